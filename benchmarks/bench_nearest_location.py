@@ -0,0 +1,154 @@
+"""
+bench_nearest_location.py
+=========================
+
+Benchmark of the nearest known location lookup on synthetic high resolution
+grids.
+
+Builds a lazy cube on a regular global grid the size of the requested model
+resolution and times 'PointLocation.find_point' and the underlying vectorised
+bounds search against the nested loop over every pair of latitude and
+longitude bounds that it replaced.
+
+Usage (from the repository root, so that 'primavera_viewer' can be imported):
+PYTHONPATH=. python benchmarks/bench_nearest_location.py [-g HM VHR4] [-n 20]
+"""
+import argparse
+import timeit
+
+import dask.array as da
+import iris.coords
+import iris.cube
+import numpy as np
+from primavera_viewer.nearest_location import (PointLocation,
+                                               find_bounds_index)
+
+# (number of latitudes, number of longitudes) of each grid
+GRIDS = {
+    'LM': (144, 192),
+    'MM': (324, 432),
+    'HM': (768, 1024),
+    'VHR4': (768, 1152),
+}
+
+
+def synthetic_cube(nlat, nlon, ntime=360, decreasing=False):
+    """
+    Creates a lazy cube on a regular global grid.
+
+    :param int nlat: Number of latitude points
+    :param int nlon: Number of longitude points
+    :param int ntime: Number of time points
+    :param bool decreasing: Order latitude from north to south
+    :return iris.cube.Cube: Cube with guessed spatial bounds
+    """
+    dlat = 180. / nlat
+    dlon = 360. / nlon
+    lats = np.linspace(-90. + dlat / 2, 90. - dlat / 2, nlat)
+    if decreasing:
+        lats = lats[::-1]
+    lons = np.linspace(0., 360. - dlon, nlon)
+    data = da.zeros((ntime, nlat, nlon), dtype=np.float32,
+                    chunks=(1, nlat, nlon))
+    cube = iris.cube.Cube(data, standard_name='air_temperature', units='K')
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.arange(ntime, dtype=np.float64), standard_name='time',
+        units='days since 1950-01-01 00:00:00'), 0)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        lats, standard_name='latitude', units='degrees'), 1)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        lons, standard_name='longitude', units='degrees'), 2)
+    cube.coord('latitude').guess_bounds()
+    cube.coord('longitude').guess_bounds()
+    return cube
+
+
+def baseline_point_index(all_lat_bounds, all_lon_bounds, lat_point,
+                         lon_point):
+    """
+    The previous nested loop search for the cell encompassing a point,
+    without the 0 degree wrapping special case.
+
+    :return tuple: The latitude and longitude indices of the cell
+    """
+    nlat = None
+    nlon = None
+    decreasing = all_lat_bounds[1, 0] < all_lat_bounds[0, 0]
+    for i, lat_bounds in enumerate(all_lat_bounds):
+        for j, lon_bounds in enumerate(all_lon_bounds):
+            if decreasing:
+                in_lat = lat_bounds[0] >= lat_point > lat_bounds[1]
+            else:
+                in_lat = lat_bounds[0] <= lat_point < lat_bounds[1]
+            if in_lat:
+                if lon_bounds[0] <= lon_point < lon_bounds[1]:
+                    nlat = i
+                    nlon = j
+            if lat_point == all_lat_bounds[-1][1]:
+                nlat = i
+            if lon_point == all_lon_bounds[-1][1]:
+                nlon = j
+    return nlat, nlon
+
+
+def parse_args():
+    """
+    Parse command-line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', '--grids', nargs='+', default=['HM', 'VHR4'],
+                        choices=sorted(GRIDS), help='grids to benchmark')
+    parser.add_argument('-n', '--number', type=int, default=20,
+                        help='number of repeats of each lookup')
+    parser.add_argument('-b', '--baseline-number', type=int, default=1,
+                        help='number of repeats of the previous nested loop '
+                             'search, which takes around a second per lookup '
+                             'on the HM and VHR4 grids (0 to skip)')
+    return parser.parse_args()
+
+
+def main(args):
+    """
+    Time the point lookups on each grid and print the results.
+    """
+    rng = np.random.RandomState(0)
+    lat_points = rng.uniform(-90., 90., 1000)
+    lon_points = rng.uniform(0., 360., 1000)
+    for grid in args.grids:
+        nlat, nlon = GRIDS[grid]
+        for decreasing in (False, True):
+            cube = synthetic_cube(nlat, nlon, decreasing=decreasing)
+            location = PointLocation(51.5, 359.9, cube)
+            point_time = timeit.timeit(location.find_point,
+                                       number=args.number) / args.number
+            lat_bounds = cube.coord('latitude').bounds
+            points_time = timeit.timeit(
+                lambda: find_bounds_index(lat_bounds, lat_points),
+                number=args.number) / args.number
+            lon_bounds = cube.coord('longitude').bounds
+            points_time += timeit.timeit(
+                lambda: find_bounds_index(lon_bounds, lon_points, 360),
+                number=args.number) / args.number
+            if args.baseline_number:
+                # a point away from 0 degrees, which the nested loop only
+                # handles as a special case
+                baseline_index = baseline_point_index(lat_bounds, lon_bounds,
+                                                      51.5, 100.3)
+                assert baseline_index == PointLocation(
+                    51.5, 100.3, cube).find_point_index()
+                baseline_time = timeit.timeit(
+                    lambda: baseline_point_index(lat_bounds, lon_bounds,
+                                                 51.5, 100.3),
+                    number=args.baseline_number) / args.baseline_number
+                baseline = '   nested loop: {:10.3f} ms ({:.0f}x)'.format(
+                    baseline_time * 1e3, baseline_time / point_time)
+            else:
+                baseline = ''
+            print('{:5s} {:4d}x{:4d} {:10s} find_point: {:8.3f} ms   '
+                  '1000 points: {:8.3f} ms{}'.format(
+                      grid, nlat, nlon,
+                      'decreasing' if decreasing else 'increasing',
+                      point_time * 1e3, points_time * 1e3, baseline))
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,325 @@
+"""
+bench_pipeline.py
+=================
+
+Benchmark of every stage of the comparison pipeline on synthetic data.
+
+Writes, or reuses, a synthetic CMIP6-like tree with 'synthetic_data.py' and
+then times each stage on its own for each simulation: loading a simulation
+lazily and loading a region of it, 'redefine_spatial_coords', 'find_point',
+'find_area', 'change_calendar', 'change_time_points' and each 'sim_statistics'
+function, followed by 'all_simulations_mean' and the whole pipeline from
+loading to statistics for a point and an area. The inputs of each stage are
+prepared before it is timed. The peak memory allocated by each stage is
+measured with 'tracemalloc' in a further, untimed run; with more than one job
+the allocations of the worker processes are not included.
+
+Results are written as JSON with the platform, package versions and settings
+of the run, and compared stage by stage with an earlier run if given.
+
+Usage (from the repository root):
+PYTHONPATH=. python benchmarks/bench_pipeline.py [-d /scratch/user/synthetic]
+[-s LM 365_day gregorian EC-Earth] [-y 1950 1952] [-n 3] [-j 1]
+[-o results.json] [-b baseline.json]
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import dask
+import iris
+import iris.cube
+import numpy as np
+from primavera_viewer import sim_statistics as stats
+from primavera_viewer import simulations_loading, simulations_output
+from primavera_viewer.nearest_location import AreaLocation, PointLocation
+from primavera_viewer.sim_format import (add_extra_time_coords,
+                                         change_calendar, change_time_points,
+                                         realise_data,
+                                         redefine_spatial_coords)
+from primavera_viewer.simulations_data import (SimulationsData,
+                                               mask_bad_data,
+                                               unify_cube_format,
+                                               unify_simulation,
+                                               unify_spatial_coordinates)
+from primavera_viewer.worker_pool import WorkerPool
+from synthetic_data import (DEFAULT_SIMULATIONS, SIMULATIONS, TIME_UNITS,
+                            simulation_request, write_tree)
+
+RESULTS_VERSION = 1
+POINT = [51.5, 359.9]
+AREA = [30., 60., -20., 20.]
+# functions of 'sim_statistics' and whether their input needs the extra time
+# coordinates
+STATISTICS = [('annual_mean', stats.annual_mean, False),
+              ('monthly_analysis', stats.monthly_analysis, False),
+              ('monthly_climatology', stats.monthly_climatology, True),
+              ('daily_anomaly', stats.daily_anomaly, False),
+              ('monthly_mean_anomaly', stats.monthly_mean_anomaly, False),
+              ('monthly_maximum_anomaly', stats.monthly_maximum_anomaly,
+               False)]
+
+
+def measure(stage, setup, number):
+    """
+    Times a stage and measures the peak memory it allocates.
+
+    :param function stage: The stage, called with the arguments returned by
+    setup
+    :param function setup: Returns a fresh tuple of the stage's arguments,
+    since stages may change their inputs
+    :param int number: Number of timed runs
+    :return dict: The time of each run and the best and median times in
+    seconds, and the peak memory allocated in bytes
+    """
+    times = []
+    for _ in range(number):
+        args = setup()
+        gc.collect()
+        start = time.perf_counter()
+        stage(*args)
+        times.append(time.perf_counter() - start)
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage(*args)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'times': times, 'best': min(times),
+            'median': statistics.median(times), 'peak_memory': peak_memory}
+
+
+def simulation_stages(load_data, simulation, years):
+    """
+    Creates the stages of a single simulation and the setup of their inputs.
+
+    :param function load_data: 'simulations_loading.load_data'
+    :param list simulation: A list in the format ['model','ensemble','variable']
+    :param array years: A two element array in the format
+    [start year, end year]
+    :return list: The name, stage and setup of each stage
+    """
+    full = load_data(simulation, years)
+    unified = unify_spatial_coordinates(full.copy())
+    point = realise_data(PointLocation(POINT[0], POINT[1],
+                                       unified.copy()).find_point())
+    region = realise_data(unify_spatial_coordinates(
+        load_data(simulation, years, AREA)))
+    formatted = mask_bad_data(unify_cube_format(region.copy(), years))
+    stages = [
+        ('load', lambda: load_data(simulation, years), lambda: ()),
+        ('load_area',
+         lambda: realise_data(load_data(simulation, years, AREA)),
+         lambda: ()),
+        ('redefine_spatial_coords', redefine_spatial_coords,
+         lambda: (full.copy(),)),
+        ('find_point',
+         lambda cube: PointLocation(POINT[0], POINT[1], cube).find_point(),
+         lambda: (unified.copy(),)),
+        ('find_area',
+         lambda cube: realise_data(AreaLocation(*AREA, cube).find_area()),
+         lambda: (region.copy(),)),
+        ('change_calendar',
+         lambda cube: change_calendar(cube, years, TIME_UNITS),
+         lambda: (point.copy(),)),
+        ('change_time_points',
+         lambda cube: change_time_points(cube, hr=12),
+         lambda: (add_extra_time_coords(
+             change_calendar(point.copy(), years, TIME_UNITS)),))]
+    for name, func, extra_coords in STATISTICS:
+        setup = (lambda: (add_extra_time_coords(formatted.copy()),)) \
+            if extra_coords else (lambda: (formatted.copy(),))
+        stages.append((name, func, setup))
+    return stages
+
+
+def pipeline(simulations_loading, simulations_output, names, years,
+             location, statistic, pool):
+    """
+    Runs the whole pipeline from loading to statistics, as the comparison
+    command does without caches.
+
+    :param module simulations_loading: 'primavera_viewer.simulations_loading'
+    :param module simulations_output: 'primavera_viewer.simulations_output'
+    :param list names: Names of the simulations in SIMULATIONS
+    :param array years: A two element array in the format
+    [start year, end year]
+    :param array location: The location constraint
+    :param str statistic: The requested statistic
+    :param WorkerPool pool: Pool of worker processes
+    :return iris.cube.CubeList: The statistics
+    """
+    requests = [simulation_request(name) for name in names]
+    simulations_inputs = simulations_loading.SimulationsLoading(
+        [requests[0][2]], [request[0] for request in requests],
+        sorted(set(request[1] for request in requests)), years, loc=location,
+        manifest={}, pool=pool)
+    simulations_list = simulations_inputs.load_all_data()
+    simulations_data = SimulationsData(simulations_list, loc=location,
+                                       t_constr=years, pool=pool)
+    unified = simulations_data.simulations_operations()
+    simulations_mean = unified.all_simulations_mean()
+    output = simulations_output.SimulationsOutput(
+        unified.simulations_list, location, simulations_mean, statistic,
+        pool=pool)
+    return output.simulations_statistics()
+
+
+def compare_results(results, baseline):
+    """
+    Compares the best time of each stage with an earlier run.
+
+    :param list results: Results of this run
+    :param dict baseline: JSON results of the earlier run
+    :return dict: The ratio of this run's best time to the earlier run's
+    keyed by stage and simulation
+    """
+    earlier = {(result['stage'], result['simulation']): result['best']
+               for result in baseline['results']}
+    ratios = {}
+    for result in results:
+        key = (result['stage'], result['simulation'])
+        if earlier.get(key):
+            ratios[key] = result['best'] / earlier[key]
+    return ratios
+
+
+def parse_args():
+    """
+    Parse command-line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--directory',
+                        help='directory of the synthetic tree, written if it '
+                             'does not exist and kept (default: a temporary '
+                             'directory)')
+    parser.add_argument('-s', '--simulations', nargs='+',
+                        default=DEFAULT_SIMULATIONS,
+                        choices=sorted(SIMULATIONS),
+                        help='simulations to benchmark (default: {})'.format(
+                            ' '.join(DEFAULT_SIMULATIONS)))
+    parser.add_argument('-y', '--years', nargs=2, type=int,
+                        default=[1950, 1952],
+                        help='first year and the year after the last year '
+                             '(default: 1950 1952)')
+    parser.add_argument('-stat', '--statistics',
+                        default='monthly_mean_anomaly_timeseries',
+                        help='statistic of the end to end runs (default: '
+                             'monthly_mean_anomaly_timeseries)')
+    parser.add_argument('-n', '--number', type=int, default=3,
+                        help='number of timed runs of each stage')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes of the end to end '
+                             'runs (default: 1)')
+    parser.add_argument('-o', '--output', default='bench_pipeline.json',
+                        help='JSON file to write the results to (default: '
+                             'bench_pipeline.json)')
+    parser.add_argument('-b', '--baseline',
+                        help='JSON results of an earlier run to compare with')
+    return parser.parse_args()
+
+
+def run(args, root):
+    """
+    Benchmark every stage on the tree and return the results.
+    """
+    write_tree(root, args.simulations, args.years)
+    # the configuration of the tree is read from the working directory, by
+    # the worker processes too
+    os.chdir(root)
+    results = []
+    for name in args.simulations:
+        simulation = simulation_request(name)
+        for stage_name, stage, setup in simulation_stages(
+                simulations_loading.load_data, simulation, args.years):
+            result = measure(stage, setup, args.number)
+            result.update(stage=stage_name, simulation=name)
+            results.append(result)
+            print('{:24} {:10} {:9.4f} s {:9.1f} MiB'.format(
+                stage_name, name, result['best'],
+                result['peak_memory'] / 2 ** 20))
+    points = [unify_simulation(
+        simulations_loading.load_data(simulation_request(name), args.years),
+        POINT, args.years) for name in args.simulations]
+    pool = WorkerPool(args.jobs)
+    stages = [('all_simulations_mean',
+               lambda cubes: SimulationsData(cubes).all_simulations_mean(),
+               lambda: (iris.cube.CubeList(cube.copy() for cube in points),))]
+    for location_name, location in [('point', POINT), ('area', AREA)]:
+        stages.append((
+            'end_to_end_' + location_name,
+            lambda location=location: pipeline(
+                simulations_loading, simulations_output, args.simulations,
+                args.years, location, args.statistics, pool),
+            lambda: ()))
+    try:
+        for stage_name, stage, setup in stages:
+            result = measure(stage, setup, args.number)
+            result.update(stage=stage_name, simulation='all')
+            results.append(result)
+            print('{:24} {:10} {:9.4f} s {:9.1f} MiB'.format(
+                stage_name, 'all', result['best'],
+                result['peak_memory'] / 2 ** 20))
+    finally:
+        pool.shutdown()
+    return results
+
+
+def main(args):
+    """
+    Run the benchmarks, write the results and compare them with the baseline.
+    """
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    cwd = os.getcwd()
+    if args.directory:
+        os.makedirs(args.directory, exist_ok=True)
+        try:
+            results = run(args, os.path.abspath(args.directory))
+        finally:
+            os.chdir(cwd)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                results = run(args, directory)
+            finally:
+                os.chdir(cwd)
+    report = {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'platform': {'machine': platform.machine(),
+                     'processor': platform.processor(),
+                     'cpu_count': os.cpu_count(),
+                     'system': platform.platform(),
+                     'python': platform.python_version()},
+        'packages': {'numpy': np.__version__, 'dask': dask.__version__,
+                     'iris': iris.__version__},
+        'settings': {'simulations': args.simulations, 'years': args.years,
+                     'statistics': args.statistics, 'number': args.number,
+                     'jobs': args.jobs, 'point': POINT, 'area': AREA},
+        'results': results}
+    with open(output, 'w') as fh:
+        json.dump(report, fh, indent=1)
+    print('Results written to {}'.format(output))
+    if baseline is not None:
+        ratios = compare_results(results, baseline)
+        print('Best time relative to {} (< 1 is faster):'.format(
+            args.baseline))
+        for (stage_name, name), ratio in ratios.items():
+            print('{:24} {:10} {:9.2f}'.format(stage_name, name, ratio))
+
+
+if __name__ == '__main__':
+    main(parse_args())
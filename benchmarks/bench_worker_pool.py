@@ -0,0 +1,145 @@
+"""
+bench_worker_pool.py
+====================
+
+Benchmark of the process start-up and inter-process communication overhead of
+the parallel stages.
+
+Runs a number of no-op stages over a list of realised cubes, first with the
+previous pattern of a new 'Manager' and one 'Process' per simulation for every
+stage, then with a single shared 'WorkerPool' that pickles the cubes' data and
+one that passes it through memory-mapped files. The stage does no work, so the
+timings are the cost of starting processes and sending cubes to and from them.
+
+Usage (from the repository root):
+PYTHONPATH=. python benchmarks/bench_worker_pool.py [-s 6] [-t 4] [-p 3650]
+[-c 100]
+"""
+import argparse
+import itertools
+import timeit
+from multiprocessing import Manager, Process
+
+import iris.coords
+import iris.cube
+import numpy as np
+from primavera_viewer.worker_pool import WorkerPool
+
+
+def synthetic_cube(label, ntime, ncell):
+    """
+    Creates a realised daily cube of one simulation over a number of cells.
+
+    :param str label: Simulation label
+    :param int ntime: Number of time points
+    :param int ncell: Number of grid cells
+    :return iris.cube.Cube: The cube
+    """
+    cube = iris.cube.Cube(np.zeros((ntime, ncell), dtype=np.float32),
+                          standard_name='air_temperature', units='K')
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.arange(ntime, dtype=np.float64) + 0.5, standard_name='time',
+        units='days since 1950-01-01 00:00:00'), 0)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.arange(ncell, dtype=np.float64), long_name='cell', units='1'), 1)
+    cube.add_aux_coord(iris.coords.AuxCoord(label,
+                                            long_name='simulation_label',
+                                            units='no_unit'))
+    return cube
+
+
+def noop_stage(cube):
+    """
+    Stage that returns its cube unchanged.
+    """
+    return cube
+
+
+def noop_queue_stage(params, output):
+    """
+    Stage in the previous queue based form, run in its own process.
+    """
+    cube = params.get()
+    if cube is not None:
+        output.append(cube)
+
+
+def manager_stages(cubes, stages):
+    """
+    Runs the stages with a new manager and a process per simulation each.
+    """
+    for _ in range(stages):
+        jobs = []
+        manager = Manager()
+        params = manager.Queue()
+        result_list = manager.list()
+        for _ in cubes:
+            p = Process(target=noop_queue_stage, args=(params, result_list))
+            jobs.append(p)
+            p.start()
+        for item in itertools.chain(cubes, (None,) * len(cubes)):
+            params.put(item)
+        for j in jobs:
+            j.join()
+        cubes = list(result_list)
+        manager.shutdown()
+    return cubes
+
+
+def pool_stages(cubes, stages, pool):
+    """
+    Runs the stages on a shared worker pool.
+    """
+    for _ in range(stages):
+        cubes = pool.map(noop_stage, cubes)
+    return cubes
+
+
+def parse_args():
+    """
+    Parse command-line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--simulations', type=int, default=6,
+                        help='number of simulations')
+    parser.add_argument('-t', '--stages', type=int, default=4,
+                        help='number of stages per run')
+    parser.add_argument('-p', '--points', type=int, default=3650,
+                        help='number of time points in each cube')
+    parser.add_argument('-c', '--cells', type=int, default=100,
+                        help='number of grid cells in each cube')
+    parser.add_argument('-n', '--number', type=int, default=3,
+                        help='number of repeats of each run')
+    return parser.parse_args()
+
+
+def main(args):
+    """
+    Time both patterns and print the results.
+    """
+    cubes = [synthetic_cube('simulation {}'.format(i), args.points,
+                            args.cells)
+             for i in range(args.simulations)]
+    manager_time = timeit.timeit(
+        lambda: manager_stages(cubes, args.stages),
+        number=args.number) / args.number
+    pool = WorkerPool(args.simulations, min_shared_bytes=None)
+    # the first run includes starting the workers
+    first_time = timeit.timeit(lambda: pool_stages(cubes, args.stages, pool),
+                               number=1)
+    pool_time = timeit.timeit(lambda: pool_stages(cubes, args.stages, pool),
+                              number=args.number) / args.number
+    pool.set_min_shared_bytes(0)
+    shared_time = timeit.timeit(lambda: pool_stages(cubes, args.stages, pool),
+                                number=args.number) / args.number
+    pool.shutdown()
+    print('{} simulations x {} stages, {} points x {} cells per cube'.format(
+        args.simulations, args.stages, args.points, args.cells))
+    print('Manager + Process per stage: {:8.3f} s'.format(manager_time))
+    print('WorkerPool, first run:       {:8.3f} s'.format(first_time))
+    print('WorkerPool, warm, pickled:   {:8.3f} s'.format(pool_time))
+    print('WorkerPool, warm, shared:    {:8.3f} s'.format(shared_time))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,282 @@
+"""
+synthetic_data.py
+=================
+
+Generator of synthetic CMIP6-like netCDF trees for the benchmarks.
+
+Writes a year of daily data per file for each simulation in a CMIP6 data
+reference syntax (DRS) directory tree, with DRS filenames and the attributes
+'primavera_viewer' reads, and an 'app_config.json' at the root of the tree
+mapping each dataset key to its directory. The simulations cover the 360_day,
+365_day and gregorian calendars, grids the size of the low, medium and high
+resolution models and the two dimensional latitude and longitude of EC-Earth.
+Data is written from lazy arrays a month at a time so that high resolution
+grids do not need to fit in memory.
+
+Usage (from the repository root):
+PYTHONPATH=. python benchmarks/synthetic_data.py /scratch/user/synthetic
+[-s LM 365_day] [-y 1950 1952]
+"""
+import argparse
+import json
+import os
+import uuid
+
+import cftime
+import dask.array as da
+import iris
+import iris.coords
+import iris.cube
+import numpy as np
+from cf_units import Unit
+
+ACTIVITY = 'HighResMIP'
+EXPERIMENT = 'highresSST-present'
+TABLE = 'day'
+VERSION = 'v20180101'
+TIME_UNITS = 'days since 1950-01-01 00:00:00'
+
+# model, ensemble member, calendar, (number of latitudes, number of
+# longitudes), grid label and whether latitude and longitude are two
+# dimensional, of each synthetic simulation by name
+SIMULATIONS = {
+    'LM': ('MOHC.HadGEM3-GC31-LM', 'r1i1p1f1', '360_day', (144, 192), 'gn',
+           False),
+    'MM': ('MOHC.HadGEM3-GC31-MM', 'r1i1p1f1', '360_day', (324, 432), 'gn',
+           False),
+    'HM': ('MOHC.HadGEM3-GC31-HM', 'r1i1p1f1', '360_day', (768, 1024), 'gn',
+           False),
+    '365_day': ('CMCC.CMCC-CM2-HR4', 'r1i1p1f1', '365_day', (192, 288), 'gn',
+                False),
+    'gregorian': ('ECMWF.ECMWF-IFS-LR', 'r1i1p1f1', 'gregorian', (181, 360),
+                  'gr', False),
+    'EC-Earth': ('EC-Earth-Consortium.EC-Earth3P', 'r1i1p1f1', 'gregorian',
+                 (256, 512), 'gr', True),
+}
+DEFAULT_SIMULATIONS = ['LM', '365_day', 'gregorian', 'EC-Earth']
+
+
+def dataset_key(model, ensemble, variable):
+    """
+    Creates a dataset key in the format of 'app_config.json'.
+
+    :param str model: Model in DRS format <institution_id>.<source_id>
+    :param str ensemble: Ensemble member in DRS format <member_id>
+    :param str variable: Variable in DRS format <variable_id>
+    :return str: The dataset key
+    """
+    return '.'.join(['CMIP6', ACTIVITY, model, EXPERIMENT, ensemble, TABLE,
+                     variable])
+
+
+def dataset_directory(root, model, ensemble, variable, grid_label):
+    """
+    Creates the DRS directory of a dataset within a tree.
+
+    :param str root: Root of the tree
+    :param str model: Model in DRS format <institution_id>.<source_id>
+    :param str ensemble: Ensemble member in DRS format <member_id>
+    :param str variable: Variable in DRS format <variable_id>
+    :param str grid_label: Grid label, e.g. 'gn'
+    :return str: Path of the directory
+    """
+    return os.path.join(root, 'CMIP6', ACTIVITY, *model.split('.'),
+                        EXPERIMENT, ensemble, TABLE, variable, grid_label,
+                        VERSION)
+
+
+def year_time_coord(year, calendar):
+    """
+    Creates the daily time coordinate of a year, each day at midday.
+
+    :param int year: The year
+    :param str calendar: Calendar of the coordinate
+    :return iris.coords.DimCoord: The time coordinate with daily bounds
+    """
+    units = Unit(TIME_UNITS, calendar=calendar)
+    start, end = units.date2num([cftime.datetime(year, 1, 1,
+                                                 calendar=calendar),
+                                 cftime.datetime(year + 1, 1, 1,
+                                                 calendar=calendar)])
+    days = np.arange(start, end, dtype=np.float64)
+    return iris.coords.DimCoord(
+        days + 0.5, standard_name='time', long_name='time', var_name='time',
+        units=units, bounds=np.column_stack([days, days + 1.]))
+
+
+def spatial_coords(nlat, nlon, curvilinear=False):
+    """
+    Creates the latitude and longitude coordinates of a global grid.
+
+    :param int nlat: Number of latitudes
+    :param int nlon: Number of longitudes
+    :param bool curvilinear: Give latitude and longitude as two dimensional
+    auxiliary coordinates on cell index dimensions, as EC-Earth does
+    :return list: Pairs of coordinates and their dimensions in the cube, the
+    time dimension being the first
+    """
+    dlat = 180. / nlat
+    dlon = 360. / nlon
+    lats = np.linspace(-90. + dlat / 2, 90. - dlat / 2, nlat)
+    lons = np.arange(nlon) * dlon + dlon / 2
+    if curvilinear:
+        lon_2d, lat_2d = np.meshgrid(lons, lats)
+        return [
+            (iris.coords.DimCoord(np.arange(nlat, dtype=np.int32),
+                                  long_name='cell index along second '
+                                            'dimension',
+                                  var_name='j', units='1'), 1),
+            (iris.coords.DimCoord(np.arange(nlon, dtype=np.int32),
+                                  long_name='cell index along first '
+                                            'dimension',
+                                  var_name='i', units='1'), 2),
+            (iris.coords.AuxCoord(lat_2d, standard_name='latitude',
+                                  var_name='latitude', units='degrees'),
+             (1, 2)),
+            (iris.coords.AuxCoord(lon_2d, standard_name='longitude',
+                                  var_name='longitude', units='degrees'),
+             (1, 2))]
+    latitude = iris.coords.DimCoord(lats, standard_name='latitude',
+                                    long_name='latitude', var_name='lat',
+                                    units='degrees')
+    longitude = iris.coords.DimCoord(lons, standard_name='longitude',
+                                     long_name='longitude', var_name='lon',
+                                     units='degrees')
+    latitude.guess_bounds()
+    longitude.guess_bounds()
+    return [(latitude, 1), (longitude, 2)]
+
+
+def synthetic_year(model, ensemble, variable, calendar, shape, year,
+                   curvilinear=False):
+    """
+    Creates a lazy cube of a year of daily data with a seasonal cycle, a
+    latitudinal gradient and noise.
+
+    :param str model: Model in DRS format <institution_id>.<source_id>
+    :param str ensemble: Ensemble member in DRS format <member_id>
+    :param str variable: Variable in DRS format <variable_id>
+    :param str calendar: Calendar of the data
+    :param tuple shape: Number of latitudes and longitudes
+    :param int year: Year of the data
+    :param bool curvilinear: Give latitude and longitude as two dimensional
+    coordinates
+    :return iris.cube.Cube: The lazy cube
+    """
+    time_coord = year_time_coord(year, calendar)
+    ntime = time_coord.shape[0]
+    nlat, nlon = shape
+    seasonal = 10. * np.sin(2. * np.pi * np.arange(ntime) / ntime)
+    gradient = 30. * np.cos(np.radians(np.linspace(-90., 90., nlat)))
+    noise = da.random.RandomState(year).standard_normal(
+        (ntime, nlat, nlon), chunks=(31, nlat, nlon))
+    data = (255. + da.from_array(seasonal[:, None, None], chunks=31) +
+            gradient[None, :, None] + 2. * noise).astype(np.float32)
+    cube = iris.cube.Cube(data, standard_name='air_temperature',
+                          long_name='Daily Maximum Near-Surface Air '
+                                    'Temperature',
+                          var_name=variable, units='K')
+    cube.add_dim_coord(time_coord, 0)
+    for coord, dims in spatial_coords(nlat, nlon, curvilinear):
+        if isinstance(coord, iris.coords.DimCoord):
+            cube.add_dim_coord(coord, dims)
+        else:
+            cube.add_aux_coord(coord, dims)
+    institution_id, source_id = model.split('.')
+    cube.attributes.globals.update(dict(
+        activity_id=ACTIVITY, experiment_id=EXPERIMENT,
+        institution_id=institution_id, source_id=source_id,
+        variant_label=ensemble, table_id=TABLE, frequency=TABLE,
+        creation_date='{}-01-01T00:00:00Z'.format(year),
+        tracking_id='hdl:21.14100/{}'.format(uuid.uuid4())))
+    return cube
+
+
+def write_simulation(root, name, years, variable='tasmax'):
+    """
+    Writes a file of daily data for each year of a synthetic simulation.
+
+    :param str root: Root of the tree
+    :param str name: Name of the simulation in SIMULATIONS
+    :param array years: A two element array in the format
+    [start year, end year], the end year excluded
+    :param str variable: Variable in DRS format <variable_id>
+    :return tuple: The dataset key and directory of the simulation
+    """
+    model, ensemble, calendar, shape, grid_label, curvilinear = \
+        SIMULATIONS[name]
+    directory = dataset_directory(root, model, ensemble, variable, grid_label)
+    os.makedirs(directory, exist_ok=True)
+    last_day = '1230' if calendar == '360_day' else '1231'
+    for year in range(*years):
+        filename = os.path.join(directory, '{}_{}_{}_{}_{}_{}_{}0101-{}{}.nc'
+                                .format(variable, TABLE, model.split('.')[1],
+                                        EXPERIMENT, ensemble, grid_label,
+                                        year, year, last_day))
+        if os.path.exists(filename):
+            continue
+        with iris.FUTURE.context(save_split_attrs=True):
+            iris.save(synthetic_year(model, ensemble, variable, calendar,
+                                     shape, year, curvilinear), filename)
+    return dataset_key(model, ensemble, variable), directory
+
+
+def write_tree(root, names=DEFAULT_SIMULATIONS, years=(1950, 1952),
+               variable='tasmax'):
+    """
+    Writes synthetic simulations and an 'app_config.json' listing them at the
+    root of a tree. Files that already exist are kept.
+
+    :param str root: Root of the tree
+    :param list names: Names of the simulations in SIMULATIONS
+    :param array years: A two element array in the format
+    [start year, end year], the end year excluded
+    :param str variable: Variable in DRS format <variable_id>
+    :return dict: The configuration of the tree's dataset directories
+    """
+    app_config = {}
+    for name in names:
+        key, directory = write_simulation(root, name, years, variable)
+        app_config[key] = {'directory': directory}
+    with open(os.path.join(root, 'app_config.json'), 'w') as fh:
+        json.dump(app_config, fh, indent=1, sort_keys=True)
+    return app_config
+
+
+def simulation_request(name, variable='tasmax'):
+    """
+    Describes a synthetic simulation as loaded by 'primavera_viewer'.
+
+    :param str name: Name of the simulation in SIMULATIONS
+    :param str variable: Variable in DRS format <variable_id>
+    :return list: A list in the format ['model','ensemble','variable']
+    """
+    model, ensemble = SIMULATIONS[name][:2]
+    return [model, ensemble, variable]
+
+
+def parse_args():
+    """
+    Parse command-line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', help='root directory of the tree')
+    parser.add_argument('-s', '--simulations', nargs='+',
+                        default=DEFAULT_SIMULATIONS,
+                        choices=sorted(SIMULATIONS),
+                        help='simulations to write (default: {})'.format(
+                            ' '.join(DEFAULT_SIMULATIONS)))
+    parser.add_argument('-y', '--years', nargs=2, type=int,
+                        default=[1950, 1952],
+                        help='first year and the year after the last year '
+                             '(default: 1950 1952)')
+    parser.add_argument('-var', '--variable', default='tasmax',
+                        help='variable name (default: tasmax)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    cmd_args = parse_args()
+    config = write_tree(cmd_args.root, cmd_args.simulations, cmd_args.years,
+                        cmd_args.variable)
+    print('Wrote {} simulations to {}'.format(len(config), cmd_args.root))
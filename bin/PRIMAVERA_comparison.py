@@ -12,13 +12,13 @@ Inputs:
 available)
 - Model names and ensemble members to compare at respective resolutions
 - Location. Either at a single point of reference or latitude longitude
-boundaries defining an area
+boundaries defining an area or a CSV/JSON file listing many points
 - Statistical analysis type
 - Output type
 
 Create a 'SimulationsLoading' class defining all of the above inputs. Use
-constrained loading to restrict time span and loads in all required data before
-concatenating. Output is a list of the cubes to be compared.
+constrained loading to restrict time span and location and loads in all required
+data before concatenating. Output is a list of the cubes to be compared.
 
 The 'SimulationsData' class unifies the simulation's cube data (spatial
 dimensions, formatting and location) in order to produce a time series
@@ -27,22 +27,52 @@ comparison.
 'SimulationsOutput' uses the simulations mean, requested statistics and output
 type to visualise finalised data for comparison.
 
+With '--batch' many requests are read from a JSON file and run in a single
+process, loading the data of requests that compare the same simulations and
+years once.
+
+With '-j' and '--max-memory' the number of worker processes and the estimated
+memory of the simulations they process at once are limited, the largest
+simulations being started first.
+
+With '--profile' the resources used by each stage, and by each simulation in
+the worker processes, are written to a JSON report, and with
+'--profile-trace' to a Chrome trace-event file.
+
+iris, matplotlib and the modules performing the comparison are imported only
+once they are needed, so that '--help', invalid arguments and requests whose
+output is cached return quickly.
+
 """
 import argparse
+import json
 import logging.config
+import os
 import sys
 
-import matplotlib
-matplotlib.use('Agg')
-from primavera_viewer.simulations_loading import *
-from primavera_viewer.simulations_data import *
-from primavera_viewer.simulations_output import *
+# plots are written to files, set before matplotlib is imported
+os.environ['MPLBACKEND'] = 'Agg'
+from primavera_viewer.footprint import parse_size
+from primavera_viewer.profiler import Profiler, profile_stage
+from primavera_viewer.grid_cache import GridCache
+from primavera_viewer.result_cache import ResultCache, comparison_request
+from primavera_viewer.series_cache import SeriesCache
+from primavera_viewer.simulations_loading import SimulationsLoading
+from primavera_viewer.worker_pool import WorkerPool
 
 DEFAULT_LOG_LEVEL = logging.WARNING
 DEFAULT_LOG_FORMAT = '%(levelname)s: %(message)s'
 
 logger = logging.getLogger(__name__)
 
+# options that can be given for each job of a batch file and their types
+BATCH_OPTIONS = {'variable': list, 'models': list, 'ensembles': list,
+                 'statistics': str, 'output_type': str, 'filename': str,
+                 'start_year': int, 'end_year': int, 'latitude_point': float,
+                 'longitude_point': float, 'latitude_min_bound': float,
+                 'latitude_max_bound': float, 'longitude_min_bound': float,
+                 'longitude_max_bound': float, 'points': str}
+
 
 def parse_args():
     """
@@ -83,16 +113,48 @@ def parse_args():
     parser.add_argument('-lonmax', '--longitude_max_bound',
                         help='input longitude max bound constraint',
                         type=float)
+    parser.add_argument('-pts', '--points',
+                        help='input CSV or JSON file listing latitude and '
+                             'longitude points (e.g. stations) to constrain '
+                             'to')
+    parser.add_argument('--cache-dir',
+                        help='optional directory for persistent caches of '
+                             'grid bounds, location indices, unified '
+                             'simulation series and completed statistics')
+    parser.add_argument('--batch',
+                        help='optional JSON file listing many requests, '
+                             'each with the options above by their long '
+                             'names. Options given on the command line are '
+                             'the defaults of every request')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='optional maximum number of worker processes '
+                             '(default: the number of CPUs)')
+    parser.add_argument('--max-memory', type=parse_size,
+                        help='optional memory budget of the worker processes, '
+                             'e.g. 16G. Simulations are started largest '
+                             'first and only while the estimated size of the '
+                             'data of those running fits within it')
+    parser.add_argument('--profile',
+                        help='optional JSON file to write the wall time, CPU '
+                             'time, peak memory, bytes read and files opened '
+                             'of each stage and simulation to')
+    parser.add_argument('--profile-trace',
+                        help='optional Chrome trace-event file to write the '
+                             'stages of each process to')
     parser.add_argument('-l', '--log-level', help='set logging level to one of '
         'debug, info, warn (the default), or error')
     args = parser.parse_args()
     return args
 
 
-def main(args):
+def request_from_args(args):
     """
-    Assign command line arguments to associated exceptions.
-    Run comparison of models/ensembles and plot data.
+    Assign command line arguments, or the options of a batch job, to
+    associated exceptions.
+
+    :param argparse.Namespace args: The options of a single request
+    :return dict: The request's variables, models, ensembles, statistics,
+    output type, time and location constraints and filename
     """
 
     if args.variable:
@@ -131,7 +193,13 @@ def main(args):
         logger.error('No time period specified')
         sys.exit()
 
-    if args.latitude_point and args.latitude_point:
+    if args.points:
+        from primavera_viewer.nearest_location import load_points
+        location_constraints = load_points(args.points)
+        if output_type in ['plot', 'both']:
+            logger.error('Plot output is not available for multiple points')
+            sys.exit()
+    elif args.latitude_point and args.latitude_point:
         location_constraints = [args.latitude_point,
                                 args.longitude_point]
     elif args.latitude_min_bound and args.latitude_max_bound and \
@@ -144,30 +212,186 @@ def main(args):
         logger.warning('No location specified. Return global average.')
         location_constraints = [-90.0, 90.0, 0.0, 360.0]
 
+
+    return {'variable': variable, 'models': models, 'ensembles': ensembles,
+            'statistics': statistics, 'output_type': output_type,
+            'time_constraints': time_constraints,
+            'location_constraints': location_constraints,
+            'filename': args.filename}
+
+
+def batch_requests(args):
+    """
+    Reads the requests of a batch file. Options given on the command line
+    are the defaults of every job.
+
+    :param argparse.Namespace args: Command line arguments
+    :return list: The requests from 'request_from_args'
+    """
+    with open(args.batch) as fh:
+        jobs = json.load(fh)
+    if isinstance(jobs, dict):
+        jobs = jobs['jobs']
+    requests = []
+    for job in jobs:
+        job_args = argparse.Namespace(**vars(args))
+        for name, value in job.items():
+            name = name.lstrip('-').replace('-', '_')
+            if name not in BATCH_OPTIONS:
+                logger.error('Unknown batch job option {}'.format(name))
+                sys.exit()
+            # convert as the command line would
+            if BATCH_OPTIONS[name] is list and isinstance(value, str):
+                value = [value]
+            elif value is not None:
+                value = BATCH_OPTIONS[name](value)
+            setattr(job_args, name, value)
+        requests.append(request_from_args(job_args))
+    return requests
+
+
+def run_request(request, filename, grid_cache=None, series_cache=None,
+                result_cache=None, pool=None, profiler=None):
+    """
+    Run comparison of models/ensembles and plot data.
+    """
+    variable = request['variable']
+    models = request['models']
+    ensembles = request['ensembles']
+    statistics = request['statistics']
+    output_type = request['output_type']
+    time_constraints = request['time_constraints']
+    location_constraints = request['location_constraints']
+
     # Create class containing details of all simulations
-    simulations_inputs = SimulationsLoading(variable, models,
-                                            ensembles, time_constraints)
-    simulations_list = simulations_inputs.load_all_data()
+    with profile_stage(profiler, 'plan'):
+        simulations_inputs = SimulationsLoading(variable, models,
+                                                ensembles, time_constraints,
+                                                loc=location_constraints,
+                                                grid_cache=grid_cache,
+                                                pool=pool,
+                                                series_cache=series_cache)
+
+    # Return the statistics of a previous identical request if the source
+    # files have not changed since
+    cache_key = None
+    if result_cache is not None:
+        with profile_stage(profiler, 'result_cache'):
+            cache_key = result_cache.request_key(
+                comparison_request(variable, models, ensembles,
+                                   time_constraints, location_constraints,
+                                   statistics),
+                simulations_inputs.source_files())
+            # the files written for the request are copied without
+            # importing iris
+            if result_cache.get_outputs(cache_key, output_type,
+                                        filename or 'primavera_comparison'):
+                logger.debug('Using cached output')
+                return
+            result_cubes = result_cache.get(cache_key)
+        if result_cubes is not None:
+            logger.debug('Using cached statistics')
+            from primavera_viewer.simulations_output import SimulationsOutput
+            output = SimulationsOutput(loc=location_constraints,
+                                       stats=statistics, out=output_type,
+                                       filename=filename, pool=pool,
+                                       result_cache=result_cache,
+                                       cache_key=cache_key)
+            with profile_stage(profiler, 'output'):
+                output.simulations_result(result_cubes)
+            return
+
+    from primavera_viewer.simulations_data import SimulationsData
+    from primavera_viewer.simulations_output import SimulationsOutput
+
+    # Only load the simulations, or the years of simulations, whose unified
+    # series are not cached
+    with profile_stage(profiler, 'load'):
+        simulations_inputs.load_cached_series()
+        simulations_list = simulations_inputs.load_all_data()
+        loaded_constraints = simulations_inputs.loaded_constraints()
 
     # Create class for simulation data at requested location
     simulations_data = SimulationsData(simulations_list,
                                        loc=location_constraints,
-                                       t_constr=time_constraints)
+                                       t_constr=time_constraints,
+                                       grid_cache=grid_cache,
+                                       pool=pool,
+                                       sim_t_constr=loaded_constraints)
 
     # Unify simulation spacial coordinate systems and constrain at location
-    simulations_data_unified = simulations_data.simulations_operations()
+    with profile_stage(profiler, 'unify'):
+        simulations_data_unified = simulations_data.simulations_operations()
+        simulations_data_unified.set_simulations_list(
+            simulations_inputs.unified_series(
+                simulations_data_unified.simulations_list))
 
-    simulations_mean = simulations_data_unified.all_simulations_mean()
+    with profile_stage(profiler, 'mean'):
+        simulations_mean = simulations_data_unified.all_simulations_mean()
 
     # Create class containing data from all simulations, the simulation mean,
     # the statical analysis requested and output type
     output = SimulationsOutput(simulations_data_unified.simulations_list,
                                simulations_data_unified.location,
                                simulations_mean, statistics, output_type,
-                               args.filename)
+                               filename, pool=pool,
+                               result_cache=result_cache,
+                               cache_key=cache_key,
+                               series_cache=series_cache,
+                               series_ids=simulations_inputs.series_ids)
 
     # Data output as requested
-    output.simulations_result()
+    with profile_stage(profiler, 'output'):
+        output.simulations_result()
+
+
+def main(args):
+    """
+    Assign command line arguments to associated exceptions.
+    Run the request, or every request of a batch file.
+    """
+
+    if args.batch:
+        requests = batch_requests(args)
+    else:
+        request = request_from_args(args)
+
+    if args.cache_dir:
+        grid_cache = GridCache(os.path.join(args.cache_dir, 'grids'))
+        series_cache = SeriesCache(os.path.join(args.cache_dir, 'series'))
+        result_cache = ResultCache(os.path.join(args.cache_dir, 'results'))
+    else:
+        grid_cache = None
+        series_cache = None
+        result_cache = None
+
+    profiler = None
+    if args.profile or args.profile_trace:
+        profiler = Profiler('PRIMAVERA_comparison')
+
+    # a single pool of workers is shared by every stage
+    pool = WorkerPool(args.jobs, profiler=profiler,
+                      max_memory=args.max_memory)
+
+    try:
+        with profile_stage(profiler, 'comparison'):
+            if args.batch:
+                from primavera_viewer.batch import run_batch
+                run_batch(requests, grid_cache=grid_cache,
+                          result_cache=result_cache, pool=pool)
+            else:
+                run_request(request, args.filename, grid_cache=grid_cache,
+                            series_cache=series_cache,
+                            result_cache=result_cache, pool=pool,
+                            profiler=profiler)
+    finally:
+        pool.shutdown()
+        if profiler is not None:
+            profiler.finish()
+            if args.profile:
+                profiler.write_report(args.profile)
+            if args.profile_trace:
+                profiler.write_trace(args.profile_trace)
 
 if __name__ == '__main__':
 
@@ -38,7 +38,8 @@ def main():
     simulation_inputs = SimulationsLoading(['tasmax'],
                                     ['MOHC.HadGEM3-GC31-LM'],
                                     ['r1i1p1f1'],
-                                    time_constraints)
+                                    time_constraints,
+                                    loc = location_point)
 
     # Load with constraints and concatenate all the required files
     simulations_list = simulation_inputs.load_all_data()
@@ -0,0 +1,118 @@
+"""
+PRIMAVERA_manifest.py
+=====================
+
+PRIMAVERA file manifest command
+
+Records, for each dataset key in a JSON configuration file, the files in its
+directory with their time ranges, calendar, units, grid shape, data type,
+modification time and size. The manifest is written as a sidecar next to the
+configuration file ('app_config.manifest.json') and is used by
+'SimulationsLoading' to plan loads without scanning every file's header.
+
+Running the command again only reads the headers of new or modified files.
+"""
+import argparse
+import json
+import logging.config
+import sys
+
+from primavera_viewer.manifest import (build_manifest, load_manifest,
+                                       manifest_filename, save_manifest)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+DEFAULT_LOG_FORMAT = '%(levelname)s: %(message)s'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """
+    Parse command-line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', default='app_config.json',
+                        help='JSON configuration file of data directories '
+                             '(default: app_config.json)')
+    parser.add_argument('-k', '--keys', nargs='+',
+                        help='optional dataset keys to update (default: all)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='read the headers of every file rather than only '
+                             'new or modified files')
+    parser.add_argument('-l', '--log-level', help='set logging level to one of '
+        'debug, info, warn (the default), or error')
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    """
+    Build or update the manifest of the configured directories.
+    """
+    try:
+        with open(args.config) as fh:
+            app_config = json.load(fh)
+    except (OSError, ValueError) as err:
+        logger.error('Unable to read configuration {}: {}'.format(args.config,
+                                                                  err))
+        sys.exit(1)
+
+    if args.keys:
+        missing = [key for key in args.keys if key not in app_config]
+        if missing:
+            logger.error('Keys not in configuration: {}'.format(
+                ', '.join(missing)))
+            sys.exit(1)
+
+    output = manifest_filename(args.config)
+    manifest = None if args.rebuild else load_manifest(output)
+    manifest = build_manifest(app_config, manifest, args.keys)
+    save_manifest(manifest, output)
+    num_files = sum(len(entry['files'])
+                    for entry in manifest['datasets'].values())
+    logger.info('Wrote manifest of {} files in {} datasets to {}'.format(
+        num_files, len(manifest['datasets']), output))
+
+
+if __name__ == '__main__':
+
+    cmd_args = parse_args()
+
+    # determine the log level
+    if cmd_args.log_level:
+        try:
+            log_level = getattr(logging, cmd_args.log_level.upper())
+        except AttributeError:
+            logger.setLevel(logging.WARNING)
+            logger.error('log-level must be one of: debug, info, warn or error')
+            sys.exit(1)
+    else:
+        log_level = DEFAULT_LOG_LEVEL
+
+    # configure the logger
+    logging.config.dictConfig({
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'standard': {
+                'format': DEFAULT_LOG_FORMAT,
+            },
+        },
+        'handlers': {
+            'default': {
+                'level': log_level,
+                'class': 'logging.StreamHandler',
+                'formatter': 'standard'
+            },
+        },
+        'loggers': {
+            '': {
+                'handlers': ['default'],
+                'level': log_level,
+                'propagate': True
+            }
+        }
+    })
+
+    # Run the code
+    main(cmd_args)
@@ -0,0 +1,125 @@
+"""
+PRIMAVERA_server.py
+===================
+
+PRIMAVERA comparison query service command
+
+Serves comparisons as a local HTTP/JSON service. Worker processes, grid
+indices, the file manifest, the series and result caches and recent results
+are kept between requests, so repeated requests are answered without loading
+any data.
+
+POST a JSON object with the options of 'PRIMAVERA_comparison.py' by their long
+names to '/compare', e.g.
+{"variable": ["tasmax"], "models": ["MOHC.HadGEM3-GC31-LM"],
+ "ensembles": ["r1i1p1f1"], "statistics": "annual_mean_timeseries",
+ "start_year": 1950, "end_year": 2000,
+ "latitude_point": 51.5, "longitude_point": 359.9}
+or query the service with 'primavera_viewer.server.ComparisonClient'.
+"""
+import argparse
+import logging.config
+import sys
+
+import matplotlib
+matplotlib.use('Agg')
+from primavera_viewer.server import (DEFAULT_CACHE_DIR, DEFAULT_PORT,
+                                     ComparisonService, make_server)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+DEFAULT_LOG_FORMAT = '%(levelname)s: %(message)s'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """
+    Parse command-line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                        help='port to listen on (default: {})'.format(
+                            DEFAULT_PORT))
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='directory for persistent caches of grid '
+                             'bounds, location indices, unified simulation '
+                             'series and completed statistics (default: '
+                             '{})'.format(DEFAULT_CACHE_DIR))
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='optional maximum number of worker processes '
+                             '(default: the number of CPUs)')
+    parser.add_argument('--max-requests', type=int, default=2,
+                        help='maximum number of requests processing data at '
+                             'once (default: 2)')
+    parser.add_argument('--max-results', type=int, default=256,
+                        help='maximum number of recent results held in '
+                             'memory (default: 256)')
+    parser.add_argument('-l', '--log-level', help='set logging level to one of '
+        'debug, info, warn (the default), or error')
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    """
+    Serve comparisons until interrupted.
+    """
+    service = ComparisonService(args.cache_dir, workers=args.jobs,
+                                max_requests=args.max_requests,
+                                max_results=args.max_results)
+    server = make_server(service, args.host, args.port)
+    logger.info('Serving comparisons on http://{}:{}'.format(
+        *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+
+    cmd_args = parse_args()
+
+    # determine the log level
+    if cmd_args.log_level:
+        try:
+            log_level = getattr(logging, cmd_args.log_level.upper())
+        except AttributeError:
+            logger.setLevel(logging.WARNING)
+            logger.error('log-level must be one of: debug, info, warn or error')
+            sys.exit(1)
+    else:
+        log_level = DEFAULT_LOG_LEVEL
+
+    # configure the logger
+    logging.config.dictConfig({
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'standard': {
+                'format': DEFAULT_LOG_FORMAT,
+            },
+        },
+        'handlers': {
+            'default': {
+                'level': log_level,
+                'class': 'logging.StreamHandler',
+                'formatter': 'standard'
+            },
+        },
+        'loggers': {
+            '': {
+                'handlers': ['default'],
+                'level': log_level,
+                'propagate': True
+            }
+        }
+    })
+
+    # Run the code
+    main(cmd_args)
@@ -0,0 +1,167 @@
+"""
+batch.py
+========
+
+Module for running many comparison requests in a single process.
+
+Requests are grouped by the variables, models, ensembles and years they
+compare so that the files of each group are planned and loaded once. Every
+location of a group is then constrained and unified once, and every statistic
+requested at that location is performed on the same unified cubes. Outputs
+are written for each request as if it had been run on its own.
+"""
+import json
+import logging
+from collections import OrderedDict
+
+import iris
+from primavera_viewer.result_cache import canonical, comparison_request
+from primavera_viewer.simulations_data import SimulationsData
+from primavera_viewer.simulations_loading import SimulationsLoading
+from primavera_viewer.simulations_output import SimulationsOutput
+from primavera_viewer.worker_pool import get_default_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILENAME = 'primavera_comparison'
+
+
+def group_key(request):
+    """
+    Creates the key of the simulations and years compared by a request.
+
+    :param dict request: A request with 'variable', 'models', 'ensembles' and
+    'time_constraints' items
+    :return str: The key
+    """
+    return json.dumps([canonical(request['variable']),
+                       canonical(request['models']),
+                       canonical(request['ensembles']),
+                       canonical(request['time_constraints'])])
+
+
+def location_key(location):
+    """
+    Creates the key of a location constraint.
+
+    :param array location: The location constraint
+    :return str: The key
+    """
+    return json.dumps(canonical(location))
+
+
+def group_requests(requests):
+    """
+    Groups requests by the simulations and years they compare and then by
+    their location, in the order the groups first appear.
+
+    :param list requests: Requests as returned by 'request_from_args'
+    :return OrderedDict: Lists of requests keyed by 'group_key' and then by
+    'location_key'
+    """
+    groups = OrderedDict()
+    for request in requests:
+        locations = groups.setdefault(group_key(request), OrderedDict())
+        locations.setdefault(location_key(request['location_constraints']),
+                             []).append(request)
+    return groups
+
+
+def cached_result(request, sources, result_cache, pool):
+    """
+    Outputs the statistics of a request from the result cache.
+
+    :param dict request: The request
+    :param dict sources: Source files of each dataset of the request's group
+    :param ResultCache result_cache: Persistent cache of completed statistics
+    :param WorkerPool pool: Pool of worker processes
+    :return str: The key of the request's statistics, or None if they were
+    found and output
+    """
+    cache_key = result_cache.request_key(
+        comparison_request(request['variable'], request['models'],
+                           request['ensembles'], request['time_constraints'],
+                           request['location_constraints'],
+                           request['statistics']), sources)
+    if result_cache.get_outputs(cache_key, request['output_type'],
+                                request['filename'] or
+                                'primavera_comparison'):
+        logger.debug('Using cached output for {}'.format(
+            request['filename']))
+        return None
+    result_cubes = result_cache.get(cache_key)
+    if result_cubes is None:
+        return cache_key
+    logger.debug('Using cached statistics for {}'.format(request['filename']))
+    output = SimulationsOutput(loc=request['location_constraints'],
+                               stats=request['statistics'],
+                               out=request['output_type'],
+                               filename=request['filename'], pool=pool,
+                               result_cache=result_cache, cache_key=cache_key)
+    output.simulations_result(result_cubes)
+    return None
+
+
+def run_batch(requests, grid_cache=None, result_cache=None, pool=None):
+    """
+    Runs every request, loading the data of each group of requests once and
+    unifying it once for each location. Requests without a filename are
+    numbered in their order in the batch.
+
+    :param list requests: Requests as returned by 'request_from_args'
+    :param GridCache grid_cache: Optional, persistent cache of grid bounds
+    and location indices
+    :param ResultCache result_cache: Optional, persistent cache of completed
+    statistics
+    :param WorkerPool pool: Optional, pool of worker processes shared by every
+    stage. The default pool is used if not given
+    """
+    pool = pool or get_default_pool()
+    requests = [dict(request, filename=request['filename'] or
+                     '{}_{}'.format(DEFAULT_FILENAME, index))
+                for index, request in enumerate(requests)]
+    groups = group_requests(requests)
+    logger.info('Running {} requests in {} groups'.format(len(requests),
+                                                          len(groups)))
+    for locations in groups.values():
+        first = next(iter(locations.values()))[0]
+        time_constraints = first['time_constraints']
+        # with a single location each file is reduced to its region as it is
+        # loaded, otherwise the whole field is loaded lazily
+        location = (first['location_constraints'] if len(locations) == 1
+                    else ([]))
+        simulations_inputs = SimulationsLoading(
+            first['variable'], first['models'], first['ensembles'],
+            time_constraints, loc=location, grid_cache=grid_cache, pool=pool)
+        pending = OrderedDict()
+        if result_cache is not None:
+            sources = simulations_inputs.source_files()
+        for key, location_requests in locations.items():
+            for request in location_requests:
+                cache_key = None
+                if result_cache is not None:
+                    cache_key = cached_result(request, sources, result_cache,
+                                              pool)
+                    if cache_key is None:
+                        continue
+                pending.setdefault(key, []).append((request, cache_key))
+        if not pending:
+            continue
+        simulations_list = simulations_inputs.load_all_data()
+        for location_requests in pending.values():
+            location = location_requests[0][0]['location_constraints']
+            simulations_data = SimulationsData(
+                iris.cube.CubeList(cube.copy() for cube in simulations_list),
+                loc=location, t_constr=time_constraints,
+                grid_cache=grid_cache, pool=pool)
+            unified = simulations_data.simulations_operations()
+            simulations_mean = unified.all_simulations_mean()
+            for request, cache_key in location_requests:
+                # statistics may change the cubes they are given
+                output = SimulationsOutput(
+                    iris.cube.CubeList(
+                        cube.copy() for cube in unified.simulations_list),
+                    location, simulations_mean.copy(), request['statistics'],
+                    request['output_type'], request['filename'], pool=pool,
+                    result_cache=result_cache, cache_key=cache_key)
+                output.simulations_result()
@@ -0,0 +1,122 @@
+"""
+file_planner.py
+===============
+
+Module for planning which files of a simulation need to be opened for a time
+constraint.
+
+CMIP6 data reference syntax (DRS) filenames end in the date range of the data
+they contain, e.g. 'tasmax_day_HadGEM3-GC31-LM_highresSST-present_r1i1p1f1_gn_
+19500101-19501230.nc'. The range is parsed from each filename so that only
+files overlapping the requested years are loaded. Files whose names do not
+follow the DRS have the first and last time points read from their header.
+"""
+import glob
+import logging
+import os
+import re
+
+from primavera_viewer.profiler import record_files_opened
+
+logger = logging.getLogger(__name__)
+
+# the date range at the end of a DRS filename in YYYY, YYYYMM, YYYYMMDD or
+# YYYYMMDDhhmm format
+DRS_DATE_RANGE = re.compile(r'_(\d{4})\d{0,8}-(\d{4})\d{0,8}\.nc$')
+
+
+def parse_year_range(filename):
+    """
+    Parses the years of the data in a file from its DRS filename.
+
+    :param str filename: Path or name of the file
+    :return tuple: The first and last year (inclusive) of data in the file or
+    None if the filename does not follow the DRS
+    """
+    match = DRS_DATE_RANGE.search(os.path.basename(filename))
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def read_year_range(filename):
+    """
+    Reads the years of the data in a file from the first and last points of
+    its time coordinate.
+
+    :param str filename: Path of the netCDF file
+    :return tuple: The first and last year (inclusive) of data in the file or
+    None if the time coordinate cannot be read
+    """
+    import cftime
+    import netCDF4
+    record_files_opened()
+    try:
+        with netCDF4.Dataset(filename) as dataset:
+            time = dataset.variables['time']
+            points = time[[0, -1]]
+            dates = cftime.num2date(points, time.units,
+                                    getattr(time, 'calendar', 'standard'))
+    except (OSError, KeyError, AttributeError, IndexError, ValueError) as err:
+        logger.warning('Unable to read time range of {}: {}'.format(filename,
+                                                                    err))
+        return None
+    return dates[0].year, dates[-1].year
+
+
+def file_year_range(filename):
+    """
+    Finds the years of the data in a file from its DRS filename, falling back
+    to its header for names that do not follow the DRS.
+
+    :param str filename: Path of the netCDF file
+    :return tuple: The first and last year (inclusive) of data in the file or
+    None if unknown
+    """
+    year_range = parse_year_range(filename)
+    if year_range is None:
+        year_range = read_year_range(filename)
+    return year_range
+
+
+def overlaps(year_range, time_constr):
+    """
+    Determines whether a file's years overlap the time constraint.
+
+    :param tuple year_range: First and last year (inclusive) of the file, or
+    None if unknown in which case the file is assumed to overlap
+    :param array time_constr: A two element array of [start year, end year]
+    where the end year is exclusive
+    :return bool: True if the file may contain data in the time constraint
+    """
+    if year_range is None:
+        return True
+    return year_range[0] < time_constr[1] and year_range[1] >= time_constr[0]
+
+
+def plan_files(directory, time_constr, year_ranges=None):
+    """
+    Lists the netCDF files in a simulation's directory that contain data within
+    the time constraint.
+
+    :param str directory: Directory containing the simulation's netCDF files
+    :param array time_constr: A two element array of [start year, end year]
+    where the end year is exclusive
+    :param dict year_ranges: Optional, year ranges of every file in the
+    directory keyed by path, e.g. from the manifest. If not given the
+    directory is listed and ranges are found from the filenames or headers
+    :return list: Sorted paths of the files to load
+    """
+    if year_ranges is None:
+        all_files = sorted(glob.glob(os.path.join(directory, '*.nc')))
+        year_ranges = {filename: file_year_range(filename)
+                       for filename in all_files}
+    else:
+        all_files = sorted(year_ranges)
+    files = []
+    for filename in all_files:
+        if overlaps(year_ranges[filename], time_constr):
+            files.append(filename)
+    logger.debug('Planned {} of {} files in {} for {}-{}'.format(
+        len(files), len(all_files), directory, time_constr[0], time_constr[1]))
+    return files
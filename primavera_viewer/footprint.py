@@ -0,0 +1,120 @@
+"""
+footprint.py
+============
+
+Module for estimating the memory needed to load each simulation, so that a
+worker pool with a memory budget only starts as many loads at once as fit.
+
+The footprint of a simulation is the size of the data it loads: the time steps
+of each planned file within the requested years, times the grid cells of the
+requested region, times the size of the data type. The shape and data type of
+each file are taken from the manifest where it records them and otherwise
+read from the file's header.
+"""
+import logging
+import math
+import re
+
+import numpy as np
+from primavera_viewer.manifest import read_file_metadata
+
+logger = logging.getLogger(__name__)
+
+# multipliers of the suffixes accepted by 'parse_size'
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+              'T': 1024 ** 4}
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*([KMGT]?)i?B?\s*$',
+                          re.IGNORECASE)
+
+
+def parse_size(text):
+    """
+    Parses a size in bytes with an optional binary suffix, e.g. '512M' or
+    '8GiB'.
+
+    :param str text: The size
+    :return int: The size in bytes
+    """
+    match = SIZE_PATTERN.match(text)
+    if not match:
+        raise ValueError('Invalid size {}'.format(text))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def year_fraction(metadata, time_constr):
+    """
+    Finds the fraction of a file's time steps within a time constraint.
+
+    :param dict metadata: The file's metadata, with its first and last year
+    if known
+    :param array time_constr: A two element array in the format
+    [start year, end year], the end year excluded
+    :return float: The fraction, or 1 if the file's years are not known
+    """
+    if 'start_year' not in metadata or 'end_year' not in metadata:
+        return 1.
+    years = metadata['end_year'] - metadata['start_year'] + 1
+    overlap = (min(metadata['end_year'] + 1, time_constr[1]) -
+               max(metadata['start_year'], time_constr[0]))
+    return min(max(overlap, 0) / years, 1.)
+
+
+def region_cells(location, spatial_shape):
+    """
+    Estimates the number of grid cells of the hyperslab loaded for a location,
+    as found by 'nearest_location.extract_region'.
+
+    :param list location: Location constraint as used by SimulationsData
+    :param list spatial_shape: Shape of the grid, latitude then longitude
+    :return int: The number of grid cells
+    """
+    ncells = int(np.prod(spatial_shape))
+    if len(spatial_shape) != 2 or not len(location):
+        return ncells
+    nlat, nlon = spatial_shape
+    if isinstance(location[0], (list, tuple, np.ndarray)):
+        # the rows and columns containing any point
+        return min(len(location), nlat) * min(len(location), nlon)
+    if len(location) == 2:
+        return 1
+    if len(location) == 4:
+        lat_span = abs(location[1] - location[0])
+        lon_span = location[3] - location[2]
+        if lon_span <= 0:
+            lon_span += 360.
+        lat_cells = min(max(math.ceil(nlat * lat_span / 180.), 1), nlat)
+        lon_cells = min(max(math.ceil(nlon * lon_span / 360.), 1), nlon)
+        return lat_cells * lon_cells
+    return ncells
+
+
+def estimate_footprint(files, time_constr, location=([]), variable=None):
+    """
+    Estimates the size of the data loaded from a simulation's files.
+
+    :param list files: The path and metadata of each planned file. Headers
+    are read for files whose metadata lacks their shape or data type
+    :param array time_constr: A two element array in the format
+    [start year, end year]
+    :param array location: Optional, location constraint
+    :param str variable: Name of the data variable in DRS format
+    <variable_id>
+    :return int: The estimated size in bytes
+    """
+    footprint = 0
+    for filename, metadata in files:
+        if 'shape' not in metadata or 'dtype' not in metadata:
+            try:
+                metadata = read_file_metadata(filename, variable)
+            except (OSError, KeyError, IndexError, ValueError) as err:
+                logger.warning('Unable to read metadata of {}: {}'.format(
+                    filename, err))
+                continue
+        shape = metadata['shape']
+        if not shape:
+            continue
+        time_steps = math.ceil(shape[0] * year_fraction(metadata,
+                                                        time_constr))
+        footprint += (time_steps * region_cells(location, shape[1:]) *
+                      np.dtype(metadata['dtype']).itemsize)
+    return footprint
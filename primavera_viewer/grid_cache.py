@@ -0,0 +1,271 @@
+"""
+grid_cache.py
+=============
+
+Persistent spatial index cache module.
+
+The grids of each model never change between runs, so the cell bounds of the
+latitude and longitude coordinates and the indices resolved for recently used
+locations are stored on disk. Each grid is keyed by a fingerprint of its
+coordinate points and bounds and held in a single '.npz' file, so indices
+resolved with bounds read from a file and with guessed bounds never collide.
+Locations within a grid and the grid files themselves are evicted least
+recently used first. Grids smaller than 'min_cells', such as the hyperslabs
+already reduced to a location, are searched quickly and are not cached.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'primavera_viewer', 'grids')
+
+
+class GridCache:
+    """
+    Class defined by a cache directory and size limits. Bounds and resolved
+    location indices for a cube's latitude and longitude coordinates are
+    retrieved with 'get_bounds' and 'get_location', and stored with
+    'set_bounds' and 'set_location'.
+
+    Example:
+    GridCache(directory = '/scratch/user/.cache/grids',
+              max_size = 256 * 1024 ** 2,
+              max_locations = 128,
+              min_cells = 4096)
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=256 * 1024 ** 2,
+                 max_locations=128, min_cells=4096):
+        """
+        Initialise the class.
+
+        :param str directory: Directory to hold the cached grids
+        :param int max_size: Maximum total size in bytes of all cached grids
+        :param int max_locations: Maximum number of locations held per grid
+        :param int min_cells: Minimum number of grid cells for a grid to be
+        cached
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_locations = max_locations
+        self.min_cells = min_cells
+        self._grids = {}
+
+    def __repr__(self):
+        return 'GridCache: {directory}, {max_size}, {max_locations}'.format(
+            directory=self.directory, max_size=self.max_size,
+            max_locations=self.max_locations)
+
+    def __str__(self):
+        return '{directory}, {max_size}, {max_locations}'.format(
+            directory=self.directory, max_size=self.max_size,
+            max_locations=self.max_locations)
+
+    def __getstate__(self):
+        # workers load grids from disk themselves rather than through a pickle
+        state = self.__dict__.copy()
+        state['_grids'] = {}
+        return state
+
+    def fingerprint(self, cube):
+        """
+        Calculates a fingerprint of a cube's latitude and longitude coordinate
+        points, bounds, names and units. A coordinate without bounds has a
+        different fingerprint to the same coordinate with bounds.
+
+        :param iris.cube.Cube cube: Cube with 'latitude' and 'longitude' coords
+        :return str: Hexadecimal fingerprint of the grid
+        """
+        digest = hashlib.sha1()
+        for lat_lon in ['latitude', 'longitude']:
+            coord = cube.coord(lat_lon)
+            for values in [coord.points, coord.bounds]:
+                if values is None:
+                    digest.update(b'no bounds')
+                    continue
+                values = np.ascontiguousarray(values, dtype=np.float64)
+                digest.update('{}:{}:{}'.format(
+                    coord.name(), coord.units, values.shape).encode('utf-8'))
+                digest.update(values.tobytes())
+        return digest.hexdigest()
+
+    def is_cached(self, cube):
+        """
+        Determines whether the cube's grid is large enough to be cached.
+
+        :param iris.cube.Cube cube: Cube with 'latitude' and 'longitude' coords
+        :return bool: True if the grid has at least 'min_cells' cells
+        """
+        return (cube.coord('latitude').shape[0] *
+                cube.coord('longitude').shape[0] >= self.min_cells)
+
+    def _path(self, grid):
+        return os.path.join(self.directory, grid + '.npz')
+
+    def _load(self, grid):
+        """
+        Returns the grid's entry from memory or from disk, or None if the grid
+        has not been cached.
+        """
+        if grid in self._grids:
+            return self._grids[grid]
+        path = self._path(grid)
+        try:
+            with np.load(path) as npz:
+                entry = {
+                    'latitude': npz['latitude'],
+                    'longitude': npz['longitude'],
+                    'locations': OrderedDict(
+                        json.loads(str(npz['locations']))),
+                }
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        self._grids[grid] = entry
+        return entry
+
+    def _save(self, grid, entry):
+        """
+        Writes the grid's entry to disk atomically and evicts the least
+        recently used grids if the cache exceeds its maximum size.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, latitude=entry['latitude'],
+                         longitude=entry['longitude'],
+                         locations=np.array(json.dumps(
+                             list(entry['locations'].items()))))
+            os.replace(tmp_path, self._path(grid))
+        except OSError as err:
+            logger.warning('Unable to write grid cache {}: {}'.format(
+                self._path(grid), err))
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used grids until the total size of the
+        cache is below its maximum size.
+        """
+        try:
+            files = [os.path.join(self.directory, name)
+                     for name in os.listdir(self.directory)
+                     if name.endswith('.npz')]
+            stats = sorted(((os.stat(path), path) for path in files),
+                           key=lambda item: item[0].st_mtime)
+        except OSError:
+            return
+        total_size = sum(stat.st_size for stat, path in stats)
+        for stat, path in stats:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= stat.st_size
+            logger.debug('Evicted grid cache {}'.format(path))
+
+    def get_bounds(self, cube, grid=None):
+        """
+        Sets the cached bounds of the cube's latitude and longitude coords
+        that do not already have bounds.
+
+        :param iris.cube.Cube cube: Cube with 'latitude' and 'longitude' coords
+        :param str grid: Optional, fingerprint of the grid before its bounds
+        were set. Calculated from the cube if not given
+        :return bool: True if the bounds were found in the cache
+        """
+        if not self.is_cached(cube):
+            return False
+        entry = self._load(grid or self.fingerprint(cube))
+        if entry is None:
+            return False
+        for lat_lon in ['latitude', 'longitude']:
+            if not cube.coord(lat_lon).has_bounds():
+                cube.coord(lat_lon).bounds = entry[lat_lon]
+        return True
+
+    def set_bounds(self, cube, grid=None):
+        """
+        Stores the bounds of the cube's latitude and longitude coords.
+
+        :param iris.cube.Cube cube: Cube with bounded 'latitude' and
+        'longitude' coords
+        :param str grid: Optional, fingerprint of the grid before its bounds
+        were set, e.g. before they were guessed. Calculated from the cube if
+        not given
+        """
+        if not self.is_cached(cube):
+            return
+        grid = grid or self.fingerprint(cube)
+        entry = self._load(grid) or {'locations': OrderedDict()}
+        for lat_lon in ['latitude', 'longitude']:
+            entry[lat_lon] = cube.coord(lat_lon).bounds
+        self._grids[grid] = entry
+        self._save(grid, entry)
+
+    def get_location(self, cube, key):
+        """
+        Returns the indices previously resolved for a location on the cube's
+        grid.
+
+        :param iris.cube.Cube cube: Cube with 'latitude' and 'longitude' coords
+        :param str key: Key describing the location
+        :return: The cached indices or None if not found
+        """
+        if not self.is_cached(cube):
+            return None
+        grid = self.fingerprint(cube)
+        entry = self._load(grid)
+        if entry is None or key not in entry['locations']:
+            return None
+        entry['locations'].move_to_end(key)
+        return entry['locations'][key]
+
+    def set_location(self, cube, key, indices):
+        """
+        Stores the indices resolved for a location on the cube's grid, evicting
+        the least recently used locations.
+
+        :param iris.cube.Cube cube: Cube with bounded 'latitude' and
+        'longitude' coords
+        :param str key: Key describing the location
+        :param list indices: JSON serialisable indices of the location
+        """
+        if not self.is_cached(cube):
+            return
+        grid = self.fingerprint(cube)
+        entry = self._load(grid)
+        if entry is None:
+            self.set_bounds(cube)
+            entry = self._load(grid)
+        entry['locations'][key] = indices
+        entry['locations'].move_to_end(key)
+        while len(entry['locations']) > self.max_locations:
+            entry['locations'].popitem(last=False)
+        self._save(grid, entry)
+
+
+def location_key(kind, *values):
+    """
+    Creates a cache key for a location from its type and coordinates.
+
+    :param str kind: Type of location, e.g. 'point', 'area' or 'points'
+    :param values: Coordinates defining the location
+    :return str: Key describing the location
+    """
+    flat = np.asarray(values, dtype=np.float64).ravel()
+    if flat.size > 8:
+        return '{}:{}'.format(kind, hashlib.sha1(flat.tobytes()).hexdigest())
+    return '{}:{}'.format(kind, ','.join(repr(float(value)) for value in flat))
@@ -0,0 +1,218 @@
+"""
+manifest.py
+===========
+
+Module for the precomputed file manifest of the directories listed in
+'app_config.json'.
+
+For each dataset key in the configuration the manifest records the files in
+its directory along with their time range, calendar, time units, grid shape,
+data type, modification time and size. The manifest is saved as a JSON sidecar
+next to the configuration file so that loads can be planned without scanning
+and parsing the headers of every file. Only files whose modification time or
+size has changed since the manifest was written are read again.
+"""
+import glob
+import json
+import logging
+import os
+import tempfile
+
+from primavera_viewer.file_planner import parse_year_range
+from primavera_viewer.profiler import record_files_opened
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'app_config.manifest.json'
+MANIFEST_VERSION = 1
+
+
+def manifest_filename(config_filename):
+    """
+    Finds the name of the manifest sidecar of a configuration file.
+
+    :param str config_filename: Path of the JSON configuration file
+    :return str: Path of the manifest next to the configuration file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(config_filename)),
+                        MANIFEST_FILENAME)
+
+
+def read_file_metadata(filename, variable):
+    """
+    Reads the metadata of a single netCDF file from its header.
+
+    :param str filename: Path of the netCDF file
+    :param str variable: Name of the data variable in DRS format
+    <variable_id>
+    :return dict: The file's time range, calendar, units, shape, dtype,
+    modification time and size
+    """
+    import cftime
+    import netCDF4
+    stat = os.stat(filename)
+    metadata = {'mtime': stat.st_mtime, 'size': stat.st_size}
+    record_files_opened()
+    with netCDF4.Dataset(filename) as dataset:
+        time = dataset.variables['time']
+        calendar = getattr(time, 'calendar', 'standard')
+        metadata['units'] = time.units
+        metadata['calendar'] = calendar
+        metadata['ntime'] = len(time)
+        if len(time):
+            dates = cftime.num2date(time[[0, -1]], time.units, calendar)
+            metadata['start'] = dates[0].isoformat()
+            metadata['end'] = dates[-1].isoformat()
+            metadata['start_year'] = dates[0].year
+            metadata['end_year'] = dates[-1].year
+        if variable in dataset.variables:
+            data = dataset.variables[variable]
+        else:
+            # fall back to the variable with the most dimensions
+            data = max(dataset.variables.values(),
+                       key=lambda var: len(var.dimensions))
+        metadata['shape'] = list(data.shape)
+        metadata['dtype'] = data.dtype.str
+    return metadata
+
+
+def is_current(metadata, filename):
+    """
+    Determines whether a file is unchanged since its metadata was recorded.
+
+    :param dict metadata: Recorded metadata of the file
+    :param str filename: Path of the file
+    :return bool: True if the file's modification time and size match
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return False
+    return (metadata.get('mtime') == stat.st_mtime and
+            metadata.get('size') == stat.st_size)
+
+
+def update_dataset(entry, directory, variable, read_headers=True):
+    """
+    Updates a dataset's manifest entry for new, modified and deleted files.
+
+    :param dict entry: The existing manifest entry for the dataset, which may
+    be empty
+    :param str directory: Directory containing the dataset's netCDF files
+    :param str variable: Name of the data variable in DRS format
+    <variable_id>
+    :param bool read_headers: Read the full metadata of new or modified files
+    from their headers. If False only the time range is recorded, parsed from
+    the filename where it follows the DRS
+    :return tuple: The updated manifest entry and the number of files that
+    were added, modified or removed
+    """
+    old_files = entry.get('files', {}) \
+        if entry.get('directory') == directory else {}
+    files = {}
+    files_updated = 0
+    for filename in sorted(glob.glob(os.path.join(directory, '*.nc'))):
+        name = os.path.basename(filename)
+        if (name in old_files and is_current(old_files[name], filename) and
+                (not read_headers or 'units' in old_files[name])):
+            files[name] = old_files[name]
+            continue
+        files_updated += 1
+        year_range = None if read_headers else parse_year_range(name)
+        if year_range is not None:
+            stat = os.stat(filename)
+            files[name] = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                           'start_year': year_range[0],
+                           'end_year': year_range[1]}
+            continue
+        try:
+            files[name] = read_file_metadata(filename, variable)
+        except (OSError, KeyError, IndexError, ValueError) as err:
+            logger.warning('Unable to read metadata of {}: {}'.format(
+                filename, err))
+            # record the file without a time range so it is always loaded
+            stat = os.stat(filename)
+            files[name] = {'mtime': stat.st_mtime, 'size': stat.st_size}
+    files_updated += len(set(old_files) - set(files))
+    return {'directory': directory, 'files': files}, files_updated
+
+
+def build_manifest(app_config, manifest=None, keys=None):
+    """
+    Builds or updates the manifest of all datasets in the configuration.
+
+    :param dict app_config: Configuration of dataset keys and directories
+    :param dict manifest: Optional, existing manifest to update
+    :param list keys: Optional, dataset keys to update. All keys are updated
+    if not given
+    :return dict: The manifest
+    """
+    if not manifest or manifest.get('version') != MANIFEST_VERSION:
+        manifest = {'version': MANIFEST_VERSION, 'datasets': {}}
+    for key in keys or sorted(app_config):
+        directory = app_config[key]['directory']
+        entry, files_updated = update_dataset(
+            manifest['datasets'].get(key, {}), directory, key.split('.')[-1])
+        manifest['datasets'][key] = entry
+        logger.debug('Updated {} of {} files for {}'.format(
+            files_updated, len(entry['files']), key))
+    return manifest
+
+
+def load_manifest(filename):
+    """
+    Loads a manifest from its JSON file.
+
+    :param str filename: Path of the manifest
+    :return dict: The manifest or None if it does not exist or is invalid
+    """
+    try:
+        with open(filename) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        logger.warning('Ignoring manifest {} with a different version'.format(
+            filename))
+        return None
+    return manifest
+
+
+def save_manifest(manifest, filename):
+    """
+    Saves a manifest to its JSON file atomically.
+
+    :param dict manifest: The manifest
+    :param str filename: Path of the manifest
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(tmp_path, filename)
+
+
+def dataset_files(manifest, key, directory):
+    """
+    Re-validates a dataset's manifest entry and lists its files' metadata.
+    Only files that are new or whose modification time or size changed are
+    updated, with their time range parsed from their DRS filename. Headers are
+    read only for changed files whose names do not follow the DRS.
+
+    :param dict manifest: The manifest, updated in place
+    :param str key: Dataset key in DRS format
+    :param str directory: Directory containing the dataset's netCDF files
+    :return tuple: Metadata of each file keyed by its path, or None if the
+    manifest does not list the dataset, and the number of files updated
+    """
+    if key not in manifest['datasets']:
+        return None, 0
+    entry, files_updated = update_dataset(
+        manifest['datasets'][key], directory, key.split('.')[-1],
+        read_headers=False)
+    manifest['datasets'][key] = entry
+    if files_updated:
+        logger.info('Re-validated {} changed files for {}'.format(
+            files_updated, key))
+    return ({os.path.join(directory, name): metadata
+             for name, metadata in entry['files'].items()}, files_updated)
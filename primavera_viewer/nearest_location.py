@@ -9,14 +9,363 @@ Nearest known location module.
 Creates a class defined by latitudes and a longitudes and a simulation that
 finds the nearest known location in the given model and, if latitude and
 longitude bounds are specified, defines the region to be averaged over for
-location analysis.
+location analysis. Lists of points, such as stations, are handled together by
+a single class.
 """
+import csv
+import json
 import iris
+import iris.analysis
+import iris.coords
+import iris.cube
 import logging
+import dask.array as da
+import numpy as np
+from primavera_viewer.grid_cache import location_key
 
 logger = logging.getLogger(__name__)
 
 
+def is_decreasing(bounds):
+    """
+    Determine the direction of a coordinate from its bounds.
+
+    :param np.array bounds: An (n, 2) array of coordinate cell bounds
+    :return bool: True if the coordinate cells are monotonically decreasing
+    """
+    if len(bounds) > 1:
+        return bounds[1, 0] < bounds[0, 0]
+    # a single cell has no neighbour so use the order of its own bounds
+    return bounds[0, 1] < bounds[0, 0]
+
+
+def find_bounds_index(bounds, points, modulus=None):
+    """
+    Vectorised search for the cells whose bounds encompass each input point.
+
+    A point matches a cell if lower <= point < upper for an increasing
+    coordinate (lower >= point > upper for a decreasing coordinate). A point
+    equal to the outer edge of the final cell is assigned to that cell. If a
+    modulus is given (360 for longitude) points not found directly are wrapped
+    into the range spanned by the bounds and searched again.
+
+    :param np.array bounds: An (n, 2) array of contiguous coordinate bounds
+    :param points: A single point or an array of points to search for
+    :param float modulus: Optional modulus of a circular coordinate
+    :return np.array: Index of the matching cell for each point, -1 where no
+    cell encompasses the point
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    points = np.atleast_1d(np.asarray(points, dtype=np.float64))
+    lower = bounds[:, 0]
+    upper = bounds[:, 1]
+    decreasing = is_decreasing(bounds)
+    if decreasing:
+        # negate the decreasing coordinate so that a single increasing search
+        # can be used for both directions
+        lower = -lower
+        upper = -upper
+        search_points = -points
+    else:
+        search_points = points
+
+    def _search(values):
+        index = np.searchsorted(lower, values, side='right') - 1
+        clipped = np.clip(index, 0, len(lower) - 1)
+        found = (index >= 0) & (values < upper[clipped])
+        # allow points to match the max upper bound
+        found_edge = ~found & (values == upper[-1])
+        clipped[found_edge] = len(lower) - 1
+        return np.where(found | found_edge, clipped, -1)
+
+    index = _search(search_points)
+    if modulus is not None and np.any(index < 0):
+        # handle the special case of bounds wrapping the modulus
+        origin = lower[0]
+        missing = index < 0
+        wrapped = (search_points[missing] - origin) % modulus + origin
+        index[missing] = _search(wrapped)
+    return index
+
+
+def find_bounds_range(bounds, min_point, max_point, modulus=None):
+    """
+    Vectorised range search for the cells intersecting the region between two
+    points. A region extending beyond the coordinate selects only the cells it
+    covers, so global requests select the whole coordinate. If a modulus is
+    given (360 for longitude) the region is taken modulo the modulus, so
+    [-20, 20] and [340, 20] both select the cells either side of 0 degrees and
+    a region spanning the whole modulus selects every cell.
+
+    :param np.array bounds: An (n, 2) array of contiguous coordinate bounds
+    :param float min_point: Minimum boundary of the region
+    :param float max_point: Maximum boundary of the region
+    :param float modulus: Optional modulus of a circular coordinate
+    :return: A slice selecting all cells within the region or, if the region
+    crosses the end of a circular coordinate, an array of the cell indices in
+    order from the minimum boundary
+    :raises ValueError: If no cell lies within the region
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    lower = bounds.min(axis=1)
+    upper = bounds.max(axis=1)
+    if modulus is None:
+        min_point, max_point = sorted([min_point, max_point])
+        inside = (lower <= max_point) & (upper > min_point)
+        if not inside.any() and max_point == upper.max():
+            # allow the region to match the max upper bound
+            inside = upper == max_point
+    else:
+        width = max_point - min_point
+        if width < 0:
+            width %= modulus
+        if width >= modulus:
+            inside = np.ones(len(bounds), dtype=bool)
+        else:
+            # distance of each cell's lower bound from the minimum boundary
+            # going around the circular coordinate
+            offset = (lower - min_point) % modulus
+            inside = (offset <= width) | (offset + upper - lower > modulus)
+    index = np.flatnonzero(inside)
+    if index.size == 0:
+        raise ValueError('Region {} to {} does not intersect the coordinate '
+                         'bounds {} to {}'.format(min_point, max_point,
+                                                  lower.min(), upper.max()))
+    gaps = np.flatnonzero(np.diff(index) > 1)
+    if gaps.size == 0:
+        return slice(int(index[0]), int(index[-1]) + 1)
+    # the region wraps around the end of the coordinate so start from the
+    # cells after the gap
+    return np.roll(index, -(gaps[0] + 1))
+
+
+def subset_region(cube, lat_index, lon_index):
+    """
+    Subsets a cube's latitude and longitude dimensions. If the longitude cells
+    wrap around the end of the coordinate, e.g. 340 to 20 degrees on a 0 to
+    360 degree grid, the points before the wrap are shifted by 360 degrees so
+    that longitude remains a monotonic dimension coordinate.
+
+    :param iris.cube.Cube cube: Cube with 1D 'latitude' and 'longitude' coords
+    :param lat_index: Slice or array of latitude indices
+    :param lon_index: Slice or array of longitude indices
+    :return iris.cube.Cube: The subset of the cube
+    """
+    lat_dim, = cube.coord_dims('latitude')
+    lon_dim, = cube.coord_dims('longitude')
+    keys = [slice(None)] * cube.ndim
+    keys[lat_dim] = lat_index
+    cube = cube[tuple(keys)]
+    keys = [slice(None)] * cube.ndim
+    keys[lon_dim] = lon_index
+    cube = cube[tuple(keys)]
+    coord = cube.coord('longitude')
+    if isinstance(coord, iris.coords.DimCoord) or coord.shape[0] < 2:
+        return cube
+    points = coord.points.astype(np.float64)
+    wrap = np.flatnonzero(np.diff(points) < 0)
+    if wrap.size:
+        shift = np.zeros(points.shape)
+        shift[:wrap[0] + 1] = -360.
+        bounds = None
+        if coord.has_bounds():
+            bounds = coord.bounds + shift[:, np.newaxis]
+        coord = coord.copy(points + shift, bounds)
+    cube.remove_coord('longitude')
+    cube.add_dim_coord(iris.coords.DimCoord.from_coord(coord), lon_dim)
+    return cube
+
+
+def index_to_json(index):
+    """
+    Converts a slice or array of indices to a JSON serialisable form.
+
+    :param index: Slice or array of indices
+    :return: A [start, stop] list for a slice or a list of the indices
+    """
+    if isinstance(index, slice):
+        return [int(index.start), int(index.stop)]
+    return {'index': [int(i) for i in index]}
+
+
+def index_from_json(value):
+    """
+    Converts the JSON form of 'index_to_json' back to a slice or array.
+
+    :param value: The JSON form of the indices
+    :return: Slice or array of indices
+    """
+    if isinstance(value, dict):
+        return np.array(value['index'], dtype=np.intp)
+    return slice(*value)
+
+
+def cell_area_weights(lat_bounds, lon_bounds):
+    """
+    Relative area of each grid cell on the sphere calculated from the cell
+    bounds, i.e. the difference of the sine of the latitude bounds multiplied
+    by the width of the longitude bounds.
+
+    :param np.array lat_bounds: An (nlat, 2) array of latitude bounds
+    :param np.array lon_bounds: An (nlon, 2) array of longitude bounds
+    :return np.array: An (nlat, nlon) array of cell area weights
+    """
+    lat_bounds = np.deg2rad(np.asarray(lat_bounds, dtype=np.float64))
+    lat_weights = np.abs(np.sin(lat_bounds[:, 1]) - np.sin(lat_bounds[:, 0]))
+    lon_weights = np.abs(np.diff(np.asarray(lon_bounds, dtype=np.float64),
+                                 axis=1))[:, 0]
+    return np.outer(lat_weights, lon_weights)
+
+
+def set_spatial_bounds(cube, cache=None):
+    """
+    Ensures the cube's latitude and longitude coordinates have bounds. Bounds
+    are restored from the grid cache if available, otherwise they are guessed
+    and stored in the cache.
+
+    :param iris.cube.Cube cube: Cube with 'latitude' and 'longitude' coords
+    :param GridCache cache: Optional, cache of grid bounds and indices
+    """
+    if all(cube.coord(lat_lon).has_bounds()
+           for lat_lon in ['latitude', 'longitude']):
+        return
+    grid = None
+    if cache is not None:
+        # key the bounds by the grid before any are guessed
+        grid = cache.fingerprint(cube)
+        if cache.get_bounds(cube, grid):
+            return
+    for lat_lon in ['latitude', 'longitude']:
+        if not cube.coord(lat_lon).has_bounds():
+            cube.coord(lat_lon).guess_bounds()
+    if cache is not None:
+        cache.set_bounds(cube, grid)
+
+
+def get_cached_location(cube, key, cache=None):
+    """
+    Returns the indices of a location previously resolved on the cube's grid.
+
+    :param iris.cube.Cube cube: Cube with 'latitude' and 'longitude' coords
+    :param str key: Key describing the location
+    :param GridCache cache: Optional, cache of grid bounds and indices
+    :return: The cached indices or None if not cached
+    """
+    if cache is None:
+        return None
+    return cache.get_location(cube, key)
+
+
+def set_cached_location(cube, key, indices, cache=None):
+    """
+    Stores the indices of a location resolved on the cube's grid.
+
+    :param iris.cube.Cube cube: Cube with 'latitude' and 'longitude' coords
+    :param str key: Key describing the location
+    :param list indices: JSON serialisable indices of the location
+    :param GridCache cache: Optional, cache of grid bounds and indices
+    """
+    if cache is not None:
+        cache.set_location(cube, key, indices)
+
+
+def contiguous_index(index):
+    """
+    Converts sorted indices to a slice if they are contiguous.
+
+    :param np.array index: Sorted array of indices
+    :return: A slice if the indices are contiguous, otherwise the array
+    """
+    if index[-1] - index[0] + 1 == len(index):
+        return slice(int(index[0]), int(index[-1]) + 1)
+    return index
+
+
+def extract_region(cube, location, cache=None):
+    """
+    Extracts the smallest hyperslab of a cube containing the requested
+    location, keeping the latitude and longitude dimensions. A point gives a
+    single grid cell and an area all the cells within its boundaries. A list
+    of points gives the rows and columns containing the cell of any point,
+    rather than the box bounding them all, so scattered stations read an
+    (nstation, nstation) grid at most rather than most of the globe. Cells
+    where a row and column of different stations cross are still read.
+    Subsetting each file before concatenation means only the required chunks
+    are ever read.
+
+    :param iris.cube.Cube cube: A single cube with 1D 'latitude' and
+    'longitude' (or 'grid_latitude' and 'grid_longitude') coords
+    :param list location: Location constraint as used by SimulationsData
+    :param GridCache cache: Optional, cache of grid bounds and indices
+    :return iris.cube.Cube: The spatial hyperslab of the cube
+    """
+    if is_multi_point(location):
+        nlat, nlon = MultiPointLocation(
+            [point[0] for point in location], [point[1] for point in location],
+            cube, cache=cache).find_point_indices()
+        lat_slice = contiguous_index(np.unique(nlat))
+        lon_slice = contiguous_index(np.unique(nlon))
+    elif len(location) == 2:
+        nlat, nlon = PointLocation(location[0], location[1], cube,
+                                   cache=cache).find_point_index()
+        lat_slice = slice(nlat, nlat + 1)
+        lon_slice = slice(nlon, nlon + 1)
+    elif len(location) == 4:
+        lat_slice, lon_slice = AreaLocation(location[0], location[1],
+                                            location[2], location[3], cube,
+                                            cache=cache).find_area_slices()
+    else:
+        return cube
+    return subset_region(cube, lat_slice, lon_slice)
+
+
+def is_multi_point(location):
+    """
+    Determine whether a location is a list of [lat, lon] points rather than a
+    single point [lat, lon] or an area [lat_min, lat_max, lon_min, lon_max].
+
+    :param list location: Location constraint
+    :return bool: True if the location is a list of points
+    """
+    return (len(location) > 0 and
+            isinstance(location[0], (list, tuple, np.ndarray)))
+
+
+def load_points(filename):
+    """
+    Reads a list of points (e.g. stations) from a CSV or JSON file. A CSV file
+    must have a header row with 'latitude' (or 'lat') and 'longitude' (or
+    'lon') columns and an optional 'name' column. A JSON file must contain a
+    list of objects with the same keys, or a list of [lat, lon] pairs.
+
+    :param str filename: Path to the .csv or .json file
+    :return list: A list of [lat, lon] or [lat, lon, name] points
+    """
+    if filename.endswith('.json'):
+        with open(filename) as fh:
+            rows = json.load(fh)
+    else:
+        with open(filename, newline='') as fh:
+            rows = list(csv.DictReader(fh))
+    points = []
+    for row in rows:
+        if isinstance(row, dict):
+            row = {key.strip().lower(): value for key, value in row.items()}
+            point = [float(row.get('latitude', row.get('lat'))),
+                     float(row.get('longitude', row.get('lon')))]
+            if row.get('name') is not None:
+                point.append(str(row['name']))
+        else:
+            point = [float(row[0]), float(row[1])]
+        points.append(point)
+    if not points:
+        msg = 'No points found in {}'.format(filename)
+        logger.error(msg)
+        raise ValueError(msg)
+    return points
+
+
+
 class PointLocation:
     """
     Class defined by a latitude point, a longitude point and a single cube
@@ -26,7 +375,7 @@ class PointLocation:
     The result is a cube sub-setted at the nearest location to the input point.
     """
 
-    def __init__(self, lat, lon, cube=iris.cube.Cube):
+    def __init__(self, lat, lon, cube=iris.cube.Cube, cache=None):
         """
         Initialise the class.
 
@@ -34,10 +383,12 @@ class PointLocation:
         :param float lon: Longitude point to constrain nearest known location to
         :param iris.cube.Cube cube: A single cube from one simulation
         constrained only in time
+        :param GridCache cache: Optional, cache of grid bounds and indices
         """
         self.latitude = lat
         self.longitude = lon
         self.cube = cube
+        self.cache = cache
 
     def set_latitude(self, lat):
         self.latitude = lat
@@ -48,6 +399,9 @@ class PointLocation:
     def set_cube(self, cube):
         self.cube = cube
 
+    def set_cache(self, cache):
+        self.cache = cache
+
     def rename_latitude(self):
         """
         Rename the latitude coordinate of the input cube to the unified format
@@ -76,100 +430,219 @@ class PointLocation:
         return "{latitude}, {longitude}, {cube}".format(
             latitude=self.latitude, longitude=self.longitude, cube=self.cube)
 
-    def find_point(self):
+    def find_point_index(self):
         """
         Based on the the input latitude/longitude point coordinate, finds the
-        nearest neighbouring point int the specified cube's coordinate system.
-        Function iterates through spatial coordinate bounds to find which bounds
-        encompass the input point. The spatial coordinate associated with these
-        bounds is assigned as the nearest known point.
-        :return: The original cube sub-setted at the this nearest location point
+        index of the nearest neighbouring point in the specified cube's
+        coordinate system. The bounds of each spatial coordinate are binary
+        searched to find which bounds encompass the input point.
+        :return tuple: The latitude and longitude index of the nearest point
         """
         lat_point = self.latitude    # define chosen latitude point from input
         lon_point = self.longitude   # define chosen longitude point from input
         self.rename_latitude()
         self.rename_longitude()
-        
-        for lat_lon in ['latitude', 'longitude']:
-            if not self.cube.coord(lat_lon).has_bounds():
-                self.cube.coord(lat_lon).guess_bounds()
+
+        set_spatial_bounds(self.cube, self.cache)
+
+        key = location_key('point', lat_point, lon_point)
+        indices = get_cached_location(self.cube, key, self.cache)
+        if indices is not None:
+            return indices[0], indices[1]
 
         all_lat_bounds = self.cube.coord('latitude').bounds
         all_lon_bounds = self.cube.coord('longitude').bounds
-        nlat = None
-        nlon = None
-
-        if ((all_lat_bounds[1, 0] > all_lat_bounds[0, 0]) and
-                (all_lon_bounds[1, 0] > all_lon_bounds[0, 0])):
-            # monotonically increasing
-            # Iterate through each 2D array of the lower and upper bounds
-            for i, lat_bounds in enumerate(all_lat_bounds):
-                for j, lon_bounds in enumerate(all_lon_bounds):
-                    # Point must be smaller than max upper bound
-                    if lat_bounds[0] <= lat_point < lat_bounds[1]:
-                        if lon_bounds[0] <= lon_point < lon_bounds[1]:
-                            nlat = i
-                            nlon = j
-                        else:
-                            pass
-                    else:
-                        pass
-                    # Additional statements allowing points to match max upper bound
-                    if lat_point == all_lat_bounds[-1][1]:
-                        nlat = i
-                    if lon_point == all_lon_bounds[-1][1]:
-                        nlon = j
-            # handle the special case of bounds wrapping 0 degrees longitude
-            if nlon is None:
-                if (all_lon_bounds[0][0] <=
-                        360 - lon_point <
-                        all_lon_bounds[0][1]):
-                    nlon = 0
-                    for i, lat_bounds in enumerate(all_lat_bounds):
-                        if lat_bounds[0] <= lat_point < lat_bounds[1]:
-                            nlat = i
-        elif ((all_lat_bounds[1, 0] < all_lat_bounds[0, 0]) and
-                (all_lon_bounds[1, 0] > all_lon_bounds[0, 0])):
-            # monotonically decreasing lat and increasing lon
-            # Iterate through each 2D array of the lower and upper bounds
-            for i, lat_bounds in enumerate(all_lat_bounds):
-                for j, lon_bounds in enumerate(all_lon_bounds):
-                    # Point must be smaller than max upper bound
-                    if lat_bounds[0] >= lat_point > lat_bounds[1]:
-                        if lon_bounds[0] <= lon_point < lon_bounds[1]:
-                            nlat = i
-                            nlon = j
-                        else:
-                            pass
-                    else:
-                        pass
-                    # Additional statements allowing points to match max upper bound
-                    if lat_point == all_lat_bounds[-1][1]:
-                        nlat = i
-                    if lon_point == all_lon_bounds[-1][1]:
-                        nlon = j
-            # handle the special case of bounds wrapping 0 degrees longitude
-            if nlon is None:
-                if (all_lon_bounds[0][0] <=
-                        360 - lon_point <
-                        all_lon_bounds[0][1]):
-                    nlon = 0
-                    for i, lat_bounds in enumerate(all_lat_bounds):
-                        if lat_bounds[0] >= lat_point > lat_bounds[1]:
-                            nlat = i
-        else:
+
+        if is_decreasing(all_lon_bounds):
             raise NotImplementedError('Direction of latitude and longitude '
                                       'has not been implemented yet.')
 
-        if nlat is None or nlon is None:
+        nlat = int(find_bounds_index(all_lat_bounds, lat_point)[0])
+        nlon = int(find_bounds_index(all_lon_bounds, lon_point,
+                                     modulus=360)[0])
+
+        if nlat < 0 or nlon < 0:
             msg = 'Latitude or longitude point not found for {}'.format(
                 self.cube.summary(shorten=True)
             )
             logger.error(msg)
             raise ValueError(msg)
 
+        set_cached_location(self.cube, key, [nlat, nlon], self.cache)
+        return nlat, nlon
+
+    def find_point(self):
+        """
+        Based on the the input latitude/longitude point coordinate, finds the
+        nearest neighbouring point int the specified cube's coordinate system.
+        The spatial coordinate associated with the bounds encompassing the
+        point is assigned as the nearest known point.
+        :return: The original cube sub-setted at the this nearest location point
+        """
+        nlat, nlon = self.find_point_index()
         return self.cube[:, nlat, nlon]
 
+
+class MultiPointLocation:
+    """
+    Class defined by lists of latitude and longitude points (e.g. a list of
+    stations) and a single cube constrained only in time from the simulations
+    data set. The nearest known neighbour of every point is found in a single
+    vectorised search using 'find_points'.
+    The result is a cube with a time and a station dimension holding the
+    time series at the nearest location to each input point.
+    """
+
+    def __init__(self, lats, lons, cube=iris.cube.Cube, names=None,
+                 cache=None):
+        """
+        Initialise the class.
+
+        :param list lats: Latitude points to constrain nearest known locations
+        to
+        :param list lons: Longitude points to constrain nearest known
+        locations to
+        :param iris.cube.Cube cube: A single cube from one simulation
+        constrained only in time
+        :param list names: Optional, names of each point
+        :param GridCache cache: Optional, cache of grid bounds and indices
+        """
+        self.latitudes = np.asarray(lats, dtype=np.float64)
+        self.longitudes = np.asarray(lons, dtype=np.float64)
+        self.cube = cube
+        self.names = names
+        self.cache = cache
+
+    def set_latitudes(self, lats):
+        self.latitudes = np.asarray(lats, dtype=np.float64)
+
+    def set_longitudes(self, lons):
+        self.longitudes = np.asarray(lons, dtype=np.float64)
+
+    def set_cube(self, cube):
+        self.cube = cube
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def set_names(self, names):
+        self.names = names
+
+    def rename_latitude(self):
+        """
+        Rename the latitude coordinate of the input cube to the unified format
+        required to merge all simulations and perform statistics
+        """
+        try:
+            self.cube.coord('grid_latitude').rename('latitude')
+        except:
+            pass
+
+    def rename_longitude(self):
+        """
+        Rename the longitude coordinate of the input cube to the unified format
+        required to merge all simulations and perform statistics
+        """
+        try:
+            self.cube.coord('grid_longitude').rename('longitude')
+        except:
+            pass
+
+    def __repr__(self):
+        return "MultiPointLocation: {latitudes}, {longitudes}, {cube}".format(
+            latitudes=self.latitudes, longitudes=self.longitudes,
+            cube=self.cube)
+
+    def __str__(self):
+        return "{latitudes}, {longitudes}, {cube}".format(
+            latitudes=self.latitudes, longitudes=self.longitudes,
+            cube=self.cube)
+
+    def find_point_indices(self):
+        """
+        Finds the index of the nearest neighbouring point in the cube's
+        coordinate system for every input latitude/longitude point with one
+        vectorised search of the spatial coordinate bounds.
+        :return tuple: Arrays of the latitude and longitude index of each
+        nearest point
+        """
+        self.rename_latitude()
+        self.rename_longitude()
+
+        set_spatial_bounds(self.cube, self.cache)
+
+        key = location_key('points', self.latitudes, self.longitudes)
+        indices = get_cached_location(self.cube, key, self.cache)
+        if indices is not None:
+            return tuple(np.array(indices, dtype=np.intp))
+
+        lat_bounds = self.cube.coord('latitude').bounds
+        lon_bounds = self.cube.coord('longitude').bounds
+        if is_decreasing(lon_bounds):
+            raise NotImplementedError('Direction of latitude and longitude '
+                                      'has not been implemented yet.')
+
+        nlat = find_bounds_index(lat_bounds, self.latitudes)
+        nlon = find_bounds_index(lon_bounds, self.longitudes, modulus=360)
+
+        not_found = (nlat < 0) | (nlon < 0)
+        if np.any(not_found):
+            msg = 'Latitude or longitude points {} not found for {}'.format(
+                list(zip(self.latitudes[not_found],
+                         self.longitudes[not_found])),
+                self.cube.summary(shorten=True)
+            )
+            logger.error(msg)
+            raise ValueError(msg)
+
+        set_cached_location(self.cube, key, [nlat.tolist(), nlon.tolist()],
+                            self.cache)
+        return nlat, nlon
+
+    def find_points(self):
+        """
+        Finds the nearest neighbouring point in the cube's coordinate system
+        for every input latitude/longitude point. All time series are then
+        taken from the lazy data in a single indexing operation, so each chunk
+        of the source data is only read once however many points are
+        requested.
+        :return: A cube with dimensions of time and station sub-setted at the
+        nearest location to each point
+        """
+        nlat, nlon = self.find_point_indices()
+        lat_coord = self.cube.coord('latitude')
+        lon_coord = self.cube.coord('longitude')
+
+        data = self.cube.lazy_data().vindex[:, nlat, nlon].T
+        template = self.cube[:, 0, 0]
+        station_cube = iris.cube.Cube(data,
+                                      standard_name=template.standard_name,
+                                      long_name=template.long_name,
+                                      var_name=template.var_name,
+                                      units=template.units,
+                                      attributes=template.attributes,
+                                      cell_methods=template.cell_methods)
+        for coord in template.dim_coords:
+            station_cube.add_dim_coord(coord.copy(),
+                                       template.coord_dims(coord))
+        for coord in template.aux_coords:
+            if coord.name() not in ['latitude', 'longitude']:
+                station_cube.add_aux_coord(coord.copy(),
+                                           template.coord_dims(coord))
+        station_cube.add_dim_coord(iris.coords.DimCoord(
+            np.arange(len(nlat), dtype=np.int32), long_name='station',
+            units='1'), 1)
+        if self.names is not None:
+            station_cube.add_aux_coord(iris.coords.AuxCoord(
+                np.asarray(self.names, dtype=str), long_name='station_name',
+                units='no_unit'), 1)
+        station_cube.add_aux_coord(
+            iris.coords.AuxCoord.from_coord(lat_coord)[nlat], 1)
+        station_cube.add_aux_coord(
+            iris.coords.AuxCoord.from_coord(lon_coord)[nlon], 1)
+        return station_cube
+
+
 class AreaLocation:
     """
     Class defined by latitude minimum and maximum limits, longitude minimum and
@@ -179,7 +652,8 @@ class AreaLocation:
     cube's spatial coordinates, subsets all relevant data points and
     produces an area average of the region defined by the limits.
     """
-    def __init__(self, lat_min, lat_max, lon_min, lon_max, cube=iris.cube.Cube):
+    def __init__(self, lat_min, lat_max, lon_min, lon_max, cube=iris.cube.Cube,
+                 cache=None):
         """
         Initialise the class.
 
@@ -189,12 +663,14 @@ class AreaLocation:
         :param float lon_max: Maximum longitude boundary to constrain points to
         :param iris.cube.Cube cube: A single cube from one simulation
         constrained only in time
+        :param GridCache cache: Optional, cache of grid bounds and indices
         """
         self.latitude_min = lat_min
         self.latitude_max = lat_max
         self.longitude_min = lon_min
         self.longitude_max = lon_max
         self.cube = cube
+        self.cache = cache
 
     def set_lat_min(self, lat_min):
         self.latitude_min = lat_min
@@ -211,6 +687,9 @@ class AreaLocation:
     def set_cube(self, cube):
         self.cube = cube
 
+    def set_cache(self, cache):
+        self.cache = cache
+
     def rename_latitude(self):
         """
         Rename the latitude coordinate of the input cube to the unified format
@@ -245,59 +724,56 @@ class AreaLocation:
             longitude_min=self.longitude_min, longitude_max=self.longitude_max,
             cube=self.cube)
 
+    def find_area_slices(self):
+        """
+        Finds the range of points in the cube's coordinate system that lie
+        within the latitude and longitude min/max boundaries using a vectorised
+        range search of the spatial coordinate bounds.
+        :return tuple: The latitude and longitude slices of the region. The
+        longitude is an array of indices if the region crosses the end of
+        the coordinate
+        :raises ValueError: If the region does not intersect the grid
+        """
+        self.rename_latitude()
+        self.rename_longitude()
+
+        set_spatial_bounds(self.cube, self.cache)
+
+        key = location_key('area', self.latitude_min, self.latitude_max,
+                           self.longitude_min, self.longitude_max)
+        indices = get_cached_location(self.cube, key, self.cache)
+        if indices is not None:
+            return index_from_json(indices[0]), index_from_json(indices[1])
+
+        lat_slice = find_bounds_range(self.cube.coord('latitude').bounds,
+                                      self.latitude_min, self.latitude_max)
+        lon_slice = find_bounds_range(self.cube.coord('longitude').bounds,
+                                      self.longitude_min, self.longitude_max,
+                                      modulus=360)
+        set_cached_location(self.cube, key,
+                            [index_to_json(lat_slice),
+                             index_to_json(lon_slice)],
+                            self.cache)
+        return lat_slice, lon_slice
+
     def find_area(self):
         """
         Finds an area averaged cube based on latitude and longitude min/max
         boundaries. With boundaries defined, the function first finds the
         nearest known points for each limit point in the cube's coordinate
         system. The cube is subset with all points that lie within this bounded
-        region and an area average is performed.
+        region and an area weighted average is performed. The average is
+        calculated lazily so the full field is never realised.
         The new cube's location is defined by the mean position
         of nearest known points NOT the mean position of the input boundaries.
         """
-        min_lat_point = self.latitude_min
-        max_lat_point = self.latitude_max
-        min_lon_point = self.longitude_min
-        max_lon_point = self.longitude_max
-        self.rename_latitude()
-        self.rename_longitude()
-        all_lat_bounds = self.cube.coord('latitude').bounds
-        all_lon_bounds = self.cube.coord('longitude').bounds
-        # Iterate through each 2D array of the lower and upper bounds
-        for i, lat_bounds in enumerate(all_lat_bounds):
-            for j, lon_bounds in enumerate(all_lon_bounds):
-                # Point must be smaller than max upper bound
-                if lat_bounds[0] <= min_lat_point < lat_bounds[1]:
-                    if lon_bounds[0] <= min_lon_point < lon_bounds[1]:
-                        nlat_min = i
-                        nlon_min = j
-                    else:
-                        pass
-                else:
-                    pass
-                # Additional statements allowing points to match max upper bound
-                if min_lat_point == all_lat_bounds[-1][1]:
-                    nlat_min = i
-                if min_lon_point == all_lon_bounds[-1][1]:
-                    nlon_min = j
-        # Iterate through each 2D array of the lower and upper bounds
-        for k, lat_bounds in enumerate(all_lat_bounds):
-            for l, lon_bounds in enumerate(all_lon_bounds):
-                # Point must be smaller than max upper bound
-                if lat_bounds[0] <= max_lat_point < lat_bounds[1]:
-                    if lon_bounds[0] <= max_lon_point < lon_bounds[1]:
-                        nlat_max = k
-                        nlon_max = l
-                    else:
-                        pass
-                else:
-                    pass
-                # Additional statements allowing points to match max upper bound
-                if max_lat_point == all_lat_bounds[-1][1]:
-                    nlat_max = i
-                if max_lon_point == all_lon_bounds[-1][1]:
-                    nlon_max = j
-        area_subset = self.cube[:, nlat_min:nlat_max+1, nlon_min:nlon_max+1]
+        lat_slice, lon_slice = self.find_area_slices()
+        area_subset = subset_region(self.cube, lat_slice, lon_slice)
+        weights = cell_area_weights(area_subset.coord('latitude').bounds,
+                                    area_subset.coord('longitude').bounds)
+        # broadcast lazily in the same chunks as the data to bound memory use
+        weights = da.broadcast_to(da.from_array(weights), area_subset.shape,
+                                  chunks=area_subset.lazy_data().chunks)
         area_mean = area_subset.collapsed(['latitude', 'longitude'],
-                                          iris.analysis.MEAN)
+                                          iris.analysis.MEAN, weights=weights)
         return area_mean
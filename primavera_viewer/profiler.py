@@ -0,0 +1,356 @@
+"""
+profiler.py
+===========
+
+Module for recording the time and resources used by each stage of a
+comparison.
+
+A 'Profiler' records the wall time, CPU time, peak resident memory, bytes read
+and netCDF files opened of each stage run in this process. A worker pool given
+the profiler wraps every stage function it maps in a 'ProfiledStage', which
+records the same for each simulation in whichever process runs it and returns
+the record with the result. The records are written as a JSON report, with
+totals by stage and by simulation, or as a Chrome trace-event file that can be
+opened in a trace viewer such as 'chrome://tracing' or Perfetto.
+
+The peak resident memory of a stage is the high-water mark of its process
+while it ran where the platform allows the mark to be reset (Linux), and
+otherwise the high-water mark of the process so far. Bytes read include reads
+served from the page cache.
+"""
+import contextlib
+import datetime
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+# netCDF files opened by this process, see 'record_files_opened'
+_files_opened = 0
+# the records of the stages running in this process, outermost first
+_running = []
+
+
+def record_files_opened(count=1):
+    """
+    Counts netCDF files opened by this process, e.g. by loading a simulation
+    or reading a file's header.
+
+    :param int count: Number of files opened
+    """
+    global _files_opened
+    _files_opened += count
+
+
+def bytes_read():
+    """
+    Returns the bytes read by this process so far.
+
+    :return int: Bytes read, or None if unknown on this platform
+    """
+    try:
+        with open('/proc/self/io') as fh:
+            for line in fh:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def peak_rss():
+    """
+    Returns the high-water mark of this process's resident memory.
+
+    :return int: The high-water mark in bytes
+    """
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def reset_peak_rss():
+    """
+    Resets the high-water mark of this process's resident memory to its
+    current resident memory where the platform allows it.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+    except OSError:
+        pass
+
+
+def simulation_name(item):
+    """
+    Finds the simulation an item of a parallel stage belongs to.
+
+    :param item: A cube with a simulation label, a simulation as a list in the
+    format ['model','ensemble','variable'] or a tuple whose first element is
+    one of these
+    :return str: The simulation label, e.g. 'HadGEM3-GC31-LM r1i1p1f1', or
+    None if unknown
+    """
+    import iris.cube
+    if isinstance(item, tuple):
+        return simulation_name(item[0]) if item else None
+    if isinstance(item, iris.cube.Cube):
+        coords = item.coords('simulation_label')
+        return str(coords[0].points[0]) if coords else None
+    if (isinstance(item, list) and len(item) == 3 and
+            all(isinstance(element, str) for element in item)):
+        return '{} {}'.format(item[0].split('.')[-1], item[1])
+    return None
+
+
+@contextlib.contextmanager
+def measure(stage, simulation=None):
+    """
+    Measures the resources used by a stage run in this process. Stages may be
+    nested, the peak memory of an enclosing stage including that of the
+    stages within it.
+
+    :param str stage: Name of the stage
+    :param str simulation: Optional, label of the simulation
+    :return dict: The record of the stage, completed when the stage ends
+    """
+    if _running:
+        _running[-1]['peak_rss'] = max(_running[-1]['peak_rss'], peak_rss())
+    reset_peak_rss()
+    record = {'stage': stage, 'simulation': simulation, 'pid': os.getpid(),
+              'start': time.time(), 'peak_rss': 0}
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_read = bytes_read()
+    start_files = _files_opened
+    _running.append(record)
+    try:
+        yield record
+    finally:
+        _running.pop()
+        record['wall'] = time.perf_counter() - start_wall
+        record['cpu'] = time.process_time() - start_cpu
+        record['peak_rss'] = max(record['peak_rss'], peak_rss())
+        end_read = bytes_read()
+        record['read_bytes'] = (None if start_read is None else
+                                end_read - start_read)
+        record['files_opened'] = _files_opened - start_files
+        if _running:
+            _running[-1]['peak_rss'] = max(_running[-1]['peak_rss'],
+                                           record['peak_rss'])
+
+
+def profile_stage(profiler, stage, simulation=None):
+    """
+    Records a stage with a profiler, if one is given.
+
+    :param Profiler profiler: The profiler or None
+    :param str stage: Name of the stage
+    :param str simulation: Optional, label of the simulation
+    :return: Context manager of the stage
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(stage, simulation)
+
+
+class ProfiledStage:
+    """
+    Class defined by a stage function that records the resources used by each
+    call. Calls return the stage's result and the record of the call, so that
+    records made in worker processes are returned to the profiler.
+
+    Example:
+    ProfiledStage(func = unify_simulation)
+    """
+    def __init__(self, func):
+        """
+        Initialise the class.
+
+        :param func: Module level function called as func(item, *args)
+        """
+        self.func = func
+
+    def __repr__(self):
+        return 'ProfiledStage: {func}'.format(func=self.func.__name__)
+
+    def __str__(self):
+        return self.func.__name__
+
+    def __call__(self, item, *args):
+        with measure(self.func.__name__, simulation_name(item)) as record:
+            result = self.func(item, *args)
+        return result, record
+
+
+class Profiler:
+    """
+    Class defined by the records of the stages of a run. Stages run in this
+    process are recorded with 'stage' and stages run by a worker pool with
+    'add_records'.
+
+    Example:
+    Profiler(name = 'PRIMAVERA_comparison')
+    """
+    def __init__(self, name='primavera_viewer'):
+        """
+        Initialise the class and start the run.
+
+        :param str name: Name of the run's main process in traces
+        """
+        self.name = name
+        self.pid = os.getpid()
+        self.start = time.time()
+        self.end = None
+        self.records = list()
+
+    def __repr__(self):
+        return 'Profiler: {name}, {records} records'.format(
+            name=self.name, records=len(self.records))
+
+    def __str__(self):
+        return '{name}, {records} records'.format(name=self.name,
+                                                   records=len(self.records))
+
+    def set_name(self, name):
+        self.name = name
+
+    @contextlib.contextmanager
+    def stage(self, stage, simulation=None):
+        """
+        Records a stage run in this process.
+
+        :param str stage: Name of the stage
+        :param str simulation: Optional, label of the simulation
+        """
+        with measure(stage, simulation) as record:
+            yield record
+        self.records.append(record)
+
+    def add_records(self, records):
+        """
+        Adds the records of stages run by a worker pool.
+
+        :param list records: Records returned by 'ProfiledStage'
+        """
+        self.records.extend(records)
+
+    def finish(self):
+        """
+        Ends the run.
+        """
+        self.end = time.time()
+
+    def summary(self, key):
+        """
+        Totals the records by stage or by simulation.
+
+        :param str key: 'stage' or 'simulation'
+        :return dict: The number of records, total wall and CPU time, bytes
+        read and files opened and maximum peak memory of each stage or
+        simulation
+        """
+        totals = dict()
+        for record in self.records:
+            if record[key] is None:
+                continue
+            total = totals.setdefault(record[key], {
+                'count': 0, 'wall': 0., 'cpu': 0., 'peak_rss': 0,
+                'read_bytes': 0, 'files_opened': 0})
+            total['count'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['peak_rss'] = max(total['peak_rss'], record['peak_rss'])
+            total['read_bytes'] += record['read_bytes'] or 0
+            total['files_opened'] += record['files_opened']
+        return totals
+
+    def report(self):
+        """
+        Creates the report of the run.
+
+        :return dict: The run's totals, the totals of each stage and each
+        simulation and every record, with times in seconds and sizes in bytes
+        """
+        end = self.end or time.time()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {
+            'version': REPORT_VERSION,
+            'name': self.name,
+            'command': sys.argv,
+            'pid': self.pid,
+            'start': datetime.datetime.fromtimestamp(self.start).isoformat(),
+            'total': {'wall': end - self.start,
+                      'cpu': usage.ru_utime + usage.ru_stime,
+                      # workers are not children of this process when they
+                      # are started by a fork server
+                      'workers_cpu': sum(record['cpu'] for record in
+                                         self.records
+                                         if record['pid'] != self.pid),
+                      'peak_rss': peak_rss()},
+            'stages': self.summary('stage'),
+            'simulations': self.summary('simulation'),
+            'records': sorted(self.records, key=lambda record:
+                              record['start'])}
+
+    def trace(self):
+        """
+        Creates the Chrome trace events of the run, one complete event per
+        record on a track for each process.
+
+        :return dict: The trace in the Chrome trace-event format
+        """
+        events = list()
+        for pid in sorted(set(record['pid'] for record in self.records) |
+                          {self.pid}):
+            events.append({
+                'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': pid,
+                'args': {'name': self.name if pid == self.pid else
+                         'worker {}'.format(pid)}})
+        for record in sorted(self.records, key=lambda record:
+                             record['start']):
+            name = record['stage']
+            if record['simulation']:
+                name += ' ' + record['simulation']
+            events.append({
+                'name': name, 'cat': record['stage'], 'ph': 'X',
+                'pid': record['pid'], 'tid': record['pid'],
+                'ts': (record['start'] - self.start) * 1e6,
+                'dur': record['wall'] * 1e6,
+                'args': {key: record[key] for key in
+                         ['simulation', 'cpu', 'peak_rss', 'read_bytes',
+                          'files_opened']}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_report(self, filename):
+        """
+        Writes the report of the run as JSON.
+
+        :param str filename: Path of the report
+        """
+        with open(filename, 'w') as fh:
+            json.dump(self.report(), fh, indent=1)
+        logger.info('Profile written to {}'.format(filename))
+
+    def write_trace(self, filename):
+        """
+        Writes the Chrome trace events of the run as JSON.
+
+        :param str filename: Path of the trace
+        """
+        with open(filename, 'w') as fh:
+            json.dump(self.trace(), fh)
+        logger.info('Trace written to {}'.format(filename))
@@ -0,0 +1,276 @@
+"""
+result_cache.py
+===============
+
+Persistent cache of completed statistics.
+
+The same comparisons are often requested repeatedly, so the cubes returned by
+'SimulationsOutput.simulations_statistics' are stored on disk. Each result is
+keyed by a hash of the canonical request (variables, models, ensembles,
+location, years and statistic) and of the path, modification time and size of
+every source file planned for it, so a result is never returned once its source
+data has changed. Results are evicted once older than 'max_age' and least
+recently used first once the cache exceeds 'max_size'.
+
+The files written for a result, its '.nc' file and plot, are cached alongside
+it, so that a repeated request can be answered by copying them without
+importing iris or matplotlib.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'primavera_viewer', 'results')
+# changed whenever the results of a request change for the same source data
+CACHE_VERSION = 1
+# suffixes of the files written for each output type
+OUTPUT_SUFFIXES = {'netCDF': ['.nc'], 'plot': ['.png'], 'both': ['.nc', '.png']}
+
+
+def canonical(value):
+    """
+    Converts a request value to a form that serialises the same way however
+    it was given, e.g. numbers as floats and arrays as lists.
+
+    :param value: Request value
+    :return: JSON serialisable value
+    """
+    if isinstance(value, dict):
+        return {str(key): canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [canonical(item) for item in value]
+    if isinstance(value, (bool, str)) or value is None:
+        return value
+    if isinstance(value, (int, float, np.number)):
+        return repr(float(value))
+    return str(value)
+
+
+def comparison_request(variables, models, ensembles, years, location,
+                       statistics):
+    """
+    Describes a comparison request for 'ResultCache.request_key'.
+
+    :param list variables: Variables in DRS format
+    :param list models: Models in DRS format
+    :param list ensembles: Ensemble members in DRS format
+    :param array years: A two element array in the format
+    [start year, end year]
+    :param array location: The location constraint
+    :param str statistics: The requested statistic
+    :return dict: The description of the request
+    """
+    return {'variables': variables, 'models': models, 'ensembles': ensembles,
+            'years': years, 'location': location, 'statistics': statistics}
+
+
+def source_state(files):
+    """
+    Records the modification time and size of source files.
+
+    :param list files: Paths of the source files
+    :return list: The path, modification time and size of each file, or None
+    for the time and size of a file that cannot be read
+    """
+    state = []
+    for filename in sorted(files):
+        try:
+            stat = os.stat(filename)
+            state.append([filename, stat.st_mtime, stat.st_size])
+        except OSError:
+            state.append([filename, None, None])
+    return state
+
+
+class ResultCache:
+    """
+    Class defined by a cache directory and size and age limits. Results are
+    retrieved with 'get' and stored with 'set' under the key returned by
+    'request_key'.
+
+    Example:
+    ResultCache(directory = '/scratch/user/.cache/results',
+                max_size = 1024 ** 3,
+                max_age = 30 * 24 * 3600)
+    """
+    suffix = '.pkl'
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=1024 ** 3,
+                 max_age=30 * 24 * 3600):
+        """
+        Initialise the class.
+
+        :param str directory: Directory to hold the cached results
+        :param int max_size: Maximum total size in bytes of all results
+        :param float max_age: Maximum age in seconds of a result
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def __repr__(self):
+        return 'ResultCache: {directory}, {max_size}, {max_age}'.format(
+            directory=self.directory, max_size=self.max_size,
+            max_age=self.max_age)
+
+    def __str__(self):
+        return '{directory}, {max_size}, {max_age}'.format(
+            directory=self.directory, max_size=self.max_size,
+            max_age=self.max_age)
+
+    def set_max_size(self, max_size):
+        self.max_size = max_size
+
+    def set_max_age(self, max_age):
+        self.max_age = max_age
+
+    def request_key(self, request, sources):
+        """
+        Calculates the key of a request's result.
+
+        :param dict request: Description of the request, e.g. its models,
+        location, years and statistic
+        :param dict sources: Source files of each dataset of the request
+        :return str: Hexadecimal key of the result
+        """
+        state = {key: source_state(files) for key, files in sources.items()}
+        text = json.dumps([CACHE_VERSION, canonical(request), state],
+                          sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """
+        Returns a cached result.
+
+        :param str key: Key of the result
+        :return: The result or None if not cached or expired
+        """
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as fh:
+                result = pickle.load(fh)
+            # the access time orders eviction, the modification time the age
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError,
+                ImportError) as err:
+            if os.path.exists(path):
+                logger.warning('Unable to read result cache {}: {}'.format(
+                    path, err))
+            return None
+        logger.debug('Found cached result {}'.format(path))
+        return result
+
+    def set(self, key, result):
+        """
+        Stores a result atomically and evicts expired and least recently used
+        results.
+
+        :param str key: Key of the result
+        :param result: Result to store, e.g. an iris.cube.CubeList
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(result, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError as err:
+            logger.warning('Unable to write result cache {}: {}'.format(
+                self._path(key), err))
+            return
+        self.evict()
+
+    def output_key(self, key, output_type):
+        """
+        Calculates the key of the files written for a result.
+
+        :param str key: Key of the result
+        :param str output_type: Output type, 'netCDF', 'plot' or 'both'
+        :return str: Key of the files
+        """
+        return '{}-{}'.format(key, output_type)
+
+    def get_outputs(self, key, output_type, filename):
+        """
+        Writes the cached files of a result.
+
+        :param str key: Key of the result
+        :param str output_type: Output type, 'netCDF', 'plot' or 'both'
+        :param str filename: Path of the files without their suffixes
+        :return bool: True if the files were cached and written
+        """
+        contents = self.get(self.output_key(key, output_type))
+        if not isinstance(contents, dict):
+            return False
+        try:
+            for suffix in OUTPUT_SUFFIXES[output_type]:
+                with open(filename + suffix, 'wb') as fh:
+                    fh.write(contents[suffix])
+        except (OSError, KeyError) as err:
+            logger.warning('Unable to write cached output {}: {}'.format(
+                filename, err))
+            return False
+        return True
+
+    def set_outputs(self, key, output_type, filename):
+        """
+        Stores the files written for a result.
+
+        :param str key: Key of the result
+        :param str output_type: Output type, 'netCDF', 'plot' or 'both'
+        :param str filename: Path of the files without their suffixes
+        """
+        contents = dict()
+        try:
+            for suffix in OUTPUT_SUFFIXES[output_type]:
+                with open(filename + suffix, 'rb') as fh:
+                    contents[suffix] = fh.read()
+        except OSError as err:
+            logger.warning('Unable to read output {}: {}'.format(filename,
+                                                                 err))
+            return
+        self.set(self.output_key(key, output_type), contents)
+
+    def evict(self):
+        """
+        Removes results older than the maximum age, then the least recently
+        used results until the total size of the cache is below its maximum
+        size.
+        """
+        try:
+            files = [os.path.join(self.directory, name)
+                     for name in os.listdir(self.directory)
+                     if name.endswith(self.suffix)]
+            stats = sorted(((os.stat(path), path) for path in files),
+                           key=lambda item: item[0].st_atime)
+        except OSError:
+            return
+        now = time.time()
+        total_size = sum(stat.st_size for stat, path in stats)
+        for stat, path in stats:
+            if (total_size <= self.max_size and
+                    now - stat.st_mtime <= self.max_age):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= stat.st_size
+            logger.debug('Evicted result cache {}'.format(path))
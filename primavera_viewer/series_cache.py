@@ -0,0 +1,141 @@
+"""
+series_cache.py
+===============
+
+Persistent cache of unified simulation series.
+
+Loading, unifying, constraining, converting the calendar of and masking a
+simulation is the same whatever statistic is then requested, so the realised
+cube returned by 'unify_simulation' is stored on disk as float32 data with the
+years it covers and the path, modification time and size of its source files.
+Each series is keyed by its dataset and location, so a later request for any
+statistic, or for a longer time range, only loads the years that are missing
+and the extended series replaces the stored one. Statistics that aggregate
+each year or month separately are stored alongside and extended the same way.
+"""
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+import numpy as np
+
+from primavera_viewer.result_cache import (CACHE_VERSION, ResultCache,
+                                           canonical)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'primavera_viewer', 'series')
+
+
+def missing_years(time_constr, cached_years):
+    """
+    Finds the years of a time constraint that a cached series does not cover.
+
+    :param array time_constr: A two element array in the format
+    [start year, end year], the end year excluded
+    :param array cached_years: The years covered by the cached series in the
+    same format
+    :return list: The ranges of years before and after the cached years, or
+    None if the time constraint neither overlaps nor adjoins them so that the
+    series cannot be extended
+    """
+    start, end = time_constr
+    cached_start, cached_end = cached_years
+    if start > cached_end or end < cached_start:
+        return None
+    ranges = []
+    if start < cached_start:
+        ranges.append([start, cached_start])
+    if end > cached_end:
+        ranges.append([cached_end, end])
+    return ranges
+
+
+class SeriesCache(ResultCache):
+    """
+    Class defined by a cache directory and size and age limits. Series are
+    stored with 'set_series' under the key returned by 'series_key' and the
+    statistics of a series with 'set_statistic' under the key returned by
+    'statistic_key'. Both are retrieved with 'get' as a dictionary of the
+    cube, the years it covers and a token that changes whenever the series
+    is replaced rather than extended.
+
+    Example:
+    SeriesCache(directory = '/scratch/user/.cache/series',
+                max_size = 4 * 1024 ** 3,
+                max_age = 30 * 24 * 3600)
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=4 * 1024 ** 3,
+                 max_age=30 * 24 * 3600):
+        """
+        Initialise the class.
+
+        :param str directory: Directory to hold the cached series
+        :param int max_size: Maximum total size in bytes of all series
+        :param float max_age: Maximum age in seconds of a series
+        """
+        super().__init__(directory, max_size, max_age)
+
+    def __repr__(self):
+        return 'SeriesCache: {directory}, {max_size}, {max_age}'.format(
+            directory=self.directory, max_size=self.max_size,
+            max_age=self.max_age)
+
+    def series_key(self, dataset, location):
+        """
+        Calculates the key of a simulation's unified series.
+
+        :param str dataset: The simulation's dataset key in DRS format
+        :param array location: The location constraint
+        :return str: Hexadecimal key of the series
+        """
+        text = json.dumps([CACHE_VERSION, dataset, canonical(location)],
+                          sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def statistic_key(self, series_key, statistic):
+        """
+        Calculates the key of a statistic of a unified series.
+
+        :param str series_key: Key of the series
+        :param str statistic: Name of the statistic
+        :return str: Hexadecimal key of the statistic
+        """
+        text = json.dumps([CACHE_VERSION, series_key, statistic])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def set_series(self, key, cube, years, sources, token=None):
+        """
+        Stores a realised series as float32 data.
+
+        :param str key: Key of the series
+        :param iris.cube.Cube cube: The unified, realised cube
+        :param array years: The years covered by the cube in the format
+        [start year, end year]
+        :param list sources: State of the source files of the years from
+        'source_state'
+        :param str token: Token of the series being extended. A new token is
+        created if not given
+        :return str: The token of the stored series
+        """
+        if cube.dtype != np.float32:
+            cube = cube.copy(data=cube.data.astype(np.float32))
+        token = token or uuid.uuid4().hex
+        self.set(key, {'cube': cube, 'years': list(years),
+                       'sources': sources, 'token': token})
+        return token
+
+    def set_statistic(self, key, cube, years, token):
+        """
+        Stores a statistic of a series.
+
+        :param str key: Key of the statistic
+        :param iris.cube.Cube cube: The statistic
+        :param array years: The years covered by the statistic in the format
+        [start year, end year]
+        :param str token: Token of the series the statistic was performed on
+        """
+        self.set(key, {'cube': cube, 'years': list(years), 'token': token})
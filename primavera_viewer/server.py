@@ -0,0 +1,370 @@
+"""
+server.py
+=========
+
+Local comparison query service.
+
+A 'ComparisonService' runs 'SimulationsLoading', 'SimulationsData' and
+'SimulationsOutput' for each request while keeping everything that outlives a
+request warm: the worker processes, the grid bounds and location indices, the
+file manifest, the series and result caches on disk and the most recent
+results in memory. 'make_server' serves it as a local HTTP/JSON service,
+handling concurrent requests with a bounded number running at once, and
+'ComparisonClient' queries it using only the standard library.
+
+Requests are JSON objects with the options of 'PRIMAVERA_comparison.py' by
+their long names, e.g.
+{"variable": ["tasmax"], "models": ["MOHC.HadGEM3-GC31-LM"],
+ "ensembles": ["r1i1p1f1"], "statistics": "annual_mean_timeseries",
+ "start_year": 1950, "end_year": 2000,
+ "latitude_point": 51.5, "longitude_point": 359.9}
+and are answered with the time points and values of each simulation's
+statistic.
+"""
+import json
+import logging
+import os
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from primavera_viewer import simulations_loading
+from primavera_viewer.grid_cache import GridCache
+from primavera_viewer.manifest import load_manifest, manifest_filename
+from primavera_viewer.result_cache import ResultCache, comparison_request
+from primavera_viewer.series_cache import SeriesCache
+from primavera_viewer.simulations_data import SimulationsData
+from primavera_viewer.simulations_loading import SimulationsLoading
+from primavera_viewer.simulations_output import STATISTICS, SimulationsOutput
+from primavera_viewer.worker_pool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'primavera_viewer')
+DEFAULT_PORT = 8642
+
+
+def request_from_json(spec):
+    """
+    Checks the options of a JSON request.
+
+    :param dict spec: The request's options by their long names
+    :return dict: The request's variables, models, ensembles, statistics and
+    time and location constraints
+    :raises ValueError: If an option is missing or invalid
+    """
+    if not isinstance(spec, dict):
+        raise ValueError('Request must be a JSON object')
+    request = {}
+    for name in ['variable', 'models', 'ensembles']:
+        value = spec.get(name)
+        if isinstance(value, str):
+            value = [value]
+        if not value:
+            raise ValueError('Must specify {}'.format(name))
+        request[name] = [str(item) for item in value]
+    if spec.get('statistics') not in STATISTICS:
+        raise ValueError('statistics must be one of: {}'.format(
+            ', '.join(STATISTICS)))
+    request['statistics'] = spec['statistics']
+    try:
+        request['time_constraints'] = [int(spec['start_year']),
+                                       int(spec['end_year'])]
+        if 'points' in spec:
+            location = [[float(point[0]), float(point[1])] +
+                        [str(name) for name in point[2:3]]
+                        for point in spec['points']]
+        elif 'latitude_point' in spec:
+            location = [float(spec['latitude_point']),
+                        float(spec['longitude_point'])]
+        elif 'latitude_min_bound' in spec:
+            location = [float(spec['latitude_min_bound']),
+                        float(spec['latitude_max_bound']),
+                        float(spec['longitude_min_bound']),
+                        float(spec['longitude_max_bound'])]
+        else:
+            location = [-90.0, 90.0, 0.0, 360.0]
+    except (KeyError, TypeError, ValueError, IndexError) as err:
+        raise ValueError('Invalid time period or location: {}'.format(err))
+    request['location_constraints'] = location
+    return request
+
+
+def cube_to_json(cube):
+    """
+    Converts a statistic's cube to JSON, with masked values as null.
+
+    :param iris.cube.Cube cube: The statistic of a simulation
+    :return dict: The simulation label, name, units, time points as dates and
+    values of the cube
+    """
+    time_coord = cube.coord('time')
+    data = np.ma.masked_invalid(cube.data)
+    values = np.where(np.ma.getmaskarray(data), None,
+                      np.ma.getdata(data).astype(object))
+    result = {'simulation': str(cube.coord('simulation_label').points[0]),
+              'name': cube.name(), 'units': str(cube.units),
+              'time': [str(date) for date in
+                       time_coord.units.num2date(time_coord.points)],
+              'data': values.tolist()}
+    if cube.coords('station_name'):
+        result['stations'] = cube.coord('station_name').points.tolist()
+    return result
+
+
+class ComparisonService:
+    """
+    Class defined by the caches and worker processes kept between requests
+    and the maximum number of requests run at once. Requests are run with
+    'compare'.
+
+    Example:
+    ComparisonService(cache_dir = '/scratch/user/.cache/primavera_viewer',
+                      workers = 4,
+                      max_requests = 2,
+                      max_results = 256)
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, workers=None,
+                 max_requests=2, max_results=256):
+        """
+        Initialise the class and start the worker processes.
+
+        :param str cache_dir: Directory of the persistent grid, series and
+        result caches
+        :param int workers: Maximum number of worker processes shared by all
+        requests. Defaults to the number of CPUs
+        :param int max_requests: Maximum number of requests loading and
+        processing data at once. Others wait for one to finish
+        :param int max_results: Maximum number of results held in memory
+        """
+        self.cache_dir = cache_dir
+        self.max_requests = max_requests
+        self.max_results = max_results
+        self.pool = WorkerPool(workers)
+        if self.pool.workers > 1:
+            self.pool.executor()
+        self.grid_cache = GridCache(os.path.join(cache_dir, 'grids'))
+        self.series_cache = SeriesCache(os.path.join(cache_dir, 'series'))
+        self.result_cache = ResultCache(os.path.join(cache_dir, 'results'))
+        self.manifest = load_manifest(
+            manifest_filename(simulations_loading.FILENAME)) or {}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_requests)
+
+    def __repr__(self):
+        return 'ComparisonService: {cache_dir}, {pool}, {max_requests}'.format(
+            cache_dir=self.cache_dir, pool=self.pool,
+            max_requests=self.max_requests)
+
+    def __str__(self):
+        return '{cache_dir}, {pool}, {max_requests} requests'.format(
+            cache_dir=self.cache_dir, pool=self.pool,
+            max_requests=self.max_requests)
+
+    def _recent_result(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+            return result
+
+    def _add_result(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def compare(self, spec):
+        """
+        Runs a comparison request, returning recent or cached results without
+        loading any data when the source files have not changed.
+
+        :param dict spec: The request's options by their long names
+        :return list: The statistic of each simulation from 'cube_to_json'
+        :raises ValueError: If the request is invalid or cannot be run
+        """
+        request = request_from_json(spec)
+        try:
+            simulations_inputs = SimulationsLoading(
+                request['variable'], request['models'], request['ensembles'],
+                request['time_constraints'],
+                loc=request['location_constraints'],
+                grid_cache=self.grid_cache, manifest=self.manifest,
+                pool=self.pool, series_cache=self.series_cache)
+        except SystemExit:
+            raise ValueError('Specified simulations do not exist')
+        key = self.result_cache.request_key(
+            comparison_request(request['variable'], request['models'],
+                               request['ensembles'],
+                               request['time_constraints'],
+                               request['location_constraints'],
+                               request['statistics']),
+            simulations_inputs.source_files())
+        result = self._recent_result(key)
+        if result is not None:
+            logger.debug('Using recent result {}'.format(key))
+            return result
+        with self._slots:
+            result_cubes = self.result_cache.get(key)
+            if result_cubes is None:
+                result_cubes = self.run(simulations_inputs, request, key)
+        result = [cube_to_json(cube) for cube in result_cubes]
+        self._add_result(key, result)
+        return result
+
+    def run(self, simulations_inputs, request, key):
+        """
+        Loads, unifies and performs the statistic of every simulation of a
+        request.
+
+        :param SimulationsLoading simulations_inputs: The request's
+        simulations
+        :param dict request: The request from 'request_from_json'
+        :param str key: Key of the request's result in the result cache
+        :return iris.cube.CubeList: The statistic of each simulation
+        """
+        simulations_inputs.load_cached_series()
+        simulations_list = simulations_inputs.load_all_data()
+        simulations_data = SimulationsData(
+            simulations_list, loc=request['location_constraints'],
+            t_constr=request['time_constraints'], grid_cache=self.grid_cache,
+            pool=self.pool,
+            sim_t_constr=simulations_inputs.loaded_constraints())
+        unified = simulations_data.simulations_operations()
+        unified.set_simulations_list(
+            simulations_inputs.unified_series(unified.simulations_list))
+        if not unified.simulations_list:
+            raise ValueError('No data within the time period')
+        simulations_mean = unified.all_simulations_mean()
+        output = SimulationsOutput(
+            unified.simulations_list, request['location_constraints'],
+            simulations_mean, request['statistics'], pool=self.pool,
+            result_cache=self.result_cache, cache_key=key,
+            series_cache=self.series_cache,
+            series_ids=simulations_inputs.series_ids)
+        return output.simulations_statistics()
+
+    def shutdown(self):
+        """
+        Stops the worker processes.
+        """
+        self.pool.shutdown()
+
+
+class ComparisonHandler(BaseHTTPRequestHandler):
+    """
+    Handles 'POST /compare' with a JSON request and 'GET /health'. Every
+    response is a JSON object.
+    """
+    def send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'Unknown path ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/compare':
+            self.send_json(404, {'error': 'Unknown path ' + self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            spec = json.loads(self.rfile.read(length).decode('utf-8'))
+            result = self.server.service.compare(spec)
+        except ValueError as err:
+            self.send_json(400, {'error': str(err)})
+        except Exception as err:
+            logger.exception('Request failed')
+            self.send_json(500, {'error': str(err)})
+        else:
+            self.send_json(200, {'results': result})
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT):
+    """
+    Creates an HTTP server of a comparison service. Each request is handled
+    in its own thread.
+
+    :param ComparisonService service: The service
+    :param str host: Address to listen on, local only by default
+    :param int port: Port to listen on, or 0 for any free port
+    :return ThreadingHTTPServer: The server, to be run with 'serve_forever'
+    """
+    server = ThreadingHTTPServer((host, port), ComparisonHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+class ComparisonClient:
+    """
+    Class defined by the URL of a comparison service.
+
+    Example:
+    ComparisonClient(url = 'http://127.0.0.1:8642', timeout = 3600)
+    """
+    def __init__(self, url='http://127.0.0.1:{}'.format(DEFAULT_PORT),
+                 timeout=3600):
+        """
+        Initialise the class.
+
+        :param str url: Base URL of the service
+        :param float timeout: Timeout of each query in seconds
+        """
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def __repr__(self):
+        return 'ComparisonClient: {url}'.format(url=self.url)
+
+    def __str__(self):
+        return self.url
+
+    def _query(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        query = urllib.request.Request(
+            self.url + path, data=data,
+            headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(query, timeout=self.timeout) as fh:
+                return json.loads(fh.read().decode('utf-8'))
+        except urllib.error.HTTPError as err:
+            message = json.loads(err.read().decode('utf-8'))['error']
+            if err.code == 400:
+                raise ValueError(message)
+            raise RuntimeError(message)
+
+    def health(self):
+        """
+        Checks the service is running.
+
+        :return dict: The service status
+        """
+        return self._query('/health')
+
+    def compare(self, spec):
+        """
+        Runs a comparison request.
+
+        :param dict spec: The request's options by their long names
+        :return list: The statistic of each simulation
+        :raises ValueError: If the request is invalid
+        """
+        return self._query('/compare', spec)['results']
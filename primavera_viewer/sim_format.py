@@ -7,11 +7,31 @@ Main module for formatting individual cubes processing unit conversions,
 additional coordinates, calendars, other time dimension issues and data types
 """
 
+import calendar
+import datetime
+import functools
+
+import dask.array as da
 import iris
 import iris.coord_categorisation as icc
 import numpy as np
 from cf_units import Unit
 
+# lengths of the months of the calendars with years of a fixed length
+CALENDAR_MONTH_DAYS = {
+    '360_day': [30] * 12,
+    '365_day': [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+    'noleap': [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+    '366_day': [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+    'all_leap': [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]}
+GREGORIAN_CALENDARS = ['standard', 'gregorian', 'proleptic_gregorian']
+# first day of the gregorian calendar in days since 1970-01-01
+GREGORIAN_START = np.datetime64('1582-10-15', 'D').astype(np.int64)
+DAY_MICROSECONDS = 86400 * 10 ** 6
+HOUR_MICROSECONDS = 3600 * 10 ** 6
+# (month, day) dates discarded when converting to the 360 day calendar
+DISALLOWED_360_DAYS = [(2, 29), (5, 31), (7, 31), (8, 31), (10, 31), (12, 31)]
+
 
 def add_simulation_label(cube):
     new_coord = iris.coords.AuxCoord(cube.attributes['source_id'] + ' ' +
@@ -25,11 +45,13 @@ def add_simulation_label(cube):
 def redefine_spatial_coords(cube):
     """
     Redefines the latitude and longitude points for the EC-Earth3 model
-    into single, rather than multi-dimensional, coordinates.
+    into single, rather than multi-dimensional, coordinates. Cubes that have
+    already been redefined are returned unchanged.
     """
     simulation_label = cube.coord('simulation_label').points[0]
 
-    if 'EC-Earth3' in simulation_label:
+    # coordinates that have already been redefined are one dimensional
+    if 'EC-Earth3' in simulation_label and cube.coord('latitude').ndim == 2:
         # procedure for handling EC-Earth latitude conversion
         cube.coord('cell index along second dimension').points = cube.coord(
             'latitude').points[:,0]
@@ -125,31 +147,74 @@ def convert_365day_to_360day(cube):
 
     Who           : Malcolm Roberts, Added by Segolene Berthou
 
+    The month and day of every time point are found as arrays and the cube is
+    indexed once with a mask of the days kept. Calendars or dates that cannot
+    be converted as arrays are filtered a cell at a time.
+
     :param iris.cube.Cube cube: input cube of data with gregorian calendar
     :returns: 360day calendar cube
     """
-    # these are tuples of (month, day) discarded by the 360 day calendar
-    tunit = cube.coord('time').units
-    if tunit.calendar == '365_day':
-        disallowed_days = [(5, 31), (7, 31), (8, 31), (10, 31), (12, 31)]
-    if tunit.calendar == 'gregorian' or 'proleptic_gregorian':
-        disallowed_days = [(2, 29), (5, 31), (7, 31), (8, 31), (10, 31),
-                           (12, 31)]
+    time_coord = cube.coord('time')
+    point_days = time_point_days(time_coord.units, time_coord.points)
+    if point_days is None:
+        return extract_360day_cells(cube)
+    _, months, days = date_from_days(time_coord.units.calendar,
+                                     point_days[0])
+    keep = ~np.isin(months * 100 + days,
+                    [month * 100 + day for month, day in DISALLOWED_360_DAYS])
+    if not keep.any():
+        return None
+    index = [slice(None)] * cube.ndim
+    index[cube.coord_dims(time_coord)[0]] = keep
+    return cube[tuple(index)]
+
 
+def extract_360day_cells(cube):
+    """
+    Removes the days not in the 360 day calendar by checking the date of
+    each cell with a constraint. Used by convert_365day_to_360day for
+    calendars and dates it cannot convert as arrays.
+
+    :param iris.cube.Cube cube: input cube of data with gregorian calendar
+    :returns: 360day calendar cube
+    """
     def doy_365_to_360(cell):
         """
         derive all (month,day) tuples that will remain in 360 day calendar
         """
 
         p_dt = cell.point
-        # p_dt = tunit.num2date(p)
         p_tuple = (p_dt.month, p_dt.day)
-        return not p_tuple in disallowed_days
+        return not p_tuple in DISALLOWED_360_DAYS
 
     # make constraint to exclude days and extract those days
     doy_365_to_360_con = iris.Constraint(time=doy_365_to_360)
     return cube.extract(doy_365_to_360_con)
 
+
+@functools.lru_cache(maxsize=None)
+def day_360_time_coord(start_year, end_year, new_units):
+    """
+    Creates the daily time coordinate of a 360 day calendar from the start of
+    one year to the start of another. Coordinates are cached so that each
+    axis is only built once.
+
+    :param int start_year: First year of the axis
+    :param int end_year: Year after the last year of the axis
+    :param str new_units: Time units of the points, counted in days
+    :return iris.coords.DimCoord: The time coordinate, to be copied before use
+    """
+    sttime_point = (start_year - 1950) * 360
+    entime_point = (end_year - 1950) * 360
+    new_points = np.arange(sttime_point, entime_point, 1)
+    time_coord = iris.coords.DimCoord(new_points, standard_name='time',
+                                      long_name='time',
+                                      var_name='time',
+                                      units=Unit(new_units,
+                                                 calendar='360_day'))
+    time_coord.guess_bounds()
+    return time_coord
+
 def change_calendar(cube, time_constr, new_units):
     """
     Purpose: Converts a list of cubes with varying calendars (gregorian,
@@ -166,27 +231,177 @@ def change_calendar(cube, time_constr, new_units):
     else:
         cube = convert_365day_to_360day(cube)
         # add new set of coordinates so that dates are consistent
-        sttime_point = (time_constr[0] - 1950) * 360
-        entime_point = (time_constr[1] - 1950) * 360
         cube.remove_coord('time')
-        new_points = np.arange(sttime_point, entime_point, 1)
-        time_coord = iris.coords.DimCoord(new_points, standard_name='time',
-                                          long_name='time',
-                                          var_name='time',
-                                          units=Unit(new_units,
-                                                     calendar='360_day'))
-        cube.add_dim_coord(time_coord, 0)
-        cube.coord('time').guess_bounds()
+        time_coord = day_360_time_coord(int(time_constr[0]),
+                                        int(time_constr[1]), new_units)
+        cube.add_dim_coord(time_coord.copy(), 0)
         return cube
 
+def days_from_date(cal, years, months, days):
+    """
+    Converts arrays of dates to day numbers in a calendar. Day numbers count
+    from 1970-01-01 in the gregorian calendars and from the start of year 0
+    in the others.
+
+    :param str cal: Calendar of the dates
+    :param np.array years: Years of the dates
+    :param np.array months: Months of the dates
+    :param np.array days: Days of the month of the dates
+    :return np.array: The day numbers
+    """
+    years = np.asarray(years, dtype=np.int64)
+    months = np.asarray(months, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    if cal in GREGORIAN_CALENDARS:
+        month_starts = ((years - 1970) * 12 + months - 1).astype(
+            'datetime64[M]')
+        return month_starts.astype('datetime64[D]').astype(np.int64) + \
+            days - 1
+    month_days = np.array(CALENDAR_MONTH_DAYS[cal])
+    month_starts = np.cumsum(month_days) - month_days
+    return years * month_days.sum() + month_starts[months - 1] + days - 1
+
+
+def date_from_days(cal, day_numbers):
+    """
+    Converts an array of day numbers, as defined by days_from_date, to dates.
+
+    :param str cal: Calendar of the dates
+    :param np.array day_numbers: The day numbers
+    :return tuple: Arrays of the years, months and days of the month
+    """
+    day_numbers = np.asarray(day_numbers, dtype=np.int64)
+    if cal in GREGORIAN_CALENDARS:
+        dates = day_numbers.astype('datetime64[D]')
+        month_starts = dates.astype('datetime64[M]')
+        months_since = month_starts.astype(np.int64)
+        days = (dates - month_starts.astype('datetime64[D]')).astype(np.int64)
+        return months_since // 12 + 1970, months_since % 12 + 1, days + 1
+    month_days = np.array(CALENDAR_MONTH_DAYS[cal])
+    month_starts = np.cumsum(month_days) - month_days
+    years, day_of_year = np.divmod(day_numbers, month_days.sum())
+    months = np.searchsorted(month_starts, day_of_year, side='right')
+    return years, months, day_of_year - month_starts[months - 1] + 1
+
+
+def time_unit_origin(units):
+    """
+    Returns the reference time of time units and the length of the units.
+
+    :param cf_units.Unit units: Time units
+    :return tuple: The reference time's day number, as defined by
+    days_from_date, and microseconds of the day, and the length of the units
+    in microseconds
+    """
+    cal = units.calendar
+    origin = units.num2date(0)
+    unit_us = DAY_MICROSECONDS // int(
+        units.date2num(origin + datetime.timedelta(days=1)))
+    origin_day = days_from_date(cal, origin.year, origin.month, origin.day)
+    origin_us = ((origin.hour * 60 + origin.minute) * 60 +
+                 origin.second) * 10 ** 6 + origin.microsecond
+    return origin_day, origin_us, unit_us
+
+
+def time_point_days(units, points):
+    """
+    Splits time points into day numbers, as defined by days_from_date, and
+    microseconds of the day.
+
+    :param cf_units.Unit units: Units of the time points
+    :param np.array points: The time points
+    :return tuple: Arrays of the day numbers and microseconds of the day, or
+    None if the calendar or dates cannot be converted as arrays
+    """
+    cal = units.calendar
+    if cal not in GREGORIAN_CALENDARS and cal not in CALENDAR_MONTH_DAYS:
+        return None
+    origin_day, origin_us, unit_us = time_unit_origin(units)
+    if np.issubdtype(points.dtype, np.integer):
+        delta_us = points.astype(np.int64) * unit_us
+    else:
+        # round half up to the nearest microsecond as num2date does
+        delta_us = np.floor(points * unit_us + 0.5).astype(np.int64)
+    day_numbers, day_us = np.divmod(origin_us + delta_us, DAY_MICROSECONDS)
+    day_numbers += origin_day
+    if cal in GREGORIAN_CALENDARS:
+        # dates before year 1, or julian dates of the standard calendar
+        first_day = (days_from_date(cal, 1, 1, 1)
+                     if cal == 'proleptic_gregorian' else GREGORIAN_START)
+        if day_numbers.min(initial=first_day) < first_day:
+            return None
+    return day_numbers, day_us
+
+
 def change_time_points(cube, yr=None, mn=None, dy=None, hr=None):
     """
     Purpose: alter's a cube's time points to ensure all cubes share the same
-    date definitions
+    date definitions. The dates are converted as arrays of day numbers and
+    microseconds, giving the same points as replacing each date in turn.
+    Calendars or dates that cannot be converted this way, such as julian
+    dates, are passed to replace_time_points.
 
     Example: cube = change_time_points(cube, yr=None, mn=None, dy=1, hr=0) fixes
     all time points in cube to the first of each month at midnight.
 
+    :param cube: iris.cube.Cube
+    :param yr: fixes all data points at defined year
+    :param mn: fixes all data points at defined month
+    :param dy: fixes all data points at defined day
+    :param hr: fixes all data points at defined hour
+    :return: cube with time points fixed with constraints above
+    """
+    time_coord = cube.coord('time')
+    units = time_coord.units
+    cal = units.calendar
+    point_days = time_point_days(units, time_coord.points)
+    if point_days is None:
+        return replace_time_points(cube, yr, mn, dy, hr)
+    day_numbers, day_us = point_days
+    origin_day, origin_us, unit_us = time_unit_origin(units)
+    years, months, days = date_from_days(cal, day_numbers)
+    hours, hour_us = np.divmod(day_us, HOUR_MICROSECONDS)
+
+    if not cube.coords('month'):
+        month_coord = iris.coords.AuxCoord(
+            np.array(calendar.month_abbr, dtype='|U64')[months],
+            units='no_unit', attributes=time_coord.attributes.copy())
+        month_coord.rename('month')
+        cube.add_aux_coord(month_coord, cube.coord_dims(time_coord))
+    # date categories already on the cube are used as they are
+    for name, values in [('year', years), ('month_number', months),
+                         ('day_of_month', days), ('hour', hours)]:
+        if cube.coords(name):
+            values[...] = cube.coord(name).points
+
+    for value, values in [(yr, years), (mn, months), (dy, days), (hr, hours)]:
+        if value is not None:
+            values[...] = value
+    if not 0 <= hours.min(initial=0) <= hours.max(initial=0) < 24:
+        raise ValueError('hour must be in 0..23')
+    new_day_numbers = days_from_date(cal, years, months, days)
+    if not all(np.array_equal(new, old) for new, old in
+               zip(date_from_days(cal, new_day_numbers),
+                   (years, months, days))):
+        raise ValueError('day is out of range for month')
+    delta_us = (new_day_numbers - origin_day) * DAY_MICROSECONDS + \
+        hours * HOUR_MICROSECONDS + hour_us - origin_us
+    # as with date2num, exact multiples of the unit are given as integers
+    quotient, remainder = np.divmod(delta_us, unit_us)
+    time_coord.points = delta_us / unit_us if remainder.any() else quotient
+    cube = remove_extra_time_coords(cube)
+    return cube
+
+
+def replace_time_points(cube, yr=None, mn=None, dy=None, hr=None):
+    """
+    Purpose: alter's a cube's time points to ensure all cubes share the same
+    date definitions, replacing each date in turn. Used by change_time_points
+    for calendars and dates it cannot convert as arrays
+
+    Example: cube = replace_time_points(cube, yr=None, mn=None, dy=1, hr=0) fixes
+    all time points in cube to the first of each month at midnight.
+
     :param cube: iris.cube.Cube
     :param yr: fixes all data points at defined year
     :param mn: fixes all data points at defined month
@@ -252,11 +467,111 @@ def set_blank_attributes(cube):
 def unify_data_type(cube):
     """
     360 day, 365 day and gregorian calendars have different data types.
-    To merge cubes, set data type to a 32bit float.
+    To merge cubes, set data type to a 32bit float. Lazy data is cast lazily.
     """
-    cube.data = np.float32(cube.data)
+    if cube.dtype != np.float32:
+        cube.data = cube.core_data().astype(np.float32)
     return cube
 
 
+def mask_time_points(cube, time_indices):
+    """
+    Masks all data at the given indices of the time dimension. Lazy data is
+    masked lazily.
+
+    :param iris.cube.Cube cube: Cube with time as its first dimension
+    :param list time_indices: Indices along the time dimension to mask
+    :return iris.cube.Cube: Cube with the time points masked
+    """
+    time_mask = np.zeros(cube.shape[0], dtype=bool)
+    time_mask[time_indices] = True
+    time_mask = time_mask.reshape((-1,) + (1,) * (cube.ndim - 1))
+    if cube.has_lazy_data():
+        data = cube.lazy_data()
+        time_mask = da.broadcast_to(
+            da.from_array(time_mask, chunks=(data.chunks[0],) +
+                          (1,) * (cube.ndim - 1)),
+            data.shape, chunks=data.chunks)
+        cube.data = da.ma.masked_where(time_mask, data)
+    else:
+        cube.data = np.ma.masked_where(
+            np.broadcast_to(time_mask, cube.shape), cube.data)
+    return cube
 
 
+def realise_data(cube):
+    """
+    Computes a cube's lazy data. Only to be used once the cube has been reduced
+    in space and time so that the data is small enough to hold in memory.
+    """
+    if cube.has_lazy_data():
+        # accessing the data replaces the cube's lazy data with real data
+        cube.data
+    return cube
+
+
+def time_point_years(cube):
+    """
+    Finds the year of each time point of a cube.
+
+    :param iris.cube.Cube cube: Cube with a time coordinate
+    :return np.array: The year of each time point
+    """
+    time_coord = cube.coord('time')
+    days = time_point_days(time_coord.units, time_coord.points)
+    if days is None:
+        return np.array([date.year for date in
+                         time_coord.units.num2date(time_coord.points)])
+    return date_from_days(time_coord.units.calendar, days[0])[0]
+
+
+def extract_years(cube, time_constr):
+    """
+    Extracts the time points of a cube within a range of years, the end year
+    excluded as when loading. Years are contiguous along the time dimension
+    so the result is a view of a single slice.
+
+    :param iris.cube.Cube cube: Cube with time as its first dimension
+    :param array time_constr: A two element array in the format
+    [start year, end year]
+    :return iris.cube.Cube: The cube within the years or None if it has no
+    time points within them
+    """
+    years = time_point_years(cube)
+    index = np.where((years >= time_constr[0]) & (years < time_constr[1]))[0]
+    if len(index) == 0:
+        return None
+    if len(index) == len(years):
+        return cube
+    return cube[index[0]:index[-1] + 1]
+
+
+def concatenate_years(cubes, attributes=None):
+    """
+    Concatenates cubes of consecutive ranges of years, e.g. a cached series
+    and the years loaded to extend it. Parts loaded from different numbers of
+    files can differ in their attributes, so every part is given the
+    attributes of all the parts. The result is realised if every part is.
+
+    :param list cubes: Cubes in time order
+    :param dict attributes: Optional, attributes to set on the result
+    :return iris.cube.Cube: The concatenated cube
+    """
+    realised = not any(cube.has_lazy_data() for cube in cubes)
+    # global and local attributes are kept apart as when loaded
+    all_attributes = cubes[0].attributes.copy()
+    for cube in cubes[1:]:
+        for name, value in cube.attributes.globals.items():
+            all_attributes.globals.setdefault(name, value)
+        for name, value in cube.attributes.locals.items():
+            all_attributes.locals.setdefault(name, value)
+    all_attributes.update(attributes or {})
+    cube_list = iris.cube.CubeList([])
+    for cube in cubes:
+        cube = cube.copy(data=cube.core_data())
+        cube.attributes = all_attributes.copy()
+        cube_list.append(cube)
+    cube = cube_list.concatenate_cube()
+    if realised:
+        cube = realise_data(cube)
+    return cube
@@ -7,16 +7,246 @@ Module for single cube statistical methods such as annual/monthly means and
 anomalies.
 """
 import logging
+import dask.array as da
 import iris
 import numpy as np
 from primavera_viewer import sim_format as format
 
 logger = logging.getLogger(__name__)
 
+# name and aggregator of each statistic of monthly_analysis
+MONTHLY_STATISTICS = [('mean', iris.analysis.MEAN),
+                      ('max', iris.analysis.MAX),
+                      ('min', iris.analysis.MIN)]
+# aggregator giving the metadata of each statistic of streaming_statistics
+STREAMING_AGGREGATORS = {'mean': iris.analysis.MEAN,
+                         'max': iris.analysis.MAX,
+                         'min': iris.analysis.MIN,
+                         'variance': iris.analysis.VARIANCE}
+
+
+class StreamingStatistics:
+    """
+    Class defined by the running statistics of groups of time points, updated
+    a chunk of the time dimension at a time. For each group and grid cell the
+    count, mean and sum of squared differences from the mean (Welford's
+    method, merged between chunks as by Chan et al.), minimum and maximum are
+    kept, so memory use depends on the number of groups and not on the number
+    of time points.
+
+    Example:
+    StreamingStatistics(groups = 12, shape = (4, 8))
+    """
+    def __init__(self, groups, shape=()):
+        """
+        Initialise the class with no data.
+
+        :param int groups: Number of groups
+        :param tuple shape: Shape of the data at a single time point
+        """
+        shape = (groups,) + tuple(shape)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.minimum = np.full(shape, np.inf)
+        self.maximum = np.full(shape, -np.inf)
+
+    def __repr__(self):
+        return 'StreamingStatistics: {shape}'.format(shape=self.count.shape)
+
+    def __str__(self):
+        return '{groups} groups of {count} values'.format(
+            groups=self.count.shape[0], count=self.count.sum())
+
+    def update(self, group, data, axis=0):
+        """
+        Adds the data of time points in a single group.
+
+        :param int group: Index of the group
+        :param np.array data: Data, possibly masked, of the time points
+        :param int axis: Time dimension of the data
+        """
+        data = np.ma.masked_invalid(np.ma.asanyarray(data, dtype=np.float64))
+        count = data.count(axis=axis)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.ma.getdata(data.sum(axis=axis)) / count
+            m2 = np.ma.getdata(((data - np.expand_dims(mean, axis)) ** 2)
+                               .sum(axis=axis))
+            total = self.count[group] + count
+            delta = mean - self.mean[group]
+            new_mean = self.mean[group] + delta * count / total
+            new_m2 = (self.m2[group] + m2 +
+                      delta ** 2 * self.count[group] * count / total)
+        updated = count > 0
+        self.mean[group] = np.where(updated, new_mean, self.mean[group])
+        self.m2[group] = np.where(updated, new_m2, self.m2[group])
+        self.count[group] = total
+        # a series of a single point reduces to a scalar
+        self.minimum[group] = np.fmin(
+            self.minimum[group], np.ma.filled(data.min(axis=axis), np.inf))
+        self.maximum[group] = np.fmax(
+            self.maximum[group], np.ma.filled(data.max(axis=axis), -np.inf))
+
+    def result(self, statistic):
+        """
+        Returns a statistic of every group, masked where a group has no data.
+
+        :param str statistic: One of 'mean', 'max', 'min', 'variance' or
+        'count'
+        :return np.array: The statistic with the groups along the first
+        dimension
+        """
+        if statistic == 'count':
+            return self.count
+        if statistic == 'variance':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = self.m2 / (self.count - 1)
+            empty = self.count < 2
+        else:
+            values = {'mean': self.mean, 'max': self.maximum,
+                      'min': self.minimum}[statistic]
+            empty = self.count == 0
+        if empty.any():
+            return np.ma.masked_where(empty, values)
+        return values
+
+
+def time_groups(cube, coords):
+    """
+    Finds the groups of consecutive time points sharing the values of the
+    coordinates to aggregate by.
+
+    :param cube: iris.cube.Cube
+    :param list coords: Names of the coordinates to group by
+    :return np.array: Index of the first time point of each group, or None if
+    points with the same values are not consecutive
+    """
+    keys = np.stack([np.unique(cube.coord(coord).points,
+                               return_inverse=True)[1].ravel()
+                     for coord in coords])
+    starts = np.flatnonzero(np.concatenate(
+        ([True], np.any(keys[:, 1:] != keys[:, :-1], axis=0))))
+    if len(starts) != np.unique(keys, axis=1).shape[1]:
+        return None
+    return starts
+
+
+def aggregated_cubes(cube, coords, aggregators, results):
+    """
+    Creates the aggregated cubes of already aggregated data. The aggregated
+    coordinates are made once, by aggregating a copy of the cube without data.
+
+    :param cube: iris.cube.Cube that was aggregated
+    :param list coords: Names of the coordinates grouped by
+    :param list aggregators: iris.analysis aggregators of each result
+    :param list results: Aggregated data of each aggregator
+    :return: list of aggregated iris.cube.Cube
+    """
+    template = cube.copy(data=da.zeros(cube.shape, dtype=cube.dtype,
+                                       chunks=-1))
+    template.data = None
+    template = template.aggregated_by(coords, aggregators[0])
+    groupby_coords = [cube.coord(coord) for coord in coords]
+    cubes = []
+    for result, aggregator in zip(results, aggregators):
+        aggregated_cube = template.copy()
+        aggregated_cube.cell_methods = cube.cell_methods
+        aggregator.update_metadata(aggregated_cube, groupby_coords,
+                                   aggregate=True)
+        cubes.append(aggregator.post_process(aggregated_cube, result,
+                                             groupby_coords))
+    return cubes
+
+
+def aggregated_statistics(cube, coords, aggregators):
+    """
+    Aggregates a cube by coordinates with several aggregators in a single pass
+    over the data. Each group of time points is sliced from the data once and
+    reduced by every aggregator, giving the same cubes as calling
+    'aggregated_by' with each aggregator in turn.
+
+    :param cube: iris.cube.Cube with realised data and time as the dimension
+    to aggregate
+    :param list coords: Names of the coordinates to group by
+    :param list aggregators: iris.analysis aggregators, e.g. MEAN, MAX
+    :return: list of aggregated iris.cube.Cube in the order of the aggregators
+    """
+    time_dim = cube.coord_dims('time')[0]
+    starts = time_groups(cube, coords)
+    if cube.has_lazy_data() or starts is None:
+        return [cube.aggregated_by(coords, aggregator)
+                for aggregator in aggregators]
+
+    results = [[] for _ in aggregators]
+    data = cube.data
+    front = (slice(None),) * time_dim
+    for start, stop in zip(starts, np.append(starts[1:], cube.shape[time_dim])):
+        group_data = data[front + (slice(start, stop),)]
+        for result, aggregator in zip(results, aggregators):
+            result.append(aggregator.aggregate(group_data, axis=time_dim))
+
+    aggregated_data = []
+    for result in results:
+        if any(np.ma.isMaskedArray(group) for group in result):
+            result = np.ma.stack(result, axis=time_dim)
+        else:
+            result = np.stack(result, axis=time_dim)
+        if not np.ma.isMaskedArray(data):
+            result = np.ma.getdata(result)
+        aggregated_data.append(result)
+    return aggregated_cubes(cube, coords, aggregators, aggregated_data)
+
+
+def streaming_statistics(cube, coords, statistics, chunk_years=1):
+    """
+    Aggregates a cube by coordinates walking the time dimension a number of
+    years at a time, so that only one chunk of the data, typically one file, is
+    realised at once. The results match 'aggregated_by' to float tolerance.
+
+    :param cube: iris.cube.Cube, usually with lazy data, with additional time
+    coordinates
+    :param list coords: Names of the coordinates to group by
+    :param list statistics: Names of the statistics out of 'mean', 'max',
+    'min' and 'variance'
+    :param int chunk_years: Number of years in each chunk
+    :return: list of aggregated iris.cube.Cube in the order of the statistics
+    """
+    aggregators = [STREAMING_AGGREGATORS[name] for name in statistics]
+    starts = time_groups(cube, coords)
+    years = time_groups(cube, ['year'])
+    if starts is None or years is None:
+        return [cube.aggregated_by(coords, aggregator)
+                for aggregator in aggregators]
+
+    time_dim = cube.coord_dims('time')[0]
+    ntime = cube.shape[time_dim]
+    front = (slice(None),) * time_dim
+    group_index = np.cumsum(np.isin(np.arange(ntime), starts)) - 1
+    accumulator = StreamingStatistics(
+        len(starts), cube.shape[:time_dim] + cube.shape[time_dim + 1:])
+    chunk_starts = years[::chunk_years]
+    for chunk_start, chunk_stop in zip(chunk_starts,
+                                       np.append(chunk_starts[1:], ntime)):
+        logger.debug('streaming time points {} to {}'.format(chunk_start,
+                                                             chunk_stop))
+        chunk = cube[front + (slice(chunk_start, chunk_stop),)].data
+        chunk_groups = group_index[chunk_start:chunk_stop]
+        for group in np.unique(chunk_groups):
+            group_slice = np.flatnonzero(chunk_groups == group)
+            accumulator.update(
+                group, chunk[front + (slice(group_slice[0],
+                                            group_slice[-1] + 1),)],
+                axis=time_dim)
+
+    results = [np.moveaxis(accumulator.result(name), 0, time_dim)
+               .astype(cube.dtype) for name in statistics]
+    return aggregated_cubes(cube, coords, aggregators, results)
+
 
 def annual_mean(cube):
     """
-    Creates year-by-year annual mean time series
+    Creates year-by-year annual mean time series. Lazy data is streamed a
+    year at a time
 
     :param cube: iris.cube.Cube
     :return: annual mean iris.cube.Cube time series
@@ -24,32 +254,81 @@ def annual_mean(cube):
     logger.debug('getting annual mean '+
                  cube.coord('simulation_label').points[0])
     cube = format.add_extra_time_coords(cube)
-    annual_mean_cube = cube.aggregated_by('year', iris.analysis.MEAN)
+    if cube.has_lazy_data():
+        annual_mean_cube = streaming_statistics(cube, ['year'], ['mean'])[0]
+    else:
+        annual_mean_cube = cube.aggregated_by('year', iris.analysis.MEAN)
     annual_mean_cube.rename(annual_mean_cube.name() + '_annual_mean')
     return annual_mean_cube
 
 
-def monthly_analysis(cube):
+def monthly_analysis(cube, statistics=None):
     """
-    Creates month-by-month annual mean/max/min time series
+    Creates month-by-month annual mean/max/min time series. All statistics are
+    computed in a single pass over the data. Lazy data is streamed a year at
+    a time
 
     :param cube: iris.cube.Cube
+    :param list statistics: Optional, names of the statistics to compute out
+    of 'mean', 'max' and 'min'. All three by default
     :return: monthly analysis iris.cube.Cube time series
     """
     logger.debug('getting monthly mean '+
                  cube.coord('simulation_label').points[0])
     cube = format.add_extra_time_coords(cube)
-    monthly_mean_cube = cube.aggregated_by(['month','year'], iris.analysis.MEAN)
-    monthly_mean_cube.rename(monthly_mean_cube.name() + '_mean')
-    monthly_max_cube = cube.aggregated_by(['month','year'], iris.analysis.MAX)
-    monthly_max_cube.rename(monthly_max_cube.name() + '_max')
-    monthly_min_cube = cube.aggregated_by(['month','year'], iris.analysis.MIN)
-    monthly_min_cube.rename(monthly_min_cube.name() + '_min')
-    cube_list= iris.cube.CubeList([monthly_mean_cube, monthly_max_cube,
-                                   monthly_min_cube])
+    if statistics is None:
+        statistics = [name for name, _ in MONTHLY_STATISTICS]
+    aggregators = dict(MONTHLY_STATISTICS)
+    if cube.has_lazy_data():
+        monthly_cubes = streaming_statistics(cube, ['month','year'],
+                                             statistics)
+    else:
+        monthly_cubes = aggregated_statistics(
+            cube, ['month','year'], [aggregators[name] for name in statistics])
+    for name, monthly_cube in zip(statistics, monthly_cubes):
+        monthly_cube.rename(monthly_cube.name() + '_' + name)
+    cube_list= iris.cube.CubeList(monthly_cubes)
     return cube_list
 
 
+def monthly_climatology(cube):
+    """
+    Creates the mean of each month of the year over all years in a single
+    grouped reduction
+
+    :param cube: iris.cube.Cube with additional time coordinates
+    :return: iris.cube.Cube of the mean of each month, with the months along
+    the time dimension
+    """
+    return cube.aggregated_by(['month'], iris.analysis.MEAN)
+
+
+def subtract_climatology(cube, climatology, name):
+    """
+    Creates the anomaly of each time point from the mean of its month of the
+    year. The climatology is repeated along the time dimension by indexing it
+    with the month of each time point and subtracted in a single broadcast.
+
+    :param cube: iris.cube.Cube with a 'month' coordinate
+    :param climatology: iris.cube.Cube of monthly_climatology
+    :param str name: Name of the anomaly cube
+    :return: anomaly iris.cube.Cube time series
+    """
+    time_dim = cube.coord_dims('time')[0]
+    climatology_months = list(climatology.coord('month').points)
+    months, month_index = np.unique(cube.coord('month').points,
+                                    return_inverse=True)
+    rows = np.array([climatology_months.index(month)
+                     for month in months])[month_index]
+    index = (slice(None),) * time_dim + (rows,)
+    anomaly = cube.copy(data=cube.core_data() -
+                        climatology.core_data()[index])
+    anomaly.rename(name)
+    anomaly.cell_methods = ()
+    anomaly = format.unify_data_type(anomaly)
+    return anomaly
+
+
 def daily_anomaly(cube):
     """
     Creates daily anomaly time series from all months mean over time period
@@ -59,21 +338,28 @@ def daily_anomaly(cube):
     """
     logger.debug('getting daily anomaly '+
                  cube.coord('simulation_label').points[0])
-    daily_mean_cube = format.add_extra_time_coords(cube)
-    daily_mean_anomaly_list = iris.cube.CubeList([])
-    all_months_mean = cube.aggregated_by(['month'], iris.analysis.MEAN)
-    for mon in np.arange(1,13,1):
-        cube_mean = daily_mean_cube.extract(
-            iris.Constraint(month_number=mon))
-        all_month_mean = all_months_mean.extract(
-            iris.Constraint(month_number=mon))
-        cube_mean_anomaly = cube_mean - all_month_mean
-        cube_mean_anomaly.rename(cube_mean.long_name + ' Anomaly')
-        for i in np.arange(0,len(cube_mean_anomaly.coord('time').points),1):
-            cube = cube_mean_anomaly[i]
-            cube = format.remove_extra_time_coords(cube)
-            daily_mean_anomaly_list.append(cube)
-    return daily_mean_anomaly_list
+    cube = format.add_extra_time_coords(cube)
+    all_months_mean = monthly_climatology(cube)
+    daily_mean_anomaly = subtract_climatology(cube, all_months_mean,
+                                              cube.long_name + ' Anomaly')
+    return format.change_time_points(daily_mean_anomaly, hr=00)
+
+
+def monthly_anomaly(cube, statistic):
+    """
+    Creates a monthly statistic's anomaly time series from all months mean over
+    time period
+
+    :param cube: iris.cube.Cube
+    :param str statistic: Name of the statistic in monthly_analysis
+    :return: monthly anomaly iris.cube.Cube time series
+    """
+    cube = format.add_extra_time_coords(cube)
+    all_months_mean = monthly_climatology(cube)
+    monthly_cube = monthly_analysis(cube, [statistic])[0]
+    monthly_cube_anomaly = subtract_climatology(
+        monthly_cube, all_months_mean, monthly_cube.name() + '_anomaly')
+    return format.change_time_points(monthly_cube_anomaly, dy=1, hr=00)
 
 
 def monthly_mean_anomaly(cube):
@@ -85,25 +371,7 @@ def monthly_mean_anomaly(cube):
     """
     logger.debug('getting monthly mean anomaly '
                  +cube.coord('simulation_label').points[0])
-    cube = format.add_extra_time_coords(cube)
-    monthly_mean_anomaly_list = iris.cube.CubeList([])
-    all_months_mean = cube.aggregated_by(['month'], iris.analysis.MEAN)
-    monthly_analysis_array = monthly_analysis(cube)
-    monthly_mean_cube = monthly_analysis_array[0]
-    for mon in np.arange(1,13,1):
-        cube_mean = monthly_mean_cube.extract(
-            iris.Constraint(month_number=mon))
-        all_month_mean = all_months_mean.extract(
-            iris.Constraint(month_number=mon))
-        cube_mean_anomaly = cube_mean - all_month_mean
-        cube_mean_anomaly.rename(cube_mean.name() + '_anomaly')
-        for i in np.arange(0,len(cube_mean_anomaly.coord('time').points),1):
-            cube = cube_mean_anomaly[i]
-            cube = format.remove_extra_time_coords(cube)
-            monthly_mean_anomaly_list.append(cube)
-    # month_anomaly = monthly_mean_anomaly_list.merge_cube()
-    # month_anomaly = format.change_time_points(month_anomaly, dy=1, hr=00)
-    return monthly_mean_anomaly_list
+    return monthly_anomaly(cube, 'mean')
 
 
 def monthly_maximum_anomaly(cube):
@@ -115,25 +383,7 @@ def monthly_maximum_anomaly(cube):
     """
     logger.debug('getting monthly maximum anomaly '
                  +cube.coord('simulation_label').points[0])
-    cube = format.add_extra_time_coords(cube)
-    monthly_max_anomaly_list = iris.cube.CubeList([])
-    all_months_mean = cube.aggregated_by(['month'], iris.analysis.MEAN)
-    monthly_analysis_array = monthly_analysis(cube)
-    monthly_max_cube = monthly_analysis_array[1]
-    for mon in np.arange(1,13,1):
-        cube_max = monthly_max_cube.extract(
-            iris.Constraint(month_number=mon))
-        all_month_mean = all_months_mean.extract(
-            iris.Constraint(month_number=mon))
-        cube_max_anomaly = cube_max - all_month_mean
-        cube_max_anomaly.rename(cube_max.name() + '_anomaly')
-        for i in np.arange(0,len(cube_max_anomaly.coord('time').points),1):
-            cube = cube_max_anomaly[i]
-            cube = format.remove_extra_time_coords(cube)
-            monthly_max_anomaly_list.append(cube)
-    # month_anomaly = monthly_mean_anomaly_list.merge_cube()
-    # month_anomaly = format.change_time_points(month_anomaly, dy=1, hr=00)
-    return monthly_max_anomaly_list
+    return monthly_anomaly(cube, 'max')
 
 
 def monthly_minimum_anomaly(cube):
@@ -145,25 +395,7 @@ def monthly_minimum_anomaly(cube):
      """
     logger.debug('getting monthly minimum anomaly '
                  +cube.coord('simulation_label').points[0])
-    cube = format.add_extra_time_coords(cube)
-    monthly_min_anomaly_list = iris.cube.CubeList([])
-    all_months_mean = cube.aggregated_by(['month'], iris.analysis.MEAN)
-    monthly_analysis_array = monthly_analysis(cube)
-    monthly_min_cube = monthly_analysis_array[2]
-    for mon in np.arange(1,13,1):
-        cube_min = monthly_min_cube.extract(
-            iris.Constraint(month_number=mon))
-        all_month_mean = all_months_mean.extract(
-            iris.Constraint(month_number=mon))
-        cube_min_anomaly = cube_min - all_month_mean
-        cube_min_anomaly.rename(cube_min.name() + '_anomaly')
-        for i in np.arange(0,len(cube_min_anomaly.coord('time').points),1):
-            cube = cube_min_anomaly[i]
-            cube = format.remove_extra_time_coords(cube)
-            monthly_min_anomaly_list.append(cube)
-    # month_anomaly = monthly_mean_anomaly_list.merge_cube()
-    # month_anomaly = format.change_time_points(month_anomaly, dy=1, hr=00)
-    return monthly_min_anomaly_list
+    return monthly_anomaly(cube, 'min')
 
 
 # SEASONAL MEAN ANALYSIS
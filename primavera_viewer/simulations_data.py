@@ -8,21 +8,192 @@ Module defines a class 'SimulationsData' used to manipulating and handling data
 from simulations once fully loaded and concatenated.
 """
 import logging
-from multiprocessing import Process, Manager
-import itertools
 import cf_units
 import iris
 import numpy as np
 from primavera_viewer import (nearest_location as loc, sim_format as format)
+from primavera_viewer.worker_pool import get_default_pool
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+
+def unify_spatial_coordinates(cube):
+    """
+    Ensures that all spatial dimensions are defined by the same coordinate
+    system: two 1D arrays of latitude and longitude coordinates.
+    Method for redefining spatial coordinates can be specific to each model.
+
+    :param iris.cube.Cube cube: Cube to spatially unify
+    :return iris.cube.Cube: Spatially unified cube
+    """
+    cube = format.redefine_spatial_coords(cube)
+    return cube
+
+
+def constrain_location(cube, location, grid_cache=None):
+    """
+    Subsets cube location to single point in the coordinate system (CS). If
+    location is a 2D array of latitude and longitude points a PointLocation
+    class is created and the nearest known point in the CS is found. If
+    location is a 4D array of min/max latitude and longitude points an
+    AreaLocation class is created finding all nearest known points in the
+    defined area and returning an area mean. If location is a list of
+    [lat, lon] points a MultiPointLocation class is created and the nearest
+    known point to each is found, returning a station dimension.
+
+    :param iris.cube.Cube cube: Cube to constrain at location
+    :param array location: An array to be used for constraining at location
+    :param GridCache grid_cache: Optional, persistent cache of grid bounds and
+    location indices
+    :return iris.cube.Cube: Constrained cube
+    """
+    if loc.is_multi_point(location):
+        latitudes = [point[0] for point in location]
+        longitudes = [point[1] for point in location]
+        names = None
+        if all(len(point) > 2 for point in location):
+            names = [point[2] for point in location]
+        logger.debug('Constraining location for '
+                     +cube.coord('simulation_label').points[0]+
+                     ' at '+str(len(location))+' points')
+        cube = loc.MultiPointLocation(latitudes, longitudes, cube, names,
+                                      cache=grid_cache)
+        cube = cube.find_points()
+    elif len(location) == 2:
+        latitude_point = location[0]
+        longitude_point = location[1]
+        logger.debug('Constraining location for '
+                     +cube.coord('simulation_label').points[0]+
+                     ' at point:\n'+str(latitude_point)+'N '+
+                     str(longitude_point)+'E')
+        cube = loc.PointLocation(latitude_point, longitude_point, cube,
+                                 cache=grid_cache)
+        cube = cube.find_point()
+    elif len(location) == 4:
+        latitude_min = location[0]
+        latitude_max = location[1]
+        longitude_min = location[2]
+        longitude_max = location[3]
+        logger.debug('Constraining location for '+
+                     cube.coord('simulation_label').points[0]+
+                     ' over region:\nLatitude range: '+str(latitude_min)+
+                     'N to '+str(latitude_max)+'N\nLongitude range: '+
+                     str(longitude_min)+'E to '+str(longitude_max)+'E')
+        cube = loc.AreaLocation(latitude_min, latitude_max,
+                                longitude_min, longitude_max, cube,
+                                cache=grid_cache)
+        cube = cube.find_area()
+    return cube
+
+
+def unify_cube_format(cube, time_constr):
+    """
+    Ensure that all simulations have the same cube format i.e the same time
+    coordinates and calendar, attributes, data type and auxillary coords.
+    Time coordinate units and time point definitions can also be set.
+    Example: units are currently set to be unified as
+    'days since 1950-01-01 00:00:00' and daily data is defined at the hour
+    of midday.
+
+    :param iris.cube.Cube cube: Cube to reformat
+    :param np.array time_constr: A two element array for specifying start and
+    end year of data
+    :return iris.cube.Cube: Reformatted cube
+    """
+    logger.debug('Unifying formatting for '
+                 +cube.coord('simulation_label').points[0])
+    cube = format.change_calendar(cube, time_constr,
+                                  new_units='days since 1950-01-01 '
+                                            '00:00:00')
+    cube = format.add_extra_time_coords(cube)
+    cube = format.unify_data_type(cube)
+    cube = format.set_blank_attributes(cube)
+    cube = format.change_time_points(cube, hr=12) # daily data = midday
+    cube = format.change_time_bounds(cube)
+    cube = format.remove_extra_time_coords(cube)# remove non-essential coord
+    return cube
+
+
+def mask_bad_data(cube):
+    """
+    If bad points are known to exist in a dataset then these are masked.
+    Masking is lazy and, as this is the last operation, the data that
+    has now been reduced in space and time is computed.
+
+    :param iris.cube.Cube cube: Cube to reformat
+    :return iris.cube.Cube: Reformatted cube
+    """
+    simulation_label = cube.coord('simulation_label').points[0]
+
+    if 'CMCC-CM2-VHR4' in simulation_label:
+        dt = datetime(2003, 2, 2, 12, 0, 0)
+        tc = cube.coord('time')
+        numeric_date = cf_units.date2num(dt, tc.units.name,
+                                         tc.units.calendar)
+        time_point_array = np.where(tc.points==numeric_date)[0]
+        if len(time_point_array) == 0:
+            logger.warning('Cannot mask. {} not found in {}'.
+                           format(dt, simulation_label))
+        else:
+            time_point_index = time_point_array[0]
+            cube = format.mask_time_points(cube, [time_point_index])
+            logger.debug('Masking bad data for {} at {}'.
+                         format(simulation_label, dt))
+    else:
+        logger.debug('No data requires masking for {}'.format
+                     (simulation_label))
+    # this is the final operation, so the data has been reduced in space
+    # and time and can now be computed
+    cube = format.realise_data(cube)
+    return cube
+
+
+def unify_simulation(cube, location, time_constr, grid_cache=None):
+    """
+    Runs every operation on a single simulation in turn: unifying spatial
+    coordinates, constraining location, unifying cube format and masking bad
+    data. Run in one worker process per simulation so that only the lazy
+    input cube and the realised result, reduced in space and time, are sent
+    between processes.
+
+    :param iris.cube.Cube cube: Lazy cube of a single simulation
+    :param array location: An array to be used for constraining at location
+    :param np.array time_constr: A two element array for specifying start and
+    end year of data
+    :param GridCache grid_cache: Optional, persistent cache of grid bounds and
+    location indices
+    :return iris.cube.Cube: The unified, realised cube
+    """
+    cube = unify_spatial_coordinates(cube)
+    cube = constrain_location(cube, location, grid_cache)
+    cube = unify_cube_format(cube, time_constr)
+    cube = mask_bad_data(cube)
+    return cube
+
+
+def unify_simulation_years(job, location, grid_cache=None):
+    """
+    Runs 'unify_simulation' on a cube loaded for its own range of years, e.g.
+    the years missing from a cached series.
+
+    :param tuple job: Lazy cube of a single simulation and a two element
+    array specifying the start and end year of its data
+    :param array location: An array to be used for constraining at location
+    :param GridCache grid_cache: Optional, persistent cache of grid bounds and
+    location indices
+    :return iris.cube.Cube: The unified, realised cube
+    """
+    cube, time_constr = job
+    return unify_simulation(cube, location, time_constr, grid_cache)
+
+
 class SimulationsData:
     """
     Class containing all simulation data and the requested location. Methods
     within class are used to manipulate spatial coordinates, time dimensions
     and cube formatting in order to accurately plot and compare simulations.
+    Data remains lazy until it has been constrained in space and time.
 
     Note: All calendars are converted to a 360 day calendar by this script.
     Gregorian and 365 day calendars keep 31/01 and 31/03 to balance 28/02.
@@ -31,26 +202,46 @@ class SimulationsData:
     Example:
     SimulationsData(sim_list = a_raw_cube_list
                     loc = [30.2, 45.7], # or [30.2, 34.3, 45.7, 48.5] for area
+                                        # or [[30.2, 45.7], [51.5, 359.9]]
                     t_constr = [1950, 2010])
     """
     def __init__(self, sim_list=iris.cube.CubeList([]), loc=([]),
-                 t_constr=([])):
+                 t_constr=([]), grid_cache=None, pool=None,
+                 sim_t_constr=None):
         """
         Initialise the class.
 
         :param iris.cube.CubeList sim_list: Cube list containing concatenated
         lazy data for each simulation
         :param array loc: An array to be used for constraining at location
-        (a two element array for a point or four element array for regional
-        boundaries)
+        (a two element array for a point, four element array for regional
+        boundaries or a list of [lat, lon] or [lat, lon, name] points)
         :param array t_constr: A two element array for specifying start and
         end year of data
+        :param GridCache grid_cache: Optional, persistent cache of grid bounds
+        and location indices
+        :param WorkerPool pool: Optional, pool of worker processes shared by
+        every stage. The default pool is used if not given
+        :param list sim_t_constr: Optional, a two element array specifying
+        the start and end year of each cube in sim_list, e.g. when only the
+        years missing from cached series are loaded. t_constr is used for
+        every cube if not given
         """
         self.simulations_list = sim_list
         self.location = loc
         self.time_constraints = t_constr
+        self.simulations_time_constraints = sim_t_constr
+        self.grid_cache = grid_cache
+        self.pool = pool or get_default_pool()
+
+    def set_simulations_list(self, sim_list):
+        self.simulations_list = sim_list
 
     def __repr__(self):
+        if loc.is_multi_point(self.location):
+            return '{simulations_list}\n{points} points'.format(
+                simulations_list=self.simulations_list,
+                points=len(self.location))
         if len(self.location) == 2:
             return '{simulations_list}\n' \
                    '{latitude}N {longitude}E'.format(
@@ -67,6 +258,11 @@ class SimulationsData:
                 max_longitude=self.location[3])
 
     def __str__(self):
+        if loc.is_multi_point(self.location):
+            return 'Simulations List:\n{simulations_list}\n' \
+                   'Location:\n{points} points'.format(
+                simulations_list=self.simulations_list,
+                points=len(self.location))
         if len(self.location) == 2:
             return 'Simulations List:\n{simulations_list}\n' \
                    'Location:\n{latitude}N {longitude}E'.format(
@@ -87,158 +283,62 @@ class SimulationsData:
 
     def unify_spatial_coordinates(self, params, output):
         """
-        Ensures that all spatial dimensions are defined by the same coordinate
-        system: two 1D arrays of latitude and longitude coordinates.
-        Method for redefining spatial coordinates can be specific to each model.
-
-        :param iris.cube.Cube params: Cube to spatially unify
-        :param iris.cube.CubeList output: Cube list to contain spatially unified
-         cubes
-        :return iris.cube.Cube: Spatially unified cube
+        Queue based wrapper of 'unify_spatial_coordinates' kept for callers of
+        the previous per-process stages.
+
+        :param params: Queue holding the cube to spatially unify
+        :param list output: List to contain spatially unified cubes
         """
-        cube = params.get()
-        cube = format.redefine_spatial_coords(cube)
-        output.append(cube)
+        output.append(unify_spatial_coordinates(params.get()))
 
     def constrain_location(self, params, output):
         """
-        Subsets cube location to single point in the coordinate system (CS). If
-        self.location is a 2D array of latitude and longitude points a
-        PointLocation class is created and the nearest known point in the CS is
-        found. If self.location is a 4D array of min/max latitude and longitude
-        points an AreaLocation class is created finding all nearest known points
-        in the defined area and returning an area mean.
-
-        :param iris.cube.Cube params: Cube to constrain at location
-        :param iris.cube.CubeList output: Cube list to contain constrained cubes
-        :return iris.cube.Cube: Constrained cube
+        Queue based wrapper of 'constrain_location' at self.location.
+
+        :param params: Queue holding the cube to constrain at location
+        :param list output: List to contain constrained cubes
         """
-        cube = params.get()
-        if len(self.location) == 2:
-            latitude_point = self.location[0]
-            longitude_point = self.location[1]
-            logger.debug('Constraining location for '
-                         +cube.coord('simulation_label').points[0]+
-                         ' at point:\n'+str(latitude_point)+'N '+
-                         str(longitude_point)+'E')
-            cube = loc.PointLocation(latitude_point, longitude_point, cube)
-            cube = cube.find_point()
-            output.append(cube)
-        if len(self.location) == 4:
-            latitude_min = self.location[0]
-            latitude_max = self.location[1]
-            longitude_min = self.location[2]
-            longitude_max = self.location[3]
-            logger.debug('Constraining location for '+
-                         cube.coord('simulation_label').points[0]+
-                         ' over region:\nLatitude range: '+str(latitude_min)+
-                         'N to '+str(latitude_max)+'N\nLongitude range: '+
-                         str(longitude_min)+'E to '+str(longitude_max)+'E')
-            cube = loc.AreaLocation(latitude_min, latitude_max,
-                                       longitude_min, longitude_max, cube)
-            cube = cube.find_area()
-            output.append(cube)
+        output.append(constrain_location(params.get(), self.location,
+                                         self.grid_cache))
 
     def unify_cube_format(self, params, output, time_constr):
         """
-        Ensure that all simulations have the same cube format i.e the same time
-        coordinates and calendar, attributes, data type and auxillary coords.
-        Time coordinate units and time point definitions can also be set.
-        Example: units are currently set to be unified as
-        'days since 1950-01-01 00:00:00' and daily data is defined at the hour
-        of midday.
-
-        :param iris.cube.Cube params: Cube to reformat
-        :param iris.cube.CubeList output: Cube list to contain reformatted cubes
-        :param np.array t_constr: A two element array for specifying start and
-        end year of data
-        :return iris.cube.Cube: Reformatted cube
+        Queue based wrapper of 'unify_cube_format'.
+
+        :param params: Queue holding the cube to reformat
+        :param list output: List to contain reformatted cubes
+        :param np.array time_constr: A two element array for specifying start
+        and end year of data
         """
-        cube=params.get()
-        logger.debug('Unifying formatting for '
-                     +cube.coord('simulation_label').points[0])
-        cube = format.change_calendar(cube, time_constr,
-                                      new_units='days since 1950-01-01 '
-                                                '00:00:00')
-        cube = format.add_extra_time_coords(cube)
-        cube = format.unify_data_type(cube)
-        cube = format.set_blank_attributes(cube)
-        cube = format.change_time_points(cube, hr=12) # daily data = midday
-        cube = format.change_time_bounds(cube)
-        cube = format.remove_extra_time_coords(cube)# remove non-essential coord
-        output.append(cube)
+        output.append(unify_cube_format(params.get(), time_constr))
 
     def mask_bad_data(self, params, output):
         """
-        If bad points are known to exist in a dataset then these are masked.
+        Queue based wrapper of 'mask_bad_data'.
 
-        :param iris.cube.Cube params: Cube to reformat
-        :param iris.cube.CubeList output: Cube list to contain reformatted cubes
-        :param np.array t_constr: A two element array for specifying start and
-        end year of data
-        :return iris.cube.Cube: Reformatted cube
+        :param params: Queue holding the cube to mask
+        :param list output: List to contain masked, realised cubes
         """
-        cube=params.get()
-
-        simulation_label = cube.coord('simulation_label').points[0]
-
-        if 'CMCC-CM2-VHR4' in simulation_label:
-            dt = datetime(2003, 2, 2, 12, 0, 0)
-            tc = cube.coord('time')
-            numeric_date = cf_units.date2num(dt, tc.units.name,
-                                             tc.units.calendar)
-            time_point_array = np.where(tc.points==numeric_date)[0]
-            if len(time_point_array) == 0:
-                logger.warning('Cannot mask. {} not found in {}'.
-                               format(dt, simulation_label))
-            else:
-                time_point_index = time_point_array[0]
-                cube.data[time_point_index, ...] = np.ma.masked
-                logger.debug('Masking bad data for {} at {}'.
-                             format(simulation_label, dt))
-        else:
-            logger.debug('No data requires masking for {}'.format
-                         (simulation_label))
-        output.append(cube)
+        output.append(mask_bad_data(params.get()))
 
     def simulations_operations(self):
         """
         Perform all the above operations in parallel for each simulation the
-        user wishes to compare.
+        user wishes to compare. Each simulation is processed end to end by a
+        single worker process.
 
         :return self: self.simulations_list refactored as the unified cube list
         """
-        operations = ['unifying spatial coords', 'constraining location',
-                      'unifying cube format', 'mask_bad_data']
-        for oper in operations:
-            jobs = []
-            manager = Manager()
-            params = manager.Queue()
-            result_list = manager.list()
-            if oper == 'unifying spatial coords':
-                func = self.unify_spatial_coordinates
-                arguments = (params, result_list)
-            if oper == 'constraining location':
-                func = self.constrain_location
-                arguments = (params, result_list)
-            if oper == 'unifying cube format':
-                func = self.unify_cube_format
-                arguments = (params, result_list, self.time_constraints)
-            if oper == 'mask_bad_data':
-                func = self.mask_bad_data
-                arguments = (params, result_list)
-            max_simul_jobs = len(self.simulations_list)
-            for i in range(max_simul_jobs):
-                p = Process(target=func, args=arguments)
-                jobs.append(p)
-                p.start()
-            iters = itertools.chain(
-                self.simulations_list,(None,) * max_simul_jobs)
-            for iter in iters:
-                params.put(iter)
-            for j in jobs:
-                   j.join()
-            self.simulations_list = iris.cube.CubeList(list(result_list))
+        if self.simulations_time_constraints is None:
+            cubes = self.pool.map(unify_simulation, self.simulations_list,
+                                  self.location, self.time_constraints,
+                                  self.grid_cache)
+        else:
+            cubes = self.pool.map(unify_simulation_years,
+                                  zip(self.simulations_list,
+                                      self.simulations_time_constraints),
+                                  self.location, self.grid_cache)
+        self.simulations_list = iris.cube.CubeList(cubes)
         return self
 
 
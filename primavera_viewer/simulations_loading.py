@@ -7,15 +7,23 @@ Philip Rutter 14/08/18
 Module for loading and concatenation of data from multiple models and ensembles
 for a given variable.
 
+The configuration of the data directories is read when first needed, and iris
+and the formatting modules are imported when data is loaded, so that planning
+the files of a request does not pay for either.
+
 """
 import logging
+import os
 import warnings
 import json
-from multiprocessing import Process, Manager
-import itertools
-import iris
-from primavera_viewer.sim_format import (add_simulation_label,
-                                         change_time_units)
+from primavera_viewer.file_planner import plan_files
+from primavera_viewer.footprint import estimate_footprint
+from primavera_viewer.manifest import (dataset_files, load_manifest,
+                                       manifest_filename, save_manifest)
+from primavera_viewer.profiler import record_files_opened
+from primavera_viewer.result_cache import source_state
+from primavera_viewer.series_cache import missing_years
+from primavera_viewer.worker_pool import get_default_pool
 from datetime import datetime
 import sys
 
@@ -24,31 +32,195 @@ logger = logging.getLogger(__name__)
 # Ignore warnings displayed when loading data
 warnings.filterwarnings("ignore")
 
-# Load in json file containing data dirs
+# json file containing data dirs, read from the working directory when first
+# needed
 FILENAME = 'app_config.json'
-# Read the config file in
-with open(FILENAME) as fh:
-    app_config = json.load(fh)
+_app_config = None
+
+
+def get_app_config():
+    """
+    Returns the configuration of the data directory of each dataset, reading
+    it from the JSON configuration file on first use.
+
+    :return dict: The directory of each dataset key in DRS format
+    """
+    global _app_config
+    if _app_config is None:
+        with open(FILENAME) as fh:
+            _app_config = json.load(fh)
+    return _app_config
+
+
+def set_app_config(app_config):
+    """
+    Sets the configuration of the data directories, e.g. to one not read from
+    the working directory. None reads the JSON configuration file again when
+    next needed.
+
+    :param dict app_config: The directory of each dataset key in DRS format
+    """
+    global _app_config
+    _app_config = app_config
+
+
+# attributes set blank when the data of several files is concatenated
+CONCATENATE_ATTRIBUTES = ['creation_date', 'history', 'tracking_id', 'realm',
+                          'NCO', 'source']
+
+
+def concatenate_data(cubes):
+    """
+    Concatenates data for a single simulation.
+    :param iris.cube.CubeList cubes: A cube list of single cubes from a
+    single simulation forming a data set contiguous over the specified time
+    constraints
+    :return iris.cube.Cube: A single cube from the concatenated cube list
+    """
+    from primavera_viewer.sim_format import change_time_units
+    for cube in cubes:
+        # set attributes likely to disrupt concatenate to a blank string
+        cube = change_time_units(cube, 'days since 1950-01-01 00:00:00')
+        for attr in CONCATENATE_ATTRIBUTES:
+            cube.attributes[
+                attr] = ''
+    return cubes.concatenate_cube()
+
+
+def dataset_key(simulation):
+    """
+    Creates the key of a simulation's dataset in the JSON configuration file.
+
+    :param list simulation: A list in the format ['model','ensemble','variable']
+    :return str: The dataset key in DRS format
+    """
+    return 'CMIP6.HighResMIP.'+simulation[0]+'.highresSST-present.'+\
+           simulation[1]+'.day.'+simulation[2]
+
+
+def load_data(simulation, time_constr, location=([]), grid_cache=None,
+              files=None):
+    """
+    Loads data with defined constraints on time (year) for single simulation
+    assuming data directory can be found in the .json file. Only files
+    whose DRS date range overlaps the constraint are opened. Run in a worker
+    process for each simulation.
+
+    :param list simulation: A list in the format ['model','ensemble','variable']
+    :param array time_constr: A two element array in the format
+    [start year, end year]
+    :param array location: Optional, location constraint. Each file is reduced
+    to the region containing it
+    :param GridCache grid_cache: Optional, persistent cache of grid bounds
+    and location indices
+    :param list files: Optional, the files planned to be loaded. Planned from
+    the DRS filenames in the simulation's directory if not given
+    :return iris.cube.Cube: A single cube loaded and concatenated with
+    simulation data or None if no files contain data in the time constraint
+    """
+    import iris
+    from primavera_viewer.nearest_location import extract_region
+    from primavera_viewer.sim_format import (add_simulation_label,
+                                             change_time_units,
+                                             redefine_spatial_coords)
+    # constrain over the required time
+    constraints = iris.Constraint(time=lambda cell: time_constr[0]
+                                                    <= cell.point.year <
+                                                    time_constr[1])
+    dir = get_app_config()[dataset_key(simulation)]['directory']
+    logger.debug('Loading {} data for model ensemble {} {} from {}'.format(
+        simulation[2], simulation[0], simulation[1], dir))
+    # only open the files whose dates overlap the time constraint
+    if files is None:
+        files = plan_files(dir, time_constr)
+    if not files:
+        logger.warning('No {} data for model ensemble {} {} between {} '
+                       'and {}'.format(simulation[2], simulation[0],
+                                       simulation[1], time_constr[0],
+                                       time_constr[1]))
+        return None
+    record_files_opened(len(files))
+    cubes = iris.load(files, constraints)
+    cubes_diff_units = iris.cube.CubeList([])
+    for cube in cubes:
+        cube = change_time_units(cube, 'days since 1950-01-01 00:00:00')
+        # Add an aux coord unique to each simulation
+        cube = add_simulation_label(cube)
+        if location:
+            # extract the spatial hyperslab from each file before
+            # concatenation so only the required chunks are read
+            cube = redefine_spatial_coords(cube)
+            cube = extract_region(cube, location, grid_cache)
+        cubes_diff_units.append(cube)
+    # Concatenate data if file structure requires
+    if len(cubes) > 1:
+        cube = concatenate_data(cubes_diff_units)
+    else:
+        cube = cubes_diff_units[0]
+    return cube
+
+
+def load_planned_data(job, time_constr, location=([]), grid_cache=None):
+    """
+    Loads a simulation's planned files. Run in a worker process for each
+    simulation.
+
+    :param tuple job: The simulation, as a list in the format
+    ['model','ensemble','variable'], and the list of its files to load
+    :param array time_constr: A two element array in the format
+    [start year, end year]
+    :param array location: Optional, location constraint
+    :param GridCache grid_cache: Optional, persistent cache of grid bounds
+    and location indices
+    :return iris.cube.Cube: The loaded and concatenated cube or None
+    """
+    simulation, files = job
+    return load_data(simulation, time_constr, location, grid_cache, files)
+
+
+def load_planned_years(job, location=([]), grid_cache=None):
+    """
+    Loads a simulation's planned files within a range of years, e.g. the
+    years missing from its cached series. Run in a worker process for each
+    range.
+
+    :param tuple job: The simulation, as a list in the format
+    ['model','ensemble','variable'], the list of its files to load and the
+    years to load as a two element array in the format
+    [start year, end year]
+    :param array location: Optional, location constraint
+    :param GridCache grid_cache: Optional, persistent cache of grid bounds
+    and location indices
+    :return iris.cube.Cube: The loaded and concatenated cube or None
+    """
+    simulation, files, time_constr = job
+    return load_data(simulation, time_constr, location, grid_cache, files)
+
 
 class SimulationsLoading:
     """
     A class of simulations for a given variable defined by a model and ensemble
     member and a time constraint. Data for each simulation can be loaded,
     constrained in time and concatenated into a single cube to be held in a
-    output cube list.
+    output cube list. If a location is given each file is constrained to the
+    spatial region containing it before concatenation.
 
     Paths to each directory containing data can be altered in the json file
     'app_config.json'. Each pathway is linked to the corresponding CMIP6 data
-    reference syntax (DRS).
+    reference syntax (DRS). If a manifest of the directories has been created
+    with 'PRIMAVERA_manifest.py' loads are planned from it.
 
     Example:
     SimulationsLoading(var = ['tasmax'],
                        mod = ['MOHC.HadGEM3-GC31-LM', 'MOHC.HadGEM3-GC31-HM'
                               'CMCC.CMCC-CM2-HR4', ' ECMWF.ECMWF-IFS-LR']
                        ens = ['r1i1p1f1']
-                       constr = [1950, 2010])
+                       constr = [1950, 2010],
+                       loc = [30.2, 45.7])
     """
-    def __init__(self, var=list(), mod=list(), ens=list(), constr=([])):
+    def __init__(self, var=list(), mod=list(), ens=list(), constr=([]),
+                 loc=([]), grid_cache=None, manifest=None, pool=None,
+                 series_cache=None):
         """
         Initialise the class and create a list of the requested simulations that
         exist in the JSON configuration file.
@@ -61,21 +233,52 @@ class SimulationsLoading:
         in DRS format <member_id>
         :param array constr: Time bounds for constraining data. A two element
         array in the format [start year, end year]
+        :param array loc: Optional, location constraint in the format used by
+        SimulationsData. Each file is reduced to the region containing it
+        :param GridCache grid_cache: Optional, persistent cache of grid bounds
+        and location indices
+        :param dict manifest: Optional, file manifest of the configured
+        directories. Loaded from the sidecar of the JSON configuration file
+        if it exists and none is given
+        :param WorkerPool pool: Optional, pool of worker processes shared by
+        every stage. The default pool is used if not given
+        :param SeriesCache series_cache: Optional, persistent cache of unified
+        simulation series. Simulations found in it are not loaded
         """
         self.variable = var
         self.models = mod
         self.ensembles = ens
         self.constraints = constr
+        self.location = loc
+        self.grid_cache = grid_cache
+        self.manifest_path = None
+        if manifest is None:
+            self.manifest_path = manifest_filename(FILENAME)
+            manifest = load_manifest(self.manifest_path)
+        self.manifest = manifest
+        self.pool = pool or get_default_pool()
+        self.series_cache = series_cache
+        # series keys, cached series and the years missing from them by
+        # index of simulation, the index and years of each cube returned by
+        # 'load_all_data' and the key and token of each unified series
+        self.series_keys = dict()
+        self.cached_series = dict()
+        self.missing_years = dict()
+        self.loaded_parts = list()
+        self.series_ids = list()
         self.simulations_list = list()
+        try:
+            app_config = get_app_config()
+        except (OSError, ValueError) as err:
+            logger.error('Unable to read {}: {}'.format(FILENAME, err))
+            sys.exit()
         for v in self.variable:
             for m in self.models:
                 for e in self.ensembles:
                     variable = str(v)
                     model = str(m)
                     ensemble = str(e)
-                    data_required = 'CMIP6.HighResMIP.'+model+\
-                                    '.highresSST-present.'+ensemble+'.day.'\
-                                    +variable
+                    data_required = dataset_key([model, ensemble, variable])
                     # Create list of available simulations given data exists
                     try:
                         dir = app_config[data_required]['directory']
@@ -101,6 +304,15 @@ class SimulationsLoading:
     def set_constraints(self, constr):
         self.constraints = constr
 
+    def set_location(self, loc):
+        self.location = loc
+
+    def set_pool(self, pool):
+        self.pool = pool
+
+    def set_series_cache(self, series_cache):
+        self.series_cache = series_cache
+
     def __repr__(self):
         return 'Simulations:\n{simulations}'.format(
             simulations = self.simulations_list)
@@ -111,83 +323,240 @@ class SimulationsLoading:
 
     def concatenate_data(self, cubes):
         """
-        Concatenates data for a single simulation.
+        Wrapper of 'concatenate_data' kept for existing callers.
+
         :param iris.cube.CubeList cubes: A cube list of single cubes from a
-        single simulation forming a data set contiguous over the specified time
-        constraints
+        single simulation
         :return iris.cube.Cube: A single cube from the concatenated cube list
         """
-        attributes = ['creation_date', 'history', 'tracking_id', 'realm',
-                      'NCO', 'source']
-        for cube in cubes:
-            # set attributes likely to disrupt concatenate to a blank string
-            cube = change_time_units(cube, 'days since 1950-01-01 00:00:00')
-            for attr in attributes:
-                cube.attributes[
-                    attr] = ''
-        return cubes.concatenate_cube()
+        return concatenate_data(cubes)
 
     def load_data(self, params, output):
         """
-        Loads data with defined constraints on time (year) for single simulation
-        assuming data directory can be found in the .json file. Each load
-        operation performed in parallel.
+        Queue based wrapper of 'load_data' kept for callers of the previous
+        per-process loading.
 
-        :param list params: A list in the format ['model','ensemble','variable']
-        :param iris.cube.CubeList output: CubeList to contain loaded,
-        concatenated data for all simulations
-        :return iris.cube.Cube: A single cube loaded and concatenated with
-        simulation data
+        :param params: Queue holding a list in the format
+        ['model','ensemble','variable']
+        :param list output: List to contain the loaded, concatenated cube
         """
         simulation = params.get()
-        # constrain over the required time
-        constraints = iris.Constraint(time=lambda cell: self.constraints[0]
-                                                        <= cell.point.year <
-                                                        self.constraints[1])
-        data_required = 'CMIP6.HighResMIP.'+simulation[0]+\
-                        '.highresSST-present.'+simulation[1]+'.day.'\
-                        +simulation[2]
-        dir = app_config[data_required]['directory']
-        logger.debug('Loading {} data for model ensemble {} {} from {}'.format(
-            simulation[2], simulation[0], simulation[1], dir))
-        cubes = iris.load(dir + '/*.nc', constraints)
-        cubes_diff_units = iris.cube.CubeList([])
-        for cube in cubes:
-            cube = change_time_units(cube, 'days since 1950-01-01 00:00:00')
-            cubes_diff_units.append(cube)
-        # Concatenate data if file structure requires
-        if len(cubes) > 1:
-            cube = self.concatenate_data(cubes_diff_units)
-        else:
-            cube = cubes[0]
-        # Add an aux coord unique to each simulation
-        cube = add_simulation_label(cube)
-        output.append(cube)
+        cube = load_data(simulation, self.constraints, self.location,
+                         self.grid_cache, self.plan_data(simulation))
+        if cube is not None:
+            output.append(cube)
+
+    def plan_data(self, simulation, time_constr=None):
+        """
+        Plans the files of a simulation that contain data within the time
+        constraint. Files are planned from the manifest if it lists the
+        simulation's dataset, re-validating only new or modified files, and
+        otherwise from the DRS filenames in the simulation's directory.
+
+        :param list simulation: A list in the format
+        ['model','ensemble','variable']
+        :param array time_constr: Optional, a two element array in the format
+        [start year, end year]. self.constraints is used if not given
+        :return list: Sorted paths of the files to load
+        """
+        data_required = dataset_key(simulation)
+        dir = get_app_config()[data_required]['directory']
+        year_ranges = None
+        if self.manifest:
+            files, files_updated = dataset_files(self.manifest, data_required,
+                                                 dir)
+            if files is not None:
+                year_ranges = {
+                    filename: (metadata['start_year'], metadata['end_year'])
+                    if 'start_year' in metadata else None
+                    for filename, metadata in files.items()}
+            if files_updated and self.manifest_path:
+                # save the re-validated entry so it is only done once
+                try:
+                    save_manifest(self.manifest, self.manifest_path)
+                except OSError as err:
+                    logger.warning('Unable to update manifest {}: {}'.format(
+                        self.manifest_path, err))
+        if time_constr is None:
+            time_constr = self.constraints
+        return plan_files(dir, time_constr, year_ranges)
+
+    def footprint(self, simulation, files, time_constr):
+        """
+        Estimates the memory needed to load a simulation's planned files, from
+        the manifest where it records their shape and data type and otherwise
+        from their headers.
+
+        :param list simulation: A list in the format
+        ['model','ensemble','variable']
+        :param list files: Paths of the planned files
+        :param array time_constr: A two element array in the format
+        [start year, end year]
+        :return int: The estimated size in bytes of the loaded data
+        """
+        metadata = dict()
+        entry = (self.manifest or {}).get('datasets', {}).get(
+            dataset_key(simulation))
+        if entry:
+            metadata = {os.path.join(entry['directory'], name): file_metadata
+                        for name, file_metadata in entry['files'].items()}
+        footprint = estimate_footprint(
+            [(filename, metadata.get(filename, {})) for filename in files],
+            time_constr, self.location, simulation[2])
+        logger.debug('Estimated memory of {} {} {}: {} bytes'.format(
+            simulation[0], simulation[1], time_constr, footprint))
+        return footprint
+
+    def source_files(self):
+        """
+        Plans the files of every simulation, e.g. to identify the source data
+        of a cached result.
+
+        :return dict: Sorted paths of the files to load keyed by each
+        simulation's dataset key
+        """
+        return {dataset_key(simulation): self.plan_data(simulation)
+                for simulation in self.simulations_list}
+
+    def series_key(self, index):
+        """
+        Returns the key of a simulation's unified series in the series cache.
+
+        :param int index: Index of the simulation in self.simulations_list
+        :return str: Hexadecimal key of the series
+        """
+        if index not in self.series_keys:
+            self.series_keys[index] = self.series_cache.series_key(
+                dataset_key(self.simulations_list[index]), self.location)
+        return self.series_keys[index]
+
+    def load_cached_series(self):
+        """
+        Loads the unified series of each simulation found in the series cache
+        whose source files have not changed. Only the years of the time
+        constraint missing from these series are then loaded by
+        'load_all_data'.
+
+        :return iris.cube.CubeList: cube list of the cached unified cubes
+        found, which may cover only part of the time constraint
+        """
+        import iris.cube
+        self.cached_series = dict()
+        self.missing_years = dict()
+        if self.series_cache is None:
+            return iris.cube.CubeList([])
+        for index, simulation in enumerate(self.simulations_list):
+            entry = self.series_cache.get(self.series_key(index))
+            if entry is None:
+                continue
+            ranges = missing_years(self.constraints, entry['years'])
+            if ranges is None:
+                continue
+            if entry['sources'] != source_state(
+                    self.plan_data(simulation, entry['years'])):
+                logger.debug('Source files of the cached series of {} have '
+                             'changed'.format(simulation))
+                continue
+            logger.debug('Using cached series of {} for {} to {}'.format(
+                simulation, *entry['years']))
+            self.cached_series[index] = entry
+            self.missing_years[index] = ranges
+        return iris.cube.CubeList(entry['cube'] for entry in
+                                  self.cached_series.values())
+
+    def unified_series(self, cube_list):
+        """
+        Combines the unified cubes of the years loaded by 'load_all_data'
+        with the cached series, storing the new or extended series in the
+        series cache.
+
+        :param iris.cube.CubeList cube_list: The unified cubes in the order
+        returned by 'load_all_data'
+        :return iris.cube.CubeList: cube list of the unified cubes of every
+        simulation within the time constraint in the order of
+        self.simulations_list
+        """
+        import iris.cube
+        from primavera_viewer.sim_format import (concatenate_years,
+                                                 extract_years)
+        parts = dict()
+        for (index, years), cube in zip(self.loaded_parts, cube_list):
+            parts.setdefault(index, []).append((years, cube))
+        series = iris.cube.CubeList([])
+        self.series_ids = list()
+        for index in sorted(set(self.cached_series) | set(parts)):
+            entry = self.cached_series.get(index)
+            token = entry['token'] if entry else None
+            cubes = sorted(parts.get(index, []) +
+                           ([(entry['years'], entry['cube'])] if entry
+                            else []), key=lambda part: part[0][0])
+            years = [cubes[0][0][0], max(part[0][1] for part in cubes)]
+            if len(cubes) > 1:
+                files = self.plan_data(self.simulations_list[index], years)
+                # as if the years had been loaded at once
+                attributes = ({attr: '' for attr in CONCATENATE_ATTRIBUTES}
+                              if len(files) > 1 else None)
+                cube = concatenate_years([part[1] for part in cubes],
+                                         attributes)
+            else:
+                cube = cubes[0][1]
+            if self.series_cache is not None and index in parts:
+                token = self.series_cache.set_series(
+                    self.series_key(index), cube, years, source_state(
+                        self.plan_data(self.simulations_list[index], years)),
+                    token)
+            cube = extract_years(cube, self.constraints)
+            if cube is None:
+                continue
+            series.append(cube)
+            if self.series_cache is not None:
+                self.series_ids.append((self.series_key(index), token))
+        return series
+
+    def loaded_constraints(self):
+        """
+        Returns the years of each cube returned by 'load_all_data'.
+
+        :return list: Two element arrays in the format
+        [start year, end year]
+        """
+        return [years for index, years in self.loaded_parts]
 
     def load_all_data(self):
         """
         Loads data all simulations in self.simulations_list in parallel.
+        Simulations found by 'load_cached_series' are only loaded for the
+        years missing from their cached series.
 
         :return iris.cube.CubeList: cube list of fully loaded and concatenated
         data from each simulation
         """
+        import iris.cube
         sttime = datetime.now()
         logger.debug('Starting loading all at: '+str(sttime))
-        max_simul_jobs = len(self.simulations_list)
-        jobs = []
-        manager = Manager()
-        params = manager.Queue()
-        result_list = manager.list()
-        for i in range(max_simul_jobs):
-            p = Process(target=self.load_data, args=(params, result_list))
-            jobs.append(p)
-            p.start()
-        iters = itertools.chain(self.simulations_list,(None,) * max_simul_jobs)
-        for iter in iters:
-            params.put(iter)
-        for j in jobs:
-               j.join()
-        cube_list = iris.cube.CubeList(list(result_list))
+        parts = list()
+        for index in range(len(self.simulations_list)):
+            if index in self.cached_series:
+                parts.extend((index, years)
+                             for years in self.missing_years[index])
+            else:
+                parts.append((index, list(self.constraints)))
+        # plan here so that the manifest is re-validated and saved once and
+        # only each simulation's list of files is sent to a worker
+        jobs = [(self.simulations_list[index],
+                 self.plan_data(self.simulations_list[index], years), years)
+                for index, years in parts]
+        # with a memory budget the largest simulations are loaded first and
+        # only as many at once as fit within it
+        sizes = None
+        if self.pool.max_memory is not None:
+            sizes = [self.footprint(*job) for job in jobs]
+        cubes = self.pool.map(load_planned_years, jobs, self.location,
+                              self.grid_cache, sizes=sizes)
+        self.loaded_parts = [part for part, cube in zip(parts, cubes)
+                             if cube is not None]
+        cube_list = iris.cube.CubeList([cube for cube in cubes
+                                        if cube is not None])
         entime = datetime.now()
         logger.debug('Finished loading all at: '+str(entime))
-        return cube_list
\ No newline at end of file
+        return cube_list
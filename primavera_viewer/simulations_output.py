@@ -7,20 +7,103 @@ Philip Rutter 15/08/18
 Module defines a class 'SimulationsOutput' used to perform requested simulation
 statistics and results output. Results are displayed as a plot or '.nc' file
 """
-import itertools
 import logging
 import sys
 
 import iris
-import numpy as np
-from multiprocessing import Process, Manager
 from primavera_viewer import sim_statistics as stats
-from primavera_viewer import sim_format as format
-import iris.quickplot as qplt
-import matplotlib.pyplot as plt
+from primavera_viewer.nearest_location import is_multi_point
+from primavera_viewer.series_cache import missing_years
+from primavera_viewer.sim_format import (concatenate_years, extract_years,
+                                         time_point_years)
+from primavera_viewer.worker_pool import get_default_pool
 
 logger = logging.getLogger(__name__)
 
+# statistics that can be requested
+STATISTICS = ['annual_mean_timeseries', 'monthly_mean_timeseries',
+              'daily_anomaly_timeseries', 'monthly_mean_anomaly_timeseries',
+              'monthly_maximum_anomaly_timeseries']
+# statistics that aggregate each year or month separately, so that they can be
+# extended to new years without being performed on the years already done
+INCREMENTAL_STATISTICS = ['annual_mean_timeseries', 'monthly_mean_timeseries']
+
+
+def annual_mean_timeseries(cube):
+    """
+    Simulations data are aggregated by year and plotted as a time series for
+    the requested period. Includes the simulations mean time series.
+    """
+    return stats.annual_mean(cube)
+
+
+def monthly_mean_timeseries(cube):
+    """
+    Simulations data are aggregated by month and plotted as a time series
+    for the requested period. Includes the simulations mean time series.
+    """
+    monthly_analysis_cubes = stats.monthly_analysis(cube, ['mean'])
+    return monthly_analysis_cubes[0]
+
+
+def daily_anomaly_timeseries(cube):
+    """
+    Calculates the anomaly time series for each simulation based on daily
+    data. The anomaly is taken with respect to the mean from each month over
+    all years for the constrained time period.
+    """
+    return stats.daily_anomaly(cube)
+
+
+def monthly_mean_anomaly_timeseries(cube):
+    """
+    Calculates the anomaly time series for each simulation aggregated by
+    month. The anomaly is taken with respect to the mean from each month
+    over all years for the constrained time period.
+    """
+    return stats.monthly_mean_anomaly(cube)
+
+
+def monthly_maximum_anomaly_timeseries(cube):
+    """
+    Calculates the anomaly time series for each simulation aggregated by
+    month. The anomaly is taken with respect to the mean from each month
+    over all years for the constrained time period.
+    """
+    return stats.monthly_maximum_anomaly(cube)
+
+
+def extend_statistic(job, plot_func):
+    """
+    Performs a statistic in INCREMENTAL_STATISTICS only for the years of a
+    simulation that are missing from its cached statistic and combines the
+    two. Run in a worker process for each simulation.
+
+    :param tuple job: The unified cube of a single simulation and the cached
+    statistic of its series from 'SeriesCache.get', or None
+    :param plot_func: Module level function performing the statistic
+    :return tuple: The statistic over the years of the cube, the statistic
+    over these and the cached years, to be stored, and those years
+    """
+    cube, cached = job
+    years = time_point_years(cube)
+    years = [int(years[0]), int(years[-1]) + 1]
+    ranges = None
+    if cached is not None:
+        ranges = missing_years(years, cached['years'])
+    if ranges is None:
+        statistic = plot_func(cube)
+        return statistic, statistic, years
+    parts = [(cached['years'], cached['cube'])]
+    parts += [(part_years, plot_func(extract_years(cube, part_years)))
+              for part_years in ranges]
+    parts.sort(key=lambda part: part[0][0])
+    # the attributes of the statistic are those of the current series
+    statistic = concatenate_years([part[1] for part in parts],
+                                  cube.attributes)
+    all_years = [parts[0][0][0], max(part[0][1] for part in parts)]
+    return extract_years(statistic, years), statistic, all_years
+
 
 class SimulationsOutput:
     """
@@ -38,7 +121,9 @@ class SimulationsOutput:
     """
 
     def __init__(self, sim_list=iris.cube.CubeList([]), loc=([]),
-                 sim_mean=iris.cube.Cube([]), stats='', out='', filename=None):
+                 sim_mean=iris.cube.Cube([]), stats='', out='', filename=None,
+                 pool=None, result_cache=None, cache_key=None,
+                 series_cache=None, series_ids=None):
         """
         Initialise the class.
 
@@ -46,8 +131,8 @@ class SimulationsOutput:
         data unified in structure and formatting and constrained at a time and
         spatial coords.
         :param array loc: An array to be used for constraining at location
-        (a two element array for a point or four element array for regional
-        boundaries)
+        (a two element array for a point, four element array for regional
+        boundaries or a list of [lat, lon] or [lat, lon, name] points)
         :param iris.cube.Cube sim_mean: A single cube with data corresponding to
         the simulations list mean
         :param str stats: Statistical operation to be performed on all data. For
@@ -55,6 +140,17 @@ class SimulationsOutput:
         on GitHub at: https://github.com/PRIMAVERA-H2020/primavera-viewer/wiki
         :param str out: Output required. (visit above wiki to see options)
         :param str filename: Optional, filename to save the output files as.
+        :param WorkerPool pool: Optional, pool of worker processes shared by
+        every stage. The default pool is used if not given
+        :param ResultCache result_cache: Optional, persistent cache of
+        completed statistics
+        :param str cache_key: Optional, key of the statistics in the result
+        cache from 'ResultCache.request_key'
+        :param SeriesCache series_cache: Optional, persistent cache of unified
+        simulation series and their statistics
+        :param list series_ids: Optional, the key and token of the cached
+        series of each cube in sim_list from
+        'SimulationsLoading.unified_series'
         """
         self.simulations_list = sim_list
         self.location = loc
@@ -65,54 +161,41 @@ class SimulationsOutput:
             self.filename = filename
         else:
             self.filename = 'primavera_comparison'
+        self.pool = pool or get_default_pool()
+        self.result_cache = result_cache
+        self.cache_key = cache_key
+        self.series_cache = series_cache
+        self.series_ids = series_ids or list()
 
     def annual_mean_timeseries(self, params, output):
         """
-        Simulations data are aggregated by year and plotted as a time series for
-        the requested period. Includes the simulations mean time series.
+        Queue based wrapper of 'annual_mean_timeseries'.
         """
-        cube = params.get()
-        annual_mean = stats.annual_mean(cube)
-        output.append(annual_mean)
+        output.append(annual_mean_timeseries(params.get()))
 
     def monthly_mean_timeseries(self, params, output):
         """
-        Simulations data are aggregated by month and plotted as a time series
-        for the requested period. Includes the simulations mean time series.
+        Queue based wrapper of 'monthly_mean_timeseries'.
         """
-        cube = params.get()
-        monthly_analysis_cubes = stats.monthly_analysis(cube)
-        output.append(monthly_analysis_cubes[0])
+        output.append(monthly_mean_timeseries(params.get()))
 
     def daily_anomaly_timeseries(self, params, output):
         """
-        Calculates the anomaly time series for each simulation based on daily
-        data. The anomaly is taken with respect to the mean from each month over
-        all years for the constrained time period.
+        Queue based wrapper of 'daily_anomaly_timeseries'.
         """
-        cube = params.get()
-        month_anomaly = stats.daily_anomaly(cube)
-        output.append(month_anomaly)
+        output.append(daily_anomaly_timeseries(params.get()))
 
     def monthly_mean_anomaly_timeseries(self, params, output):
         """
-        Calculates the anomaly time series for each simulation aggregated by
-        month. The anomaly is taken with respect to the mean from each month
-        over all years for the constrained time period.
+        Queue based wrapper of 'monthly_mean_anomaly_timeseries'.
         """
-        cube = params.get()
-        month_anomaly = stats.monthly_mean_anomaly(cube)
-        output.append(month_anomaly)
+        output.append(monthly_mean_anomaly_timeseries(params.get()))
 
     def monthly_maximum_anomaly_timeseries(self, params, output):
         """
-        Calculates the anomaly time series for each simulation aggregated by
-        month. The anomaly is taken with respect to the mean from each month
-        over all years for the constrained time period.
+        Queue based wrapper of 'monthly_maximum_anomaly_timeseries'.
         """
-        cube = params.get()
-        month_anomaly = stats.monthly_maximum_anomaly(cube)
-        output.append(month_anomaly)
+        output.append(monthly_maximum_anomaly_timeseries(params.get()))
 
     def lighten_color(self, color, amount=0.5):
         """
@@ -136,97 +219,103 @@ class SimulationsOutput:
 
     def simulations_statistics(self):
         """
-        Performs the statistics for all simulations cubes in parallel.
-        Currently has to merge cubes for anomaly plot outside of the
-        parallelisation due to errors.
+        Performs the statistics for all simulations cubes in parallel. Each
+        simulation's statistic is returned as a single cube. Statistics are
+        returned from and stored in the result cache if one is given.
         """
+        if self.result_cache is not None and self.cache_key:
+            cube_list = self.result_cache.get(self.cache_key)
+            if cube_list is not None:
+                return cube_list
 
         # Perform statistical analysis of cubes in parallel
-        jobs = []
-        manager = Manager()
-        params = manager.Queue()
-        result_list = manager.list()
+        # the mean of a single simulation is an empty cube
+        has_mean = bool(self.simulations_mean.coords('simulation_label'))
         if self.statistics == 'annual_mean_timeseries':
-            plot_func = self.annual_mean_timeseries
-            arguments = (params, result_list)
-            self.simulations_list.append(self.simulations_mean)
+            plot_func = annual_mean_timeseries
+            if has_mean:
+                self.simulations_list.append(self.simulations_mean)
         elif self.statistics == 'monthly_mean_timeseries':
-            plot_func = self.monthly_mean_timeseries
-            arguments = (params, result_list)
-            self.simulations_list.append(self.simulations_mean)
+            plot_func = monthly_mean_timeseries
+            if has_mean:
+                self.simulations_list.append(self.simulations_mean)
         elif self.statistics == 'daily_anomaly_timeseries':
-            plot_func = self.daily_anomaly_timeseries
-            arguments = (params, result_list)
+            plot_func = daily_anomaly_timeseries
         elif self.statistics == 'monthly_mean_anomaly_timeseries':
-            plot_func = self.monthly_mean_anomaly_timeseries
-            arguments = (params, result_list)
+            plot_func = monthly_mean_anomaly_timeseries
         elif self.statistics == 'monthly_maximum_anomaly_timeseries':
-            plot_func = self.monthly_maximum_anomaly_timeseries
-            arguments = (params, result_list)
+            plot_func = monthly_maximum_anomaly_timeseries
         else:
             logger.error('Specified plotting is not permitted')
             sys.exit()
-        max_simul_jobs = len(self.simulations_list)
-        for i in range(max_simul_jobs):
-            p = Process(target=plot_func, args=arguments)
-            jobs.append(p)
-            p.start()
-        iters = itertools.chain(
-            self.simulations_list, (None,) * max_simul_jobs)
-        for iter in iters:
-            params.put(iter)
-        for j in jobs:
-            j.join()
-
-        # Problem with merging monthly anomaly cubes inside parallel branches
-        # must complete merge outside of the loop
-        if self.statistics == 'monthly_mean_anomaly_timeseries':
-            cube_list = iris.cube.CubeList([])
-            for i in np.arange(0, len(result_list), 1):
-                cubes = result_list[i]
-                for ocube in cubes:
-                    if ocube.data.dtype != np.float32:
-                        ocube.data = ocube.data.astype(np.float32)
-                cube = cubes.merge_cube()
-                cube = format.change_time_points(cube, dy=1, hr=00)
-                cube_list.append(cube)
-        elif self.statistics == 'monthly_maximum_anomaly_timeseries':
-            cube_list = iris.cube.CubeList([])
-            for i in np.arange(0, len(result_list), 1):
-                cubes = result_list[i]
-                for ocube in cubes:
-                    if ocube.data.dtype != np.float32:
-                        ocube.data = ocube.data.astype(np.float32)
-                cube = cubes.merge_cube()
-                cube = format.change_time_points(cube, dy=1, hr=00)
-                cube_list.append(cube)
-        elif self.statistics == 'daily_anomaly_timeseries':
-            cube_list = iris.cube.CubeList([])
-            for i in np.arange(0, len(result_list), 1):
-                cubes = result_list[i]
-                for ocube in cubes:
-                    if ocube.data.dtype != np.float32:
-                        ocube.data = ocube.data.astype(np.float32)
-                cube = cubes.merge_cube()
-                cube = format.change_time_points(cube, hr=00)
-                cube_list.append(cube)
+        if (self.statistics in INCREMENTAL_STATISTICS and
+                self.series_cache is not None and self.series_ids):
+            cube_list = self.extended_statistics(plot_func)
         else:
-            cube_list = result_list
+            cube_list = iris.cube.CubeList(
+                self.pool.map(plot_func, self.simulations_list))
+        if self.result_cache is not None and self.cache_key:
+            self.result_cache.set(self.cache_key, cube_list)
         return cube_list
 
-    def simulations_result(self):
+    def extended_statistics(self, plot_func):
+        """
+        Performs a statistic in INCREMENTAL_STATISTICS for all simulations
+        cubes in parallel, starting from the statistics of their cached
+        series. New or extended statistics are stored in the series cache.
+
+        :param plot_func: Module level function performing the statistic
+        :return iris.cube.CubeList: The statistic of each simulation
+        """
+        keys = [self.series_cache.statistic_key(series_key, self.statistics)
+                for series_key, token in self.series_ids]
+        jobs = []
+        for index, cube in enumerate(self.simulations_list):
+            cached = None
+            if index < len(keys):
+                cached = self.series_cache.get(keys[index])
+                # statistics of a replaced series are performed again
+                if (cached is not None and
+                        cached['token'] != self.series_ids[index][1]):
+                    cached = None
+            jobs.append((cube, cached))
+        cube_list = iris.cube.CubeList([])
+        results = self.pool.map(extend_statistic, jobs, plot_func)
+        for index, (job, result) in enumerate(zip(jobs, results)):
+            statistic, all_statistic, all_years = result
+            if index < len(keys) and (job[1] is None or
+                                      all_years != job[1]['years']):
+                self.series_cache.set_statistic(keys[index], all_statistic,
+                                                all_years,
+                                                self.series_ids[index][1])
+            cube_list.append(statistic)
+        return cube_list
+
+    def simulations_result(self, result_cubes=None):
         """
         Handles the output of the primevera-viewer tool, either a plot or a
         '.nc' file
+
+        :param iris.cube.CubeList result_cubes: Optional, statistics already
+        performed, e.g. found in the result cache. Performed if not given
         """
 
-        result_cubes = self.simulations_statistics()
+        if (is_multi_point(self.location) and
+                self.output in ['plot', 'both']):
+            logger.error('Plot output is not available for multiple points')
+            sys.exit()
+
+        if result_cubes is None:
+            result_cubes = self.simulations_statistics()
 
-        if len(self.location) == 2:
+        if is_multi_point(self.location):
+            plot_title = (result_cubes[0].long_name + '\nat '
+                          + str(len(self.location)) + ' points')
+        elif len(self.location) == 2:
             plot_title = (result_cubes[0].long_name + '\nat Lat: '
                           + str(self.location[0]) + 'N  Lon: '
                           + str(self.location[1]) + 'E')
-        if len(self.location) == 4:
+        elif len(self.location) == 4:
             plot_title = (result_cubes[0].long_name + '\n over Lat range: '
                           + str(self.location[0]) + 'N to '
                           + str(self.location[1]) + 'N Longitude range: '
@@ -242,6 +331,9 @@ class SimulationsOutput:
                       netcdf_format="NETCDF3_CLASSIC")
         # Optional plot output
         if self.output in ['plot', 'both']:
+            # plotting is imported only when a plot is requested
+            import iris.quickplot as qplt
+            import matplotlib.pyplot as plt
             fig = plt.figure()
             # Plot the primavera comparison results
             colours = ['r','b','#1f77b4', '#ff7f0e',
@@ -261,4 +353,9 @@ class SimulationsOutput:
             plt.title(plot_title)
             plt.grid(True)
             fig.savefig(self.filename + '.png')
+            # figures are kept until closed, e.g. over a batch of requests
+            plt.close(fig)
+        if self.result_cache is not None and self.cache_key:
+            self.result_cache.set_outputs(self.cache_key, self.output,
+                                          self.filename)
 
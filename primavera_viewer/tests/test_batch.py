@@ -0,0 +1,70 @@
+"""
+Tests for primavera_viewer.batch
+"""
+import unittest
+from unittest import mock
+from primavera_viewer import batch
+
+
+def request(statistics, location, years=(1950, 2000), filename=None):
+    """
+    Creates a request as returned by 'request_from_args'.
+    """
+    return {'variable': ['tasmax'], 'models': ['MOHC.HadGEM3-GC31-LM'],
+            'ensembles': ['r1i1p1f1'], 'statistics': statistics,
+            'output_type': 'netCDF', 'time_constraints': list(years),
+            'location_constraints': location, 'filename': filename}
+
+
+class TestBatch(unittest.TestCase):
+
+    batch = batch
+
+    def setUp(self):
+        self.requests = [
+            request('annual_mean_timeseries', [51.5, 359.9]),
+            request('monthly_mean_timeseries', [51.5, 359.9]),
+            request('annual_mean_timeseries', [30., 60., -20., 20.]),
+            request('annual_mean_timeseries', [51.5, 359.9], (1950, 2014),
+                    'longer')]
+
+    def test_group_requests_case(self):
+        """
+        Tests requests are grouped by their simulations and years and then
+        by their location, in order
+        """
+        groups = self.batch.group_requests(self.requests)
+        self.assertEqual([[len(requests) for requests in locations.values()]
+                          for locations in groups.values()], [[2, 1], [1]])
+        self.assertEqual(self.batch.group_key(self.requests[0]),
+                         self.batch.group_key(
+                             request('daily_anomaly_timeseries', [0., 0.],
+                                     (1950., 2000.))))
+
+    def test_run_batch_case(self):
+        """
+        Tests each group is loaded once, each location is unified once and
+        every request is output under its own filename
+        """
+        with mock.patch.object(self.batch, 'SimulationsLoading') as loading, \
+                mock.patch.object(self.batch, 'SimulationsData') as data, \
+                mock.patch.object(self.batch, 'SimulationsOutput') as output:
+            loading.return_value.load_all_data.return_value = []
+            self.batch.run_batch(self.requests, pool=mock.Mock())
+        self.assertEqual(loading.return_value.load_all_data.call_count, 2)
+        # a single location is reduced to its region while loading
+        self.assertEqual([call[1]['loc'] for call in loading.call_args_list],
+                         [[], [51.5, 359.9]])
+        self.assertEqual(data.call_count, 3)
+        self.assertEqual([call[0][3:6] for call in output.call_args_list],
+                         [('annual_mean_timeseries', 'netCDF',
+                           'primavera_comparison_0'),
+                          ('monthly_mean_timeseries', 'netCDF',
+                           'primavera_comparison_1'),
+                          ('annual_mean_timeseries', 'netCDF',
+                           'primavera_comparison_2'),
+                          ('annual_mean_timeseries', 'netCDF', 'longer')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Tests for primavera_viewer.file_planner
+"""
+import os
+import tempfile
+import unittest
+import netCDF4
+import numpy as np
+from primavera_viewer.file_planner import *
+
+
+class TestFilePlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+        for year in range(1950, 2015):
+            filename = 'tasmax_day_HadGEM3-GC31-LM_highresSST-present_' \
+                       'r1i1p1f1_gn_{0}0101-{0}1230.nc'.format(year)
+            open(os.path.join(self.directory, filename), 'w').close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_netcdf(self, filename, start_year, end_year):
+        """
+        Writes a netCDF file with a 360 day calendar time coordinate
+        """
+        with netCDF4.Dataset(os.path.join(self.directory, filename),
+                             'w') as dataset:
+            dataset.createDimension('time', None)
+            time = dataset.createVariable('time', 'f8', ('time',))
+            time.units = 'days since 1950-01-01 00:00:00'
+            time.calendar = '360_day'
+            time[:] = np.arange((start_year - 1950) * 360,
+                                (end_year - 1950 + 1) * 360) + 0.5
+
+    def test_parse_year_range_case(self):
+        """
+        Tests parsing DRS date ranges of different precision
+        """
+        self.assertEqual(parse_year_range(
+            'tasmax_day_EC-Earth3_highresSST-present_r1i1p1f1_gr_'
+            '19500101-19501231.nc'), (1950, 1950))
+        self.assertEqual(parse_year_range(
+            'tas_Amon_CMCC-CM2-HR4_highresSST-present_r1i1p1f1_gn_'
+            '195001-201412.nc'), (1950, 2014))
+        self.assertIsNone(parse_year_range('tasmax_1950.nc'))
+
+    def test_plan_one_year_case(self):
+        """
+        Tests a one year request opens one file
+        """
+        files = plan_files(self.directory, [1960, 1961])
+        self.assertEqual([os.path.basename(f)[-20:] for f in files],
+                         ['19600101-19601230.nc'])
+
+    def test_plan_period_case(self):
+        """
+        Tests a ten year request opens the ten overlapping files
+        """
+        files = plan_files(self.directory, [2005, 2015])
+        self.assertEqual(len(files), 10)
+
+    def test_header_fallback_case(self):
+        """
+        Tests files not following the DRS are planned from their headers
+        """
+        self.write_netcdf('early.nc', 1930, 1939)
+        self.write_netcdf('late.nc', 2020, 2029)
+        self.assertEqual(read_year_range(
+            os.path.join(self.directory, 'early.nc')), (1930, 1939))
+        files = plan_files(self.directory, [1935, 1951])
+        self.assertEqual([os.path.basename(f)[-20:] for f in files],
+                         ['early.nc', '19500101-19501230.nc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Tests for primavera_viewer.footprint
+"""
+import os
+import tempfile
+import unittest
+from primavera_viewer.footprint import (estimate_footprint, parse_size,
+                                        region_cells)
+from primavera_viewer.tests.test_simulations_loading import write_year
+
+
+class TestFootprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for year in [1950, 1951]:
+            write_year(self.tmp_dir.name, year)
+        self.files = sorted(os.path.join(self.tmp_dir.name, name)
+                            for name in os.listdir(self.tmp_dir.name))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_size_case(self):
+        """
+        Tests sizes are parsed with and without binary suffixes
+        """
+        self.assertEqual(parse_size('1024'), 1024)
+        self.assertEqual(parse_size('512M'), 512 * 1024 ** 2)
+        self.assertEqual(parse_size('1.5GiB'), 3 * 1024 ** 3 // 2)
+        with self.assertRaises(ValueError):
+            parse_size('lots')
+
+    def test_region_cells_case(self):
+        """
+        Tests the cells of a point, points, an area and the globe
+        """
+        self.assertEqual(region_cells([51.5, 359.9], [12, 24]), 1)
+        self.assertEqual(region_cells([[0., 0.], [10., 10.]], [12, 24]), 4)
+        self.assertEqual(region_cells([0., 90., 350., 10.], [12, 24]), 12)
+        self.assertEqual(region_cells([-90., 90., 0., 360.], [12, 24]), 288)
+        self.assertEqual(region_cells([], [12, 24]), 288)
+
+    def test_estimate_case(self):
+        """
+        Tests the footprint is found from headers, or from metadata without
+        opening the files, and only counts the requested years and region
+        """
+        year_bytes = 360 * 12 * 24 * 4
+        files = [(filename, {}) for filename in self.files]
+        self.assertEqual(estimate_footprint(files, [1950, 1952],
+                                            variable='tasmax'),
+                         2 * year_bytes)
+        self.assertEqual(estimate_footprint(files, [1951, 1960],
+                                            variable='tasmax'), year_bytes)
+        self.assertEqual(estimate_footprint(files, [1950, 1952],
+                                            [51.5, 359.9], 'tasmax'),
+                         2 * 360 * 4)
+        metadata = {'shape': [720, 12, 24], 'dtype': '<f8',
+                    'start_year': 1950, 'end_year': 1951}
+        self.assertEqual(estimate_footprint([('missing.nc', metadata)],
+                                            [1950, 1951]),
+                         360 * 12 * 24 * 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Tests for primavera_viewer.grid_cache
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+from iris.tests.stock import realistic_3d
+from primavera_viewer.grid_cache import GridCache, location_key
+from primavera_viewer.nearest_location import (AreaLocation, PointLocation,
+                                               set_spatial_bounds)
+
+
+class TestGridCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # the stock grid is smaller than the default minimum cached size
+        self.cache = GridCache(self.tmp_dir.name, min_cells=1)
+        self.stock_cube = realistic_3d()
+        self.stock_cube.coord('grid_latitude').rename('latitude')
+        self.stock_cube.coord('grid_longitude').rename('longitude')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_bounds_restored_case(self):
+        """
+        Tests bounds guessed in one run are restored from disk in the next
+        """
+        self.assertFalse(self.cache.get_bounds(self.stock_cube))
+        PointLocation(-1.51, 3.78, self.stock_cube, cache=self.cache) \
+            .find_point()
+        new_cache = GridCache(self.tmp_dir.name, min_cells=1)
+        new_cube = realistic_3d()
+        new_cube.coord('grid_latitude').rename('latitude')
+        new_cube.coord('grid_longitude').rename('longitude')
+        self.assertTrue(new_cache.get_bounds(new_cube))
+        self.assertEqual(new_cube.coord('latitude').bounds.tolist(),
+                         self.stock_cube.coord('latitude').bounds.tolist())
+
+    def test_location_cached_case(self):
+        """
+        Tests resolved point and area indices are reused
+        """
+        point_cube = PointLocation(-1.51, 3.78, self.stock_cube,
+                                   cache=self.cache).find_point()
+        area_cube = AreaLocation(-2.92, 1.63, 0.35, 3.89, self.stock_cube,
+                                 cache=self.cache).find_area()
+        new_cache = GridCache(self.tmp_dir.name, min_cells=1)
+        self.assertEqual(new_cache.get_location(
+            self.stock_cube, location_key('point', -1.51, 3.78)), [2, 9])
+        cached_point = PointLocation(-1.51, 3.78, self.stock_cube,
+                                     cache=new_cache).find_point()
+        cached_area = AreaLocation(-2.92, 1.63, 0.35, 3.89, self.stock_cube,
+                                   cache=new_cache).find_area()
+        for cached, expected in [(cached_point, point_cube),
+                                 (cached_area, area_cube)]:
+            np.testing.assert_array_equal(cached.data, expected.data)
+            self.assertEqual(cached.coord('latitude').points,
+                             expected.coord('latitude').points)
+            self.assertEqual(cached.coord('longitude').points,
+                             expected.coord('longitude').points)
+
+    def test_file_bounds_kept_case(self):
+        """
+        Tests bounds read from a file are not replaced by cached guessed
+        bounds and give a different grid fingerprint
+        """
+        guessed_cube = self.stock_cube.copy()
+        set_spatial_bounds(guessed_cube, self.cache)
+        file_cube = self.stock_cube.copy()
+        file_bounds = guessed_cube.coord('latitude').bounds + 0.1
+        file_cube.coord('latitude').bounds = file_bounds
+        set_spatial_bounds(file_cube, self.cache)
+        np.testing.assert_array_equal(file_cube.coord('latitude').bounds,
+                                      file_bounds)
+        np.testing.assert_array_equal(file_cube.coord('longitude').bounds,
+                                      guessed_cube.coord('longitude').bounds)
+        self.assertNotEqual(self.cache.fingerprint(file_cube),
+                            self.cache.fingerprint(guessed_cube))
+
+    def test_small_grid_case(self):
+        """
+        Tests grids smaller than the minimum size are not cached
+        """
+        self.cache.min_cells = 4096
+        PointLocation(-1.51, 3.78, self.stock_cube, cache=self.cache) \
+            .find_point()
+        self.assertFalse(os.path.exists(self.tmp_dir.name) and
+                         os.listdir(self.tmp_dir.name))
+
+    def test_location_eviction_case(self):
+        """
+        Tests the least recently used locations are evicted
+        """
+        self.cache.max_locations = 2
+        for key in ['a', 'b', 'c']:
+            self.cache.set_location(self.stock_cube, key, [0, 0])
+        self.assertIsNone(self.cache.get_location(self.stock_cube, 'a'))
+        self.assertEqual(self.cache.get_location(self.stock_cube, 'c'),
+                         [0, 0])
+
+    def test_grid_eviction_case(self):
+        """
+        Tests the least recently used grids are evicted beyond the max size
+        """
+        self.cache.set_location(self.stock_cube, 'a', [0, 0])
+        self.cache.max_size = 0
+        self.cache.evict()
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Tests the command line tool starts without importing iris, matplotlib or dask
+or reading the configuration of the data directories
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+COMPARISON = os.path.join(ROOT, 'bin', 'PRIMAVERA_comparison.py')
+HEAVY_MODULES = ['iris', 'matplotlib', 'dask']
+
+# runs the command line tool and prints the heavy modules it imported and
+# whether it read the configuration
+SCRIPT = '''
+import json
+import runpy
+import sys
+sys.argv = [{comparison!r}] + {args!r}
+try:
+    runpy.run_path({comparison!r}, run_name='__main__')
+except SystemExit:
+    pass
+from primavera_viewer import simulations_loading
+print(json.dumps({{
+    'modules': sorted(name for name in sys.modules
+                      if name.split('.')[0] in {heavy!r}),
+    'config_read': simulations_loading._app_config is not None}}))
+'''
+
+
+def run_comparison(args):
+    """
+    Runs the command line tool in a new process in an empty directory.
+
+    :param list args: Command line arguments
+    :return dict: The heavy modules imported and whether the configuration
+    was read
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    with tempfile.TemporaryDirectory() as directory:
+        process = subprocess.run(
+            [sys.executable, '-c', SCRIPT.format(comparison=COMPARISON,
+                                                 args=args,
+                                                 heavy=HEAVY_MODULES)],
+            cwd=directory, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+class TestImports(unittest.TestCase):
+
+    def test_help_case(self):
+        """
+        Tests '--help' imports no heavy modules
+        """
+        result = run_comparison(['--help'])
+        self.assertEqual(result['modules'], [])
+        self.assertFalse(result['config_read'])
+
+    def test_invalid_args_case(self):
+        """
+        Tests a request missing options is rejected without importing heavy
+        modules or reading the configuration
+        """
+        result = run_comparison(['-var', 'tasmax', '-mod',
+                                 'MOHC.HadGEM3-GC31-LM'])
+        self.assertEqual(result['modules'], [])
+        self.assertFalse(result['config_read'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests for primavera_viewer.manifest
+"""
+import os
+import tempfile
+import unittest
+import netCDF4
+import numpy as np
+from primavera_viewer.file_planner import plan_files
+from primavera_viewer.manifest import (build_manifest, dataset_files,
+                                       load_manifest, save_manifest)
+
+KEY = 'CMIP6.HighResMIP.MOHC.HadGEM3-GC31-LM.highresSST-present.r1i1p1f1.' \
+      'day.tasmax'
+
+
+def write_file(filename, start_day, ntime):
+    """
+    Writes a small daily netCDF file on a 360 day calendar.
+    """
+    with netCDF4.Dataset(filename, 'w') as dataset:
+        dataset.createDimension('time', ntime)
+        dataset.createDimension('lat', 2)
+        dataset.createDimension('lon', 3)
+        time = dataset.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 1950-01-01 00:00:00'
+        time.calendar = '360_day'
+        time[:] = np.arange(start_day, start_day + ntime) + 0.5
+        tasmax = dataset.createVariable('tasmax', 'f4', ('time', 'lat', 'lon'))
+        tasmax[:] = np.zeros((ntime, 2, 3))
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+        # the second file's name does not follow the DRS
+        write_file(os.path.join(self.directory, 'a.nc'), 0, 360)
+        write_file(os.path.join(self.directory, 'b.nc'), 720, 360)
+        self.app_config = {KEY: {'directory': self.directory}}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_metadata_case(self):
+        """
+        Tests the time range, calendar and shape of each file are recorded
+        """
+        manifest = build_manifest(self.app_config)
+        metadata = manifest['datasets'][KEY]['files']['b.nc']
+        self.assertEqual((metadata['start_year'], metadata['end_year']),
+                         (1952, 1952))
+        self.assertEqual(metadata['calendar'], '360_day')
+        self.assertEqual(metadata['shape'], [360, 2, 3])
+        self.assertEqual(metadata['dtype'], '<f4')
+
+    def test_round_trip_case(self):
+        """
+        Tests a saved manifest is loaded unchanged
+        """
+        filename = os.path.join(self.directory, 'manifest.json')
+        manifest = build_manifest(self.app_config)
+        save_manifest(manifest, filename)
+        self.assertEqual(load_manifest(filename), manifest)
+        self.assertIsNone(load_manifest(os.path.join(self.directory,
+                                                     'missing.json')))
+
+    def test_revalidation_case(self):
+        """
+        Tests only new, modified or removed files are updated
+        """
+        manifest = build_manifest(self.app_config)
+        files, files_updated = dataset_files(manifest, KEY, self.directory)
+        self.assertEqual(files_updated, 0)
+        filename = os.path.join(self.directory, 'a.nc')
+        write_file(filename, 360, 360)
+        os.utime(filename, (0, 0))
+        files, files_updated = dataset_files(manifest, KEY, self.directory)
+        self.assertEqual(files_updated, 1)
+        self.assertEqual(files[filename]['start_year'], 1951)
+        os.remove(filename)
+        files, files_updated = dataset_files(manifest, KEY, self.directory)
+        self.assertEqual(files_updated, 1)
+        self.assertEqual(list(files), [os.path.join(self.directory, 'b.nc')])
+
+    def test_drs_revalidation_case(self):
+        """
+        Tests new files with DRS names are planned from their names without
+        reading their headers, which are read when the manifest is rebuilt
+        """
+        manifest = build_manifest(self.app_config)
+        name = 'tasmax_day_HadGEM3-GC31-LM_highresSST-present_r1i1p1f1_gn_' \
+               '19530101-19531230.nc'
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as fh:
+            fh.write('not a netCDF file')
+        files, files_updated = dataset_files(manifest, KEY, self.directory)
+        self.assertEqual(files_updated, 1)
+        self.assertEqual(files[filename]['start_year'], 1953)
+        self.assertNotIn('units', files[filename])
+        os.remove(filename)
+        write_file(filename, 1080, 360)
+        manifest = build_manifest(self.app_config, manifest)
+        self.assertEqual(
+            manifest['datasets'][KEY]['files'][name]['calendar'], '360_day')
+
+    def test_missing_dataset_case(self):
+        """
+        Tests datasets missing from the manifest are not read
+        """
+        manifest = build_manifest({})
+        self.assertEqual(dataset_files(manifest, KEY, self.directory),
+                         (None, 0))
+
+    def test_plan_files_case(self):
+        """
+        Tests loads are planned from the manifest's year ranges
+        """
+        manifest = build_manifest(self.app_config)
+        files, _ = dataset_files(manifest, KEY, self.directory)
+        year_ranges = {filename: (metadata['start_year'],
+                                  metadata['end_year'])
+                       for filename, metadata in files.items()}
+        self.assertEqual(plan_files(self.directory, [1952, 1953], year_ranges),
+                         [os.path.join(self.directory, 'b.nc')])
+
+
+if __name__ == '__main__':
+    unittest.main()
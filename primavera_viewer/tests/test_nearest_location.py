@@ -1,10 +1,33 @@
 """
 Tests for primavera_viewer
 """
+import os
+import tempfile
 import unittest
+import dask.array as da
+import numpy as np
 from iris.tests.stock import realistic_3d
 from primavera_viewer.nearest_location import *
 
+def global_cube():
+    """
+    Creates a small cube on a global 10 degree grid from 0 to 360 degrees
+    longitude.
+    """
+    cube = iris.cube.Cube(
+        np.arange(2 * 18 * 36, dtype=np.float64).reshape(2, 18, 36),
+        standard_name='air_temperature', units='K')
+    cube.add_dim_coord(iris.coords.DimCoord(
+        [0.5, 1.5], standard_name='time', units='days since 1950-01-01'), 0)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.arange(-85., 90., 10.), standard_name='latitude',
+        units='degrees'), 1)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.arange(5., 360., 10.), standard_name='longitude',
+        units='degrees'), 2)
+    return cube
+
+
 class TestPointLocation(unittest.TestCase):
 
     def setUp(self):
@@ -33,6 +56,239 @@ class TestPointLocation(unittest.TestCase):
         self.assertEqual([self.lat_coord.points[0], self.lon_coord.points[0]],
                          [-2.0, 4.0])
 
+    def test_find_point_decreasing_latitude_case(self):
+        """
+        Tests case of a latitude coordinate running from north to south
+        """
+        self.stock_cube = self.stock_cube[:, ::-1, :]
+        self.test_cube = PointLocation(lat=-1.51,lon=3.78,cube=self.stock_cube)
+        self.lat_coord = self.test_cube.find_point().coord('latitude')
+        self.lon_coord = self.test_cube.find_point().coord('longitude')
+        self.assertEqual([self.lat_coord.points[0], self.lon_coord.points[0]],
+                         [-2.0, 4.0])
+
+    def test_find_point_not_found_case(self):
+        """
+        Tests case of a point outside of the coordinate system
+        """
+        self.test_cube = PointLocation(lat=10.0,lon=3.78,cube=self.stock_cube)
+        self.assertRaises(ValueError, self.test_cube.find_point)
+
+
+class TestMultiPointLocation(unittest.TestCase):
+
+    def setUp(self):
+        self.stock_cube = realistic_3d()
+        self.stock_cube.coord('grid_latitude').guess_bounds()
+        self.stock_cube.coord('grid_longitude').guess_bounds()
+        self.lats = [-1.51, -2.5, 3.9, -1.51]
+        self.lons = [3.78, 3.5, -4.2, 3.78]
+
+    def test_find_points_matches_point_case(self):
+        """
+        Tests each station series matches the single point lookup
+        """
+        self.test_cube = MultiPointLocation(self.lats, self.lons,
+                                            cube=self.stock_cube.copy(),
+                                            names=['a', 'b', 'c', 'd'])
+        self.station_cube = self.test_cube.find_points()
+        self.assertEqual(self.station_cube.shape, (7, 4))
+        self.assertEqual(
+            self.station_cube.coord('station_name').points.tolist(),
+            ['a', 'b', 'c', 'd'])
+        for i, (lat, lon) in enumerate(zip(self.lats, self.lons)):
+            point_cube = PointLocation(lat, lon,
+                                       self.stock_cube.copy()).find_point()
+            np.testing.assert_array_equal(self.station_cube.data[:, i],
+                                          point_cube.data)
+            self.assertEqual(
+                self.station_cube.coord('latitude').points[i],
+                point_cube.coord('latitude').points[0])
+            self.assertEqual(
+                self.station_cube.coord('longitude').points[i],
+                point_cube.coord('longitude').points[0])
+
+    def test_find_points_not_found_case(self):
+        """
+        Tests case of a point outside of the coordinate system
+        """
+        self.test_cube = MultiPointLocation([0.0, 10.0], [0.0, 0.0],
+                                            cube=self.stock_cube)
+        self.assertRaises(ValueError, self.test_cube.find_points)
+
+    def test_load_points_case(self):
+        """
+        Tests reading points from CSV and JSON files
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_file = os.path.join(tmp_dir, 'stations.csv')
+            with open(csv_file, 'w') as fh:
+                fh.write('name,lat,lon\nExeter,50.7,356.5\nRome,41.9,12.5\n')
+            json_file = os.path.join(tmp_dir, 'stations.json')
+            with open(json_file, 'w') as fh:
+                fh.write('[[50.7, 356.5], [41.9, 12.5]]')
+            self.assertEqual(load_points(csv_file),
+                             [[50.7, 356.5, 'Exeter'], [41.9, 12.5, 'Rome']])
+            self.assertEqual(load_points(json_file),
+                             [[50.7, 356.5], [41.9, 12.5]])
+            self.assertTrue(is_multi_point(load_points(json_file)))
+            self.assertFalse(is_multi_point([50.7, 356.5]))
+
+
+class TestExtractRegion(unittest.TestCase):
+
+    def setUp(self):
+        self.stock_cube = realistic_3d()
+        self.stock_cube.coord('grid_latitude').guess_bounds()
+        self.stock_cube.coord('grid_longitude').guess_bounds()
+
+    def test_point_region_case(self):
+        """
+        Tests a point region is a single cell giving the same point
+        """
+        self.region = extract_region(self.stock_cube, [-1.51, 3.78])
+        self.assertEqual(self.region.shape, (7, 1, 1))
+        self.point_cube = PointLocation(-1.51, 3.78,
+                                        self.region).find_point()
+        self.expected = PointLocation(-1.51, 3.78,
+                                      self.stock_cube).find_point()
+        np.testing.assert_array_equal(self.point_cube.data,
+                                      self.expected.data)
+
+    def test_decreasing_point_region_case(self):
+        """
+        Tests a point region in a decreasing latitude coordinate
+        """
+        self.stock_cube = self.stock_cube[:, ::-1, :]
+        self.region = extract_region(self.stock_cube, [-1.51, 3.78])
+        self.point_cube = PointLocation(-1.51, 3.78,
+                                        self.region).find_point()
+        self.assertEqual(self.point_cube.coord('latitude').points[0], -2.0)
+
+    def test_area_region_case(self):
+        """
+        Tests an area region gives the same area mean
+        """
+        self.location = [-2.92, 1.63, 0.35, 3.89]
+        self.region = extract_region(self.stock_cube, self.location)
+        self.assertEqual(self.region.shape, (7, 6, 5))
+        self.area_cube = AreaLocation(*self.location,
+                                      cube=self.region).find_area()
+        self.expected = AreaLocation(*self.location,
+                                     cube=self.stock_cube).find_area()
+        np.testing.assert_allclose(self.area_cube.data, self.expected.data)
+
+    def test_points_region_case(self):
+        """
+        Tests a list of points region holds the rows and columns of the cell
+        of every point, giving the same station time series
+        """
+        points = [[-1.51, 3.78], [2.2, -1.1]]
+        self.region = extract_region(self.stock_cube, points)
+        self.assertEqual(self.region.shape, (7, 2, 2))
+        lats = [point[0] for point in points]
+        lons = [point[1] for point in points]
+        expected = MultiPointLocation(lats, lons,
+                                      self.stock_cube).find_points()
+        stations = MultiPointLocation(lats, lons, self.region).find_points()
+        np.testing.assert_array_equal(stations.data, expected.data)
+
+
+class TestFindBoundsIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.lat_bounds = np.array([[-90., -30.], [-30., 30.], [30., 90.]])
+        self.lon_bounds = np.array([[-60., 60.], [60., 180.], [180., 300.]])
+
+    def test_increasing_case(self):
+        """
+        Tests multiple points in an increasing coordinate
+        """
+        index = find_bounds_index(self.lat_bounds, [-45., -30., 0., 89.])
+        self.assertEqual(index.tolist(), [0, 1, 1, 2])
+
+    def test_decreasing_case(self):
+        """
+        Tests multiple points in a decreasing coordinate
+        """
+        index = find_bounds_index(self.lat_bounds[::-1, ::-1],
+                                  [-45., -30., 0., 89.])
+        self.assertEqual(index.tolist(), [2, 2, 1, 0])
+
+    def test_upper_bound_case(self):
+        """
+        Tests points matching the max upper bound of the coordinate
+        """
+        self.assertEqual(find_bounds_index(self.lat_bounds, 90.)[0], 2)
+        self.assertEqual(
+            find_bounds_index(self.lat_bounds[::-1, ::-1], -90.)[0], 2)
+
+    def test_not_found_case(self):
+        """
+        Tests points outside of the coordinate bounds
+        """
+        index = find_bounds_index(self.lat_bounds, [-91., 91.])
+        self.assertEqual(index.tolist(), [-1, -1])
+
+    def test_longitude_wrap_case(self):
+        """
+        Tests longitude points wrapping around 0/360 degrees
+        """
+        index = find_bounds_index(self.lon_bounds, [359., 360., -90., 0.],
+                                  modulus=360)
+        self.assertEqual(index.tolist(), [0, 0, 2, 0])
+
+
+class TestFindBoundsRange(unittest.TestCase):
+
+    def setUp(self):
+        self.lat_bounds = np.column_stack([np.arange(-90., 90., 10.),
+                                           np.arange(-80., 100., 10.)])
+        self.lon_bounds = np.column_stack([np.arange(0., 360., 10.),
+                                           np.arange(10., 370., 10.)])
+
+    def test_within_case(self):
+        """
+        Tests a region within the coordinate, including boundaries on cell
+        edges
+        """
+        self.assertEqual(find_bounds_range(self.lat_bounds, -15., 20.),
+                         slice(7, 12))
+        self.assertEqual(find_bounds_range(self.lat_bounds, 90., 90.),
+                         slice(17, 18))
+
+    def test_global_case(self):
+        """
+        Tests regions covering the whole coordinate select every cell
+        """
+        self.assertEqual(find_bounds_range(self.lat_bounds, -90., 90.),
+                         slice(0, 18))
+        for lon_min, lon_max in [(0., 360.), (-180., 180.)]:
+            self.assertEqual(find_bounds_range(self.lon_bounds, lon_min,
+                                               lon_max, modulus=360),
+                             slice(0, 36))
+
+    def test_longitude_wrap_case(self):
+        """
+        Tests longitude regions crossing 0 degrees or beyond 360 degrees
+        """
+        for lon_min, lon_max in [(-20., 15.), (340., 15.)]:
+            index = find_bounds_range(self.lon_bounds, lon_min, lon_max,
+                                      modulus=360)
+            self.assertEqual(index.tolist(), [34, 35, 0, 1])
+        self.assertEqual(find_bounds_range(self.lon_bounds, 400., 455.,
+                                           modulus=360), slice(4, 10))
+
+    def test_not_found_case(self):
+        """
+        Tests regions outside of the coordinate raise an error
+        """
+        self.assertRaises(ValueError, find_bounds_range, self.lat_bounds,
+                          95., 100.)
+        self.assertRaises(ValueError, find_bounds_range,
+                          self.lon_bounds[:9], 200., 250., 360)
+
+
 class TestAreaLocation(unittest.TestCase):
 
     def setUp(self):
@@ -66,5 +322,52 @@ class TestAreaLocation(unittest.TestCase):
         self.assertEqual([self.lat_coord.points[0], self.lon_coord.points[0]],
                          [-0.5, 3.0])
 
+    def test_find_area_global_lazy_case(self):
+        """
+        Tests case of a global area mean remaining lazy and being weighted by
+        the area of each grid cell
+        """
+        self.stock_cube = self.stock_cube.copy(
+            data=da.from_array(self.stock_cube.data, chunks=(1, 9, 11)))
+        self.test_cube = AreaLocation(lat_min=-90.0, lat_max=90.0,
+                                      lon_min=-180.0, lon_max=180.0,
+                                      cube=self.stock_cube)
+        self.area_cube = self.test_cube.find_area()
+        self.assertTrue(self.area_cube.has_lazy_data())
+        weights = cell_area_weights(
+            self.stock_cube.coord('latitude').bounds,
+            self.stock_cube.coord('longitude').bounds)
+        expected = np.average(self.stock_cube.data, axis=(1, 2),
+                              weights=np.broadcast_to(
+                                  weights, self.stock_cube.shape))
+        np.testing.assert_allclose(self.area_cube.data, expected, rtol=1e-6)
+
+    def test_find_area_longitude_wrap_case(self):
+        """
+        Tests case of an area crossing 0 degrees longitude on a 0 to 360
+        degree grid
+        """
+        cube = global_cube()
+        area_cube = AreaLocation(lat_min=-20.0, lat_max=15.0, lon_min=340.0,
+                                 lon_max=15.0, cube=cube).find_area()
+        lon_index = [34, 35, 0, 1]
+        subset = cube.data[:, 7:11][:, :, lon_index]
+        weights = cell_area_weights(cube.coord('latitude').bounds[7:11],
+                                    cube.coord('longitude').bounds[lon_index])
+        expected = np.average(subset, axis=(1, 2),
+                              weights=np.broadcast_to(weights, subset.shape))
+        np.testing.assert_allclose(area_cube.data, expected, rtol=1e-6)
+        region = extract_region(cube, [-20.0, 15.0, 340.0, 15.0])
+        self.assertEqual(region.coord('longitude').points.tolist(),
+                         [-15.0, -5.0, 5.0, 15.0])
+
+    def test_find_area_not_found_case(self):
+        """
+        Tests case of an area outside of the grid
+        """
+        test_cube = AreaLocation(lat_min=95.0, lat_max=100.0, lon_min=0.0,
+                                 lon_max=10.0, cube=global_cube())
+        self.assertRaises(ValueError, test_cube.find_area)
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Tests for primavera_viewer.profiler
+"""
+import json
+import os
+import tempfile
+import unittest
+from primavera_viewer.profiler import Profiler, record_files_opened
+from primavera_viewer.tests.test_worker_pool import double, realised_cube
+from primavera_viewer.worker_pool import WorkerPool
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_nested_stage_case(self):
+        """
+        Tests stages run in this process are recorded with the files they
+        open, an enclosing stage including the stages within it
+        """
+        profiler = Profiler()
+        with profiler.stage('outer'):
+            record_files_opened(2)
+            with profiler.stage('inner', 'a r1i1p1f1'):
+                record_files_opened()
+                data = bytearray(2 ** 24)
+            del data
+        inner, outer = profiler.records
+        self.assertEqual((inner['stage'], inner['simulation']),
+                         ('inner', 'a r1i1p1f1'))
+        self.assertEqual(outer['stage'], 'outer')
+        self.assertEqual(inner['files_opened'], 1)
+        self.assertEqual(outer['files_opened'], 3)
+        self.assertGreaterEqual(outer['wall'], inner['wall'])
+        self.assertGreaterEqual(outer['peak_rss'], inner['peak_rss'])
+        self.assertEqual(inner['pid'], os.getpid())
+
+    def test_worker_records_case(self):
+        """
+        Tests a profiled pool gives the same results as an unprofiled one and
+        records each simulation's call in the worker that ran it
+        """
+        cubes = [realised_cube(label) for label in 'abc']
+        profiler = Profiler('test')
+        pool = WorkerPool(2, min_shared_bytes=0, profiler=profiler)
+        try:
+            profiled = pool.map(double, cubes)
+            pool.set_profiler(None)
+            expected = pool.map(double, cubes)
+        finally:
+            pool.shutdown()
+        for result, cube in zip(profiled, expected):
+            self.assertEqual(result, cube)
+        self.assertEqual([record['stage'] for record in profiler.records],
+                         ['double'] * 3)
+        self.assertEqual([record['simulation']
+                          for record in profiler.records], list('abc'))
+        self.assertNotIn(os.getpid(),
+                         [record['pid'] for record in profiler.records])
+        report = profiler.report()
+        self.assertEqual(report['stages']['double']['count'], 3)
+        self.assertEqual(sorted(report['simulations']), list('abc'))
+
+    def test_trace_case(self):
+        """
+        Tests the trace has a named track for each process and a complete
+        event for each record
+        """
+        profiler = Profiler('test')
+        with profiler.stage('load'):
+            pass
+        profiler.add_records([dict(profiler.records[0], pid=1,
+                                   simulation='a r1i1p1f1')])
+        profiler.finish()
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'trace.json')
+            profiler.write_trace(filename)
+            with open(filename) as fh:
+                events = json.load(fh)['traceEvents']
+        names = {event['pid']: event['args']['name'] for event in events
+                 if event['ph'] == 'M'}
+        self.assertEqual(names, {os.getpid(): 'test', 1: 'worker 1'})
+        self.assertEqual(sorted(event['name'] for event in events
+                                if event['ph'] == 'X'),
+                         ['load', 'load a r1i1p1f1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Tests for primavera_viewer.result_cache
+"""
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import iris.cube
+import numpy as np
+from primavera_viewer.result_cache import ResultCache
+from primavera_viewer.simulations_output import SimulationsOutput
+from primavera_viewer.tests.test_sim_statistics import unified_cube
+from primavera_viewer.worker_pool import WorkerPool
+
+REQUEST = {'variables': ['tasmax'], 'models': ['MOHC.HadGEM3-GC31-LM'],
+           'ensembles': ['r1i1p1f1'], 'years': [1950, 1952],
+           'location': [51.5, 359.9], 'statistics': 'annual_mean_timeseries'}
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(os.path.join(self.tmp_dir.name, 'results'))
+        self.source = os.path.join(self.tmp_dir.name, 'source.nc')
+        with open(self.source, 'w') as fh:
+            fh.write('data')
+        self.sources = {'dataset': [self.source]}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key_case(self):
+        """
+        Tests requests given in a different form have the same key and a
+        change to the source files changes the key
+        """
+        key = self.cache.request_key(REQUEST, self.sources)
+        request = dict(REQUEST, years=(1950.0, 1952), location=np.array(
+            [51.5, 359.9]))
+        self.assertEqual(self.cache.request_key(request, self.sources), key)
+        self.assertNotEqual(self.cache.request_key(
+            dict(REQUEST, statistics='monthly_mean_timeseries'),
+            self.sources), key)
+        os.utime(self.source, (0, 0))
+        self.assertNotEqual(self.cache.request_key(REQUEST, self.sources), key)
+
+    def test_round_trip_case(self):
+        """
+        Tests a stored result is returned unchanged
+        """
+        key = self.cache.request_key(REQUEST, self.sources)
+        self.assertIsNone(self.cache.get(key))
+        cubes = iris.cube.CubeList([unified_cube(1)])
+        self.cache.set(key, cubes)
+        self.assertEqual(self.cache.get(key), cubes)
+
+    def test_eviction_case(self):
+        """
+        Tests results are evicted once expired and least recently used first
+        once the cache is too large
+        """
+        for key in ['a', 'b', 'c']:
+            self.cache.set(key, np.zeros(1000))
+            path = os.path.join(self.cache.directory, key + '.pkl')
+            os.utime(path, (time.time() - ord('d') + ord(key),
+                            time.time()))
+        size = os.path.getsize(path)
+        self.cache.set_max_size(2 * size)
+        self.cache.evict()
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+        self.cache.set_max_age(60)
+        os.utime(path, (time.time(), time.time() - 120))
+        self.assertIsNone(self.cache.get('c'))
+        self.assertFalse(os.path.exists(path))
+
+    def test_statistics_case(self):
+        """
+        Tests statistics are stored and then returned without being performed
+        """
+        key = self.cache.request_key(REQUEST, self.sources)
+        cube = unified_cube(2)
+        pool = WorkerPool(1)
+        try:
+            output = SimulationsOutput(iris.cube.CubeList([cube]),
+                                       [51.5, 359.9], cube.copy(),
+                                       'annual_mean_timeseries', 'netCDF',
+                                       pool=pool, result_cache=self.cache,
+                                       cache_key=key)
+            expected = output.simulations_statistics()
+        finally:
+            pool.shutdown()
+        pool = mock.Mock()
+        output = SimulationsOutput(loc=[51.5, 359.9],
+                                   stats='annual_mean_timeseries',
+                                   out='netCDF', pool=pool,
+                                   result_cache=self.cache, cache_key=key)
+        self.assertEqual(output.simulations_statistics(), expected)
+        pool.map.assert_not_called()
+
+    def test_outputs_case(self):
+        """
+        Tests the files written for a result are stored and written again
+        for the same output type only
+        """
+        key = self.cache.request_key(REQUEST, self.sources)
+        filename = os.path.join(self.tmp_dir.name, 'comparison')
+        with open(filename + '.nc', 'wb') as fh:
+            fh.write(b'netCDF')
+        self.assertFalse(self.cache.get_outputs(key, 'netCDF', filename))
+        self.cache.set_outputs(key, 'netCDF', filename)
+        os.remove(filename + '.nc')
+        self.assertTrue(self.cache.get_outputs(key, 'netCDF', filename))
+        with open(filename + '.nc', 'rb') as fh:
+            self.assertEqual(fh.read(), b'netCDF')
+        self.assertFalse(self.cache.get_outputs(key, 'both', filename))
+
+if __name__ == '__main__':
+    unittest.main()
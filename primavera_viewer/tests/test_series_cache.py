@@ -0,0 +1,70 @@
+"""
+Tests for primavera_viewer.series_cache
+"""
+import tempfile
+import unittest
+import iris.cube
+import numpy as np
+from primavera_viewer.series_cache import SeriesCache, missing_years
+from primavera_viewer.sim_format import extract_years
+from primavera_viewer.simulations_output import (annual_mean_timeseries,
+                                                 extend_statistic,
+                                                 monthly_mean_timeseries)
+from primavera_viewer.tests.test_sim_statistics import unified_cube
+
+
+class TestSeriesCache(unittest.TestCase):
+
+    def test_missing_years_case(self):
+        """
+        Tests the years missing from a cached series are found before and
+        after it, and a series that cannot be extended is reported
+        """
+        self.assertEqual(missing_years([1950, 2000], [1950, 2000]), [])
+        self.assertEqual(missing_years([1960, 1970], [1950, 2000]), [])
+        self.assertEqual(missing_years([1950, 2014], [1950, 2000]),
+                         [[2000, 2014]])
+        self.assertEqual(missing_years([1940, 2014], [1950, 2000]),
+                         [[1940, 1950], [2000, 2014]])
+        self.assertIsNone(missing_years([2001, 2014], [1950, 2000]))
+
+    def test_series_case(self):
+        """
+        Tests a series is stored as float32 and keeps its token when extended
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SeriesCache(directory)
+            key = cache.series_key('dataset', [51.5, 359.9])
+            self.assertNotEqual(key, cache.series_key('dataset', [51.5, 0.]))
+            cube = unified_cube(1)
+            cube.data = cube.data.astype(np.float64)
+            token = cache.set_series(key, cube, [1950, 1951], [])
+            entry = cache.get(key)
+            self.assertEqual(entry['cube'].dtype, np.float32)
+            self.assertEqual(entry['years'], [1950, 1951])
+            self.assertEqual(cache.set_series(key, cube, [1950, 1952], [],
+                                              token), token)
+
+    def test_extend_statistic_case(self):
+        """
+        Tests statistics extended from a cached statistic equal those
+        performed on the whole series
+        """
+        cube = unified_cube(3)
+        for plot_func in [annual_mean_timeseries, monthly_mean_timeseries]:
+            expected = plot_func(cube)
+            for cached_years, years in [([1950, 1952], [1950, 1953]),
+                                        ([1951, 1953], [1950, 1953]),
+                                        ([1950, 1953], [1951, 1952])]:
+                cached = {'cube': plot_func(extract_years(cube,
+                                                          cached_years)),
+                          'years': cached_years}
+                statistic, all_statistic, all_years = extend_statistic(
+                    (extract_years(cube, years), cached), plot_func)
+                self.assertEqual(statistic, extract_years(expected, years))
+                self.assertEqual(all_statistic, expected)
+                self.assertEqual(all_years, [1950, 1953])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Tests for primavera_viewer.server
+"""
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from primavera_viewer import server, simulations_loading
+from primavera_viewer.tests.test_simulations_loading import (KEY, SIMULATION,
+                                                             write_year)
+
+REQUEST = {'variable': SIMULATION[2], 'models': [SIMULATION[0]],
+           'ensembles': [SIMULATION[1]],
+           'statistics': 'annual_mean_timeseries', 'start_year': 1950,
+           'end_year': 1952, 'latitude_point': 51.5, 'longitude_point': 359.9}
+
+
+class TestServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        for year in [1950, 1951]:
+            write_year(cls.tmp_dir.name, year)
+        simulations_loading.set_app_config(
+            {KEY: {'directory': cls.tmp_dir.name}})
+        cls.server_module = server
+        cls.service = cls.server_module.ComparisonService(
+            os.path.join(cls.tmp_dir.name, 'cache'), workers=1)
+        cls.server = cls.server_module.make_server(cls.service, port=0)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+        cls.client = cls.server_module.ComparisonClient(
+            'http://127.0.0.1:{}'.format(cls.server.server_address[1]))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+        cls.service.shutdown()
+        simulations_loading.set_app_config(None)
+        cls.tmp_dir.cleanup()
+
+    def test_health_case(self):
+        """
+        Tests the service reports that it is running
+        """
+        self.assertEqual(self.client.health(), {'status': 'ok'})
+
+    def test_compare_case(self):
+        """
+        Tests a request is answered with each simulation's statistic and a
+        repeated request is answered from memory without loading any data
+        """
+        result = self.client.compare(REQUEST)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['simulation'], 'HadGEM3-GC31-LM r1i1p1f1')
+        self.assertEqual(len(result[0]['time']), 2)
+        self.assertEqual(len(result[0]['data']), 2)
+        with mock.patch.object(self.server_module.SimulationsLoading,
+                               'load_all_data') as load_all_data:
+            self.assertEqual(self.client.compare(REQUEST), result)
+        load_all_data.assert_not_called()
+
+    def test_invalid_request_case(self):
+        """
+        Tests invalid requests are rejected with their reason
+        """
+        with self.assertRaisesRegex(ValueError, 'statistics'):
+            self.client.compare(dict(REQUEST, statistics='median'))
+        with self.assertRaisesRegex(ValueError, 'time period'):
+            self.client.compare(dict(REQUEST, start_year=None))
+        with self.assertRaisesRegex(ValueError, 'do not exist'):
+            self.client.compare(dict(REQUEST, models=['NONE.NONE']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+"""
+Tests for primavera_viewer.sim_format
+"""
+import unittest
+import iris.coords
+import iris.cube
+import cftime
+import dask.array as da
+import numpy as np
+from cf_units import Unit
+from primavera_viewer.sim_format import (change_calendar, change_time_points,
+                                         convert_365day_to_360day,
+                                         date_from_days, day_360_time_coord,
+                                         days_from_date, extract_360day_cells,
+                                         replace_time_points)
+
+
+def time_cube(cal, frequency='day', units='days since 1950-01-01 00:00:00'):
+    """
+    Creates a daily, monthly or yearly cube on a calendar, with points part
+    way through each day.
+    """
+    if frequency == 'day':
+        dates = Unit('days since 1950-01-01 00:00:00', calendar=cal).num2date(
+            np.arange(1500) + 0.3)
+    elif frequency == 'month':
+        dates = [cftime.datetime(year, month, 16, 6, 30, calendar=cal)
+                 for year in range(1950, 1960) for month in range(1, 13)]
+    else:
+        dates = [cftime.datetime(year, 7, 2, 6, 30, calendar=cal)
+                 for year in range(1950, 1960)]
+    unit = Unit(units, calendar=cal)
+    cube = iris.cube.Cube(np.zeros(len(dates), dtype=np.float32),
+                          standard_name='air_temperature', units='K')
+    cube.add_dim_coord(iris.coords.DimCoord(unit.date2num(dates),
+                                            standard_name='time',
+                                            units=unit), 0)
+    cube.add_aux_coord(iris.coords.AuxCoord(np.zeros(1), long_name='height',
+                                            units='m'))
+    return cube
+
+
+class TestChangeTimePoints(unittest.TestCase):
+
+    def assert_same_as_replace(self, cube, **kwargs):
+        """
+        Checks change_time_points gives the same cube as replacing each date.
+        """
+        expected = replace_time_points(cube.copy(), **kwargs)
+        result = change_time_points(cube.copy(), **kwargs)
+        np.testing.assert_array_equal(result.coord('time').points,
+                                      expected.coord('time').points)
+        self.assertEqual(result.coord('time').points.dtype,
+                         expected.coord('time').points.dtype)
+        self.assertEqual(result, expected)
+
+    def test_calendars_case(self):
+        """
+        Tests the points are the same as replacing each date on the 360 day,
+        365 day and gregorian calendars
+        """
+        for cal in ['360_day', '365_day', 'gregorian', 'proleptic_gregorian']:
+            for frequency, kwargs in [('day', {'hr': 12}),
+                                      ('month', {'dy': 1, 'hr': 0}),
+                                      ('year', {'mn': 6, 'dy': 15})]:
+                with self.subTest(calendar=cal, **kwargs):
+                    self.assert_same_as_replace(time_cube(cal, frequency),
+                                                **kwargs)
+
+    def test_units_case(self):
+        """
+        Tests the points are the same in units of hours from a reference
+        time that is not midnight
+        """
+        for cal in ['360_day', 'gregorian']:
+            with self.subTest(calendar=cal):
+                units = 'hours since 1949-12-01 06:00:00'
+                self.assert_same_as_replace(time_cube(cal, 'day', units),
+                                            hr=12)
+                self.assert_same_as_replace(time_cube(cal, 'month', units),
+                                            dy=1, hr=0)
+
+    def test_existing_coords_case(self):
+        """
+        Tests date categories already on the cube are used
+        """
+        cube = time_cube('360_day', 'year')
+        cube.add_aux_coord(iris.coords.AuxCoord(
+            np.full(cube.shape, 3), long_name='month_number', units='1'), 0)
+        self.assert_same_as_replace(cube, dy=1, hr=0)
+
+    def test_invalid_day_case(self):
+        """
+        Tests days beyond the end of a month are not allowed
+        """
+        with self.assertRaises(ValueError):
+            change_time_points(time_cube('365_day', 'year'), mn=2, dy=30)
+
+    def test_day_numbers_case(self):
+        """
+        Tests day numbers are converted back to the same dates
+        """
+        for cal in ['360_day', '365_day', 'gregorian']:
+            with self.subTest(calendar=cal):
+                day_numbers = np.arange(-1000, 30000)
+                dates = date_from_days(cal, day_numbers)
+                np.testing.assert_array_equal(days_from_date(cal, *dates),
+                                              day_numbers)
+
+
+class TestChangeCalendar(unittest.TestCase):
+
+    def test_mask_case(self):
+        """
+        Tests the masked conversion keeps the same lazy days as checking each
+        cell
+        """
+        for cal in ['365_day', 'gregorian']:
+            with self.subTest(calendar=cal):
+                cube = time_cube(cal, 'day')
+                cube.data = da.from_array(np.arange(cube.shape[0],
+                                                    dtype=np.float32))
+                result = convert_365day_to_360day(cube)
+                expected = extract_360day_cells(cube)
+                self.assertTrue(result.has_lazy_data())
+                self.assertEqual(result.coord('time'),
+                                 expected.coord('time'))
+                np.testing.assert_array_equal(result.data, expected.data)
+
+    def test_time_axis_case(self):
+        """
+        Tests each year has a 360 day time axis, built once for each period
+        """
+        day_360_time_coord.cache_clear()
+        for cal in ['365_day', 'gregorian']:
+            with self.subTest(calendar=cal):
+                dates = [cftime.datetime(year, 1, 1, 12, calendar=cal)
+                         for year in [1950, 1952]]
+                units = Unit('days since 1950-01-01 00:00:00', calendar=cal)
+                start, end = units.date2num(dates)
+                cube = time_cube(cal, 'day')[int(start):int(end)]
+                cube = change_calendar(cube, [1950, 1952],
+                                       'days since 1950-01-01 00:00:00')
+                time_coord = cube.coord('time')
+                self.assertEqual(time_coord.units.calendar, '360_day')
+                np.testing.assert_array_equal(time_coord.points,
+                                              np.arange(720))
+                np.testing.assert_array_equal(time_coord.bounds[0],
+                                              [-0.5, 0.5])
+        self.assertEqual(day_360_time_coord.cache_info().misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Tests for primavera_viewer.sim_statistics
+"""
+import unittest
+from unittest import mock
+import dask.array as da
+import iris.analysis
+import iris.coords
+import iris.cube
+import numpy as np
+from cf_units import Unit
+from primavera_viewer import sim_format as format
+from primavera_viewer import sim_statistics as stats
+
+
+def unified_cube(years=2):
+    """
+    Creates a realised daily time series of one simulation in the unified
+    format, on a 360 day calendar with points at midday.
+    """
+    ndays = 360 * years
+    rng = np.random.RandomState(0)
+    cube = iris.cube.Cube(rng.rand(ndays).astype(np.float32),
+                          standard_name='air_temperature',
+                          long_name='Daily Maximum Near-Surface Air '
+                                    'Temperature', units='K')
+    time_coord = iris.coords.DimCoord(
+        np.arange(ndays) + 0.5, standard_name='time',
+        units=Unit('days since 1950-01-01 00:00:00', calendar='360_day'))
+    time_coord.guess_bounds()
+    cube.add_dim_coord(time_coord, 0)
+    cube.add_aux_coord(iris.coords.AuxCoord('HadGEM3-GC31-LM r1i1p1f1',
+                                            long_name='simulation_label',
+                                            units='no_unit'))
+    return cube
+
+
+class TestAnomaly(unittest.TestCase):
+
+    def setUp(self):
+        self.cube = unified_cube()
+        # days by year and month
+        self.data = self.cube.data.reshape(2, 12, 30)
+
+    def test_daily_anomaly_case(self):
+        """
+        Tests daily anomalies are a single cube of each day less the mean of
+        its month over all years, at midnight
+        """
+        anomaly = stats.daily_anomaly(self.cube.copy())
+        self.assertIsInstance(anomaly, iris.cube.Cube)
+        self.assertEqual(anomaly.name(), 'Daily Maximum Near-Surface Air '
+                                         'Temperature Anomaly')
+        expected = self.data - self.data.mean(axis=(0, 2))[:, np.newaxis]
+        np.testing.assert_allclose(anomaly.data, expected.ravel(), atol=1e-6)
+        np.testing.assert_array_equal(anomaly.coord('time').points,
+                                      np.arange(720))
+        self.assertEqual(anomaly.dtype, np.float32)
+
+    def test_monthly_anomaly_case(self):
+        """
+        Tests monthly mean and maximum anomalies are single cubes of each
+        month less the mean of its month over all years, on the first of
+        the month
+        """
+        climatology = self.data.mean(axis=(0, 2))
+        for func, reduce, name in [
+                (stats.monthly_mean_anomaly, np.mean,
+                 'air_temperature_mean_anomaly'),
+                (stats.monthly_maximum_anomaly, np.max,
+                 'air_temperature_max_anomaly')]:
+            with self.subTest(name=name):
+                anomaly = func(self.cube.copy())
+                self.assertEqual(anomaly.name(), name)
+                np.testing.assert_allclose(
+                    anomaly.data, (reduce(self.data, axis=2) -
+                                   climatology).ravel(), atol=1e-6)
+                np.testing.assert_array_equal(anomaly.coord('time').points,
+                                              np.arange(0, 720, 30))
+                self.assertEqual(list(anomaly.coord('month').points[:2]),
+                                 ['Jan', 'Feb'])
+
+
+class TestMonthlyAnalysis(unittest.TestCase):
+
+    def test_single_pass_case(self):
+        """
+        Tests the mean, maximum and minimum are computed in one pass and are
+        the same as aggregating the cube with each statistic in turn
+        """
+        cube = format.add_extra_time_coords(unified_cube())
+        cube.data = np.ma.masked_greater(cube.data, 0.95)
+        expected = [cube.aggregated_by(['month', 'year'], aggregator)
+                    for aggregator in [iris.analysis.MEAN, iris.analysis.MAX,
+                                       iris.analysis.MIN]]
+        with mock.patch.object(iris.cube.Cube, 'aggregated_by',
+                               autospec=True,
+                               side_effect=iris.cube.Cube.aggregated_by) as \
+                aggregated_by:
+            result = stats.monthly_analysis(cube)
+        # the coordinates are aggregated once, from a copy without data
+        self.assertEqual(aggregated_by.call_count, 1)
+        self.assertTrue(aggregated_by.call_args.args[0].is_dataless())
+        for result_cube, expected_cube, name in zip(result, expected,
+                                                     ['mean', 'max', 'min']):
+            self.assertEqual(result_cube.name(), 'air_temperature_' + name)
+            self.assertEqual(result_cube.coords(), expected_cube.coords())
+            self.assertEqual(result_cube.cell_methods,
+                             expected_cube.cell_methods)
+            np.testing.assert_array_equal(result_cube.data,
+                                          expected_cube.data)
+            np.testing.assert_array_equal(
+                np.ma.getmaskarray(result_cube.data),
+                np.ma.getmaskarray(expected_cube.data))
+
+
+class TestStreamingStatistics(unittest.TestCase):
+
+    def setUp(self):
+        cube = unified_cube(3)
+        data = np.ma.masked_greater(
+            np.stack([cube.data, cube.data[::-1] * 10.]).T, 0.95)
+        # a grid cell with no data in a month
+        data[30:60, 1] = np.ma.masked
+        self.cube = iris.cube.Cube(data, long_name='air_temperature',
+                                   units='K')
+        self.cube.add_dim_coord(cube.coord('time'), 0)
+        self.cube.add_dim_coord(iris.coords.DimCoord(
+            [0., 1.], long_name='station', units='1'), 1)
+        self.cube.add_aux_coord(cube.coord('simulation_label'))
+        self.cube = format.add_extra_time_coords(self.cube)
+        self.lazy_cube = self.cube.copy(
+            data=da.from_array(self.cube.data, chunks=(90, 2)))
+
+    def test_tolerance_case(self):
+        """
+        Tests the streamed statistics of a lazy cube match aggregating the
+        realised cube to float tolerance, with the same coordinates and masks
+        """
+        for coords in [['year'], ['month', 'year']]:
+            statistics = ['mean', 'max', 'min', 'variance']
+            result = stats.streaming_statistics(self.lazy_cube, coords,
+                                                statistics)
+            for cube, name in zip(result, statistics):
+                with self.subTest(coords=coords, statistic=name):
+                    expected = self.cube.aggregated_by(
+                        coords, stats.STREAMING_AGGREGATORS[name])
+                    self.assertEqual(cube.coords(), expected.coords())
+                    self.assertEqual(cube.cell_methods,
+                                     expected.cell_methods)
+                    np.testing.assert_array_equal(
+                        np.ma.getmaskarray(cube.data),
+                        np.ma.getmaskarray(expected.data))
+                    np.testing.assert_allclose(
+                        np.ma.compressed(cube.data),
+                        np.ma.compressed(expected.data), rtol=1e-5)
+
+    def test_chunks_case(self):
+        """
+        Tests the data is realised a year at a time
+        """
+        with mock.patch.object(stats.StreamingStatistics, 'update',
+                               autospec=True) as update:
+            stats.monthly_analysis(self.lazy_cube)
+        self.assertEqual(update.call_count, 36)
+        for call in update.call_args_list:
+            self.assertIsInstance(call.args[2], np.ndarray)
+            self.assertEqual(call.args[2].shape, (30, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+Tests for primavera_viewer.simulations_data
+"""
+import unittest
+import cftime
+import dask.array as da
+import iris.coords
+import iris.cube
+import numpy as np
+from cf_units import Unit
+from primavera_viewer import sim_format as format
+from primavera_viewer.simulations_data import (SimulationsData,
+                                               constrain_location,
+                                               mask_bad_data,
+                                               unify_cube_format,
+                                               unify_simulation,
+                                               unify_spatial_coordinates)
+from primavera_viewer.worker_pool import WorkerPool
+
+
+def lazy_cube(label='CMCC-CM2-VHR4 r1i1p1f1', calendar='365_day',
+              start_year=2003, days=365):
+    """
+    Creates a small lazy daily cube of one simulation starting at the
+    beginning of the given year.
+    """
+    units = Unit('days since 1950-01-01 00:00:00', calendar=calendar)
+    start = units.date2num(cftime.datetime(start_year, 1, 1,
+                                           calendar=calendar))
+    data = da.from_array(
+        np.arange(days * 4 * 8, dtype=np.float64).reshape(days, 4, 8),
+        chunks=(30, 4, 8))
+    cube = iris.cube.Cube(data, standard_name='air_temperature',
+                          long_name='Daily Maximum Near-Surface Air '
+                                    'Temperature', units='K')
+    cube.add_dim_coord(iris.coords.DimCoord(
+        start + np.arange(days) + 0.5, standard_name='time', units=units), 0)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.linspace(-67.5, 67.5, 4), standard_name='latitude',
+        units='degrees'), 1)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.arange(0., 360., 45.), standard_name='longitude',
+        units='degrees'), 2)
+    cube.add_aux_coord(iris.coords.AuxCoord(label,
+                                            long_name='simulation_label',
+                                            units='no_unit'))
+    return cube
+
+
+class TestLazyOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.time_constraints = [2003, 2004]
+        self.simulations_data = SimulationsData(
+            iris.cube.CubeList([lazy_cube()]),
+            loc=[-90.0, 90.0, 0.0, 360.0],
+            t_constr=self.time_constraints)
+
+    def test_operations_lazy_case(self):
+        """
+        Tests data remains lazy through every operation until computed once
+        reduced in space and time
+        """
+        cube = self.simulations_data.simulations_list[0]
+        cube = unify_spatial_coordinates(cube)
+        self.assertTrue(cube.has_lazy_data())
+        cube = constrain_location(cube, self.simulations_data.location)
+        self.assertTrue(cube.has_lazy_data())
+        cube = unify_cube_format(cube, self.time_constraints)
+        self.assertTrue(cube.has_lazy_data())
+        self.assertEqual(cube.dtype, np.float32)
+        self.assertEqual(cube.shape, (360,))
+        masked_cube = format.mask_time_points(cube.copy(), [31])
+        self.assertTrue(masked_cube.has_lazy_data())
+        cube = mask_bad_data(cube)
+        self.assertFalse(cube.has_lazy_data())
+        self.assertTrue(cube.data.mask[31])
+        self.assertEqual(np.ma.count_masked(cube.data), 1)
+
+    def test_fused_matches_staged_case(self):
+        """
+        Tests the fused per-simulation pipeline gives the same cube as
+        running each operation as a separate stage
+        """
+        location = [40.0, 60.0, 10.0, 100.0]
+        staged = unify_spatial_coordinates(lazy_cube())
+        staged = constrain_location(staged, location)
+        staged = unify_cube_format(staged, self.time_constraints)
+        staged = mask_bad_data(staged)
+        fused = unify_simulation(lazy_cube(), location,
+                                 self.time_constraints)
+        np.testing.assert_array_equal(fused.data, staged.data)
+        np.testing.assert_array_equal(np.ma.getmaskarray(fused.data),
+                                      np.ma.getmaskarray(staged.data))
+        self.assertEqual(fused.coords(), staged.coords())
+        self.assertEqual(fused.metadata, staged.metadata)
+
+    def test_operations_pool_case(self):
+        """
+        Tests the operations give the same result in worker processes as in
+        this process and keep the order of the simulations
+        """
+        labels = ['CMCC-CM2-VHR4 r1i1p1f1', 'HadGEM3-GC31-LM r1i1p1f1']
+        results = []
+        for workers in [1, 2]:
+            pool = WorkerPool(workers)
+            simulations_data = SimulationsData(
+                iris.cube.CubeList([lazy_cube(label) for label in labels]),
+                loc=[-90.0, 90.0, 0.0, 360.0],
+                t_constr=self.time_constraints, pool=pool)
+            results.append(simulations_data.simulations_operations()
+                           .simulations_list)
+            pool.shutdown()
+        for serial, parallel, label in zip(results[0], results[1], labels):
+            self.assertEqual(parallel.coord('simulation_label').points[0],
+                             label)
+            np.testing.assert_array_equal(parallel.data, serial.data)
+            np.testing.assert_array_equal(np.ma.getmaskarray(parallel.data),
+                                          np.ma.getmaskarray(serial.data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+Tests for primavera_viewer.simulations_loading
+"""
+import os
+import tempfile
+import unittest
+import cftime
+import iris
+import iris.coords
+import iris.cube
+import numpy as np
+from cf_units import Unit
+from primavera_viewer import simulations_loading
+from primavera_viewer.series_cache import SeriesCache
+from primavera_viewer.simulations_data import (constrain_location,
+                                               unify_simulation,
+                                               unify_spatial_coordinates)
+from primavera_viewer.worker_pool import WorkerPool
+
+SIMULATION = ['MOHC.HadGEM3-GC31-LM', 'r1i1p1f1', 'tasmax']
+KEY = 'CMIP6.HighResMIP.MOHC.HadGEM3-GC31-LM.highresSST-present.r1i1p1f1.' \
+      'day.tasmax'
+
+
+def write_year(directory, year, nlat=12, nlon=24):
+    """
+    Writes a year of daily data on a global 360 day calendar grid to a file
+    with a DRS filename.
+    """
+    units = Unit('days since 1950-01-01 00:00:00', calendar='360_day')
+    start = units.date2num(cftime.datetime(year, 1, 1, calendar='360_day'))
+    rng = np.random.RandomState(year)
+    cube = iris.cube.Cube(rng.rand(360, nlat, nlon).astype(np.float32),
+                          standard_name='air_temperature', var_name='tasmax',
+                          units='K')
+    cube.add_dim_coord(iris.coords.DimCoord(
+        start + np.arange(360) + 0.5, standard_name='time', var_name='time',
+        units=units), 0)
+    dlat = 180. / nlat
+    dlon = 360. / nlon
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.linspace(-90. + dlat / 2, 90. - dlat / 2, nlat),
+        standard_name='latitude', var_name='lat', units='degrees'), 1)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.arange(nlon) * dlon + dlon / 2, standard_name='longitude',
+        var_name='lon', units='degrees'), 2)
+    cube.attributes.update(source_id='HadGEM3-GC31-LM',
+                           variant_label='r1i1p1f1')
+    iris.save(cube, os.path.join(
+        directory, 'tasmax_day_HadGEM3-GC31-LM_highresSST-present_r1i1p1f1_'
+                   'gn_{0}0101-{0}1230.nc'.format(year)))
+
+
+class TestLoadData(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        for year in [1950, 1951]:
+            write_year(cls.tmp_dir.name, year)
+        cls.loading = simulations_loading
+        cls.loading.set_app_config({KEY: {'directory': cls.tmp_dir.name}})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loading.set_app_config(None)
+        cls.tmp_dir.cleanup()
+
+    def assert_same_as_full_load(self, location, region_shape):
+        """
+        Checks loading the hyperslab of a location gives the same result as
+        loading the full field and then constraining it.
+        """
+        time_constr = [1950, 1952]
+        full = self.loading.load_data(SIMULATION, time_constr)
+        region = self.loading.load_data(SIMULATION, time_constr, location)
+        self.assertTrue(region.has_lazy_data())
+        self.assertEqual(region.shape, (720,) + region_shape)
+        expected = constrain_location(unify_spatial_coordinates(full),
+                                      location)
+        result = constrain_location(unify_spatial_coordinates(region),
+                                    location)
+        self.assertEqual(result.shape, expected.shape)
+        np.testing.assert_array_equal(result.data, expected.data)
+        np.testing.assert_array_equal(result.coord('time').points,
+                                      expected.coord('time').points)
+
+    def test_point_case(self):
+        """
+        Tests a point is loaded as a single cell
+        """
+        self.assert_same_as_full_load([51.5, 359.9], (1, 1))
+
+    def test_area_case(self):
+        """
+        Tests an area crossing 0 degrees longitude is loaded as its cells
+        """
+        self.assert_same_as_full_load([30., 60., -20., 20.], (3, 4))
+
+    def test_points_case(self):
+        """
+        Tests a list of points is loaded as the rows and columns of its cells
+        """
+        self.assert_same_as_full_load(
+            [[51.5, 359.9], [-33.9, 18.4], [40.7, 286.0]], (3, 3))
+
+    def test_series_cache_case(self):
+        """
+        Tests unified series are stored and then used without loading the
+        simulation, until its source files change
+        """
+        location = [51.5, 359.9]
+        time_constr = [1950, 1952]
+        with tempfile.TemporaryDirectory() as directory:
+            series_cache = SeriesCache(directory)
+            cube_lists = []
+            for run in range(2):
+                inputs = self.loading.SimulationsLoading(
+                    [SIMULATION[2]], [SIMULATION[0]], [SIMULATION[1]],
+                    time_constr, location, manifest={}, pool=WorkerPool(1),
+                    series_cache=series_cache)
+                cached = inputs.load_cached_series()
+                cubes = [unify_simulation(cube, location, time_constr)
+                         for cube in inputs.load_all_data()]
+                self.assertEqual((len(cached), len(cubes)), (run, 1 - run))
+                cube_lists.append(inputs.unified_series(cubes))
+            self.assertEqual(cube_lists[0], cube_lists[1])
+            self.assertEqual(cube_lists[1][0].dtype, np.float32)
+            filename = inputs.plan_data(SIMULATION)[0]
+            stat = os.stat(filename)
+            os.utime(filename, (stat.st_atime, stat.st_mtime + 1))
+            inputs = self.loading.SimulationsLoading(
+                [SIMULATION[2]], [SIMULATION[0]], [SIMULATION[1]],
+                time_constr, location, manifest={}, pool=WorkerPool(1),
+                series_cache=series_cache)
+            self.assertEqual(len(inputs.load_cached_series()), 0)
+
+    def test_series_extension_case(self):
+        """
+        Tests a cached series is extended by loading only the missing years
+        and equals the series of all the years loaded at once
+        """
+        location = [51.5, 359.9]
+        with tempfile.TemporaryDirectory() as directory:
+            series_cache = SeriesCache(directory)
+            for time_constr in [[1950, 1951], [1950, 1952]]:
+                inputs = self.loading.SimulationsLoading(
+                    [SIMULATION[2]], [SIMULATION[0]], [SIMULATION[1]],
+                    time_constr, location, manifest={}, pool=WorkerPool(1),
+                    series_cache=series_cache)
+                inputs.load_cached_series()
+                cubes = inputs.load_all_data()
+                constraints = inputs.loaded_constraints()
+                self.assertEqual(constraints, [[1950, 1951]] if
+                                 time_constr[1] == 1951 else [[1951, 1952]])
+                result = inputs.unified_series(
+                    [unify_simulation(cube, location, years)
+                     for cube, years in zip(cubes, constraints)])[0]
+            self.assertEqual(series_cache.get(inputs.series_key(0))['years'],
+                             [1950, 1952])
+        expected = unify_simulation(
+            self.loading.load_data(SIMULATION, [1950, 1952], location),
+            location, [1950, 1952])
+        self.assertEqual(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Tests for primavera_viewer.worker_pool
+"""
+import pickle
+import tempfile
+import time
+import unittest
+import iris.coords
+import iris.cube
+import numpy as np
+from primavera_viewer.worker_pool import SharedCube, WorkerPool
+
+
+def realised_cube(label, ntime=1000, nlat=10):
+    """
+    Creates a realised, partly masked daily cube of a line of latitudes.
+    """
+    data = np.ma.masked_less(
+        np.arange(ntime * nlat, dtype=np.float32).reshape(ntime, nlat) % 7, 1)
+    cube = iris.cube.Cube(data, standard_name='air_temperature', units='K')
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.arange(ntime, dtype=np.float64) + 0.5, standard_name='time',
+        units='days since 1950-01-01 00:00:00'), 0)
+    cube.add_dim_coord(iris.coords.DimCoord(
+        np.linspace(-45., 45., nlat), standard_name='latitude',
+        units='degrees'), 1)
+    cube.add_aux_coord(iris.coords.AuxCoord(label,
+                                            long_name='simulation_label',
+                                            units='no_unit'))
+    return cube
+
+
+def double(cube):
+    """
+    Stage that doubles a cube's data.
+    """
+    return cube * 2
+
+
+def timed(label):
+    """
+    Stage that sleeps and returns when it started and ended.
+    """
+    start = time.time()
+    time.sleep(0.5)
+    return label, start, time.time()
+
+
+class TestSharedCube(unittest.TestCase):
+
+    def test_round_trip_case(self):
+        """
+        Tests a shared cube is restored unchanged from its mapped files
+        without its data being pickled
+        """
+        cube = realised_cube('a')
+        with tempfile.TemporaryDirectory() as directory:
+            shared = SharedCube(cube, directory)
+            self.assertLess(len(pickle.dumps(shared)), cube.data.nbytes)
+            result = pickle.loads(pickle.dumps(shared)).restore()
+        self.assertIsInstance(np.ma.getdata(result.data), np.memmap)
+        np.testing.assert_array_equal(result.data, cube.data)
+        np.testing.assert_array_equal(np.ma.getmaskarray(result.data),
+                                      np.ma.getmaskarray(cube.data))
+        self.assertEqual(result, cube)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_shared_map_case(self):
+        """
+        Tests mapping over workers through shared files gives the same cubes
+        as pickling them, in the same order
+        """
+        cubes = [realised_cube(label) for label in 'abc']
+        pool = WorkerPool(2, min_shared_bytes=0)
+        try:
+            shared = pool.map(double, cubes)
+            pool.set_min_shared_bytes(None)
+            pickled = pool.map(double, cubes)
+        finally:
+            pool.shutdown()
+        for result, expected in zip(shared, pickled):
+            self.assertEqual(result, expected)
+            np.testing.assert_array_equal(np.ma.getmaskarray(result.data),
+                                          np.ma.getmaskarray(expected.data))
+
+    def test_memory_budget_case(self):
+        """
+        Tests the largest item starts first and items only run together while
+        their sizes fit within the memory budget, results keeping the order
+        of the items
+        """
+        pool = WorkerPool(2, max_memory=100)
+        try:
+            # start the workers so that their start up is not timed
+            pool.map(timed, ['x', 'y'])
+            results = pool.map(timed, ['a', 'b', 'c'], sizes=[30, 80, 60])
+        finally:
+            pool.shutdown()
+        self.assertEqual([label for label, start, end in results],
+                         ['a', 'b', 'c'])
+        (_, a_start, a_end), (_, b_start, b_end), (_, c_start, c_end) = \
+            results
+        # 'b' runs alone, then 'c' and 'a' together
+        self.assertLessEqual(b_end, min(a_start, c_start))
+        self.assertLess(max(a_start, c_start), min(a_end, c_end))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,370 @@
+"""
+worker_pool.py
+==============
+
+Module for the pool of worker processes shared by every parallel stage of the
+primavera-viewer tool.
+
+A single executor with a bounded number of workers is created on first use and
+reused for loading, unifying and analysing every simulation, rather than a
+manager server and one process per simulation being started for each stage.
+Stage functions are module level functions of a single simulation so that only
+the simulation's data and the arguments the stage needs are sent to a worker.
+
+Workers are started with the 'forkserver' method where available ('spawn'
+otherwise) because forking a process that has already run dask's thread pool
+can deadlock the child.
+
+The data arrays of realised cubes sent to or returned from a worker are written
+once to a memory-mapped file, in shared memory ('/dev/shm') where available,
+and only the cube's metadata is pickled. The receiving process maps the file
+rather than unpickling a copy of the array.
+
+A pool given a 'Profiler' records the resources used by every call of a stage
+function, in whichever process runs it.
+
+Items are started largest first, no more at once than there are workers. A
+pool given a memory budget only starts an item while the estimated sizes of
+the items running, including it, fit within the budget; an item larger than
+the budget runs on its own. The size of a cube is that of its data, and the
+size of other items, e.g. the files of a simulation to load, is given to
+'map' by the caller.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from primavera_viewer.profiler import ProfiledStage
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(log_level):
+    """
+    Configures logging in a worker that does not inherit the parent's
+    handlers, e.g. when processes are spawned rather than forked.
+    """
+    logging.basicConfig(level=log_level, format='%(levelname)s: %(message)s')
+
+
+def get_context():
+    """
+    Returns the multiprocessing context used to start workers.
+
+    :return multiprocessing.context.BaseContext: 'forkserver' context if
+    supported by the platform, otherwise 'spawn'
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # workers are forked from a server that has imported iris once
+        context.set_forkserver_preload(['iris', 'primavera_viewer.sim_format'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def shared_directory():
+    """
+    Creates a directory for the memory-mapped data of one call to 'map'.
+
+    :return str: Path of the new directory
+    """
+    shm = '/dev/shm'
+    return tempfile.mkdtemp(prefix='primavera_viewer_',
+                            dir=shm if os.path.isdir(shm) else None)
+
+
+class SharedCube:
+    """
+    Class defined by a realised cube whose data array is written to memory-
+    mapped files in a directory. Pickling the instance only pickles the cube's
+    metadata, and 'restore' maps the data back without reading a copy of it.
+
+    Example:
+    SharedCube(cube = iris.cube.Cube, directory = '/dev/shm/primavera_viewer_x')
+    """
+    def __init__(self, cube, directory):
+        """
+        Initialise the class and write the cube's data.
+
+        :param iris.cube.Cube cube: Cube with realised data
+        :param str directory: Directory to write the data to
+        """
+        import dask.array as da
+        data = cube.data
+        self.filename = os.path.join(directory, uuid.uuid4().hex)
+        np.save(self.filename + '.data.npy', np.ma.getdata(data))
+        self.masked = np.ma.isMaskedArray(data)
+        self.fill_value = data.fill_value if self.masked else None
+        if self.masked:
+            np.save(self.filename + '.mask.npy', np.ma.getmaskarray(data))
+        # a lazy placeholder of the right shape is pickled in place of the data
+        self.cube = cube.copy(data=da.zeros(data.shape, dtype=data.dtype,
+                                            chunks=-1))
+
+    def __repr__(self):
+        return 'SharedCube: {filename}'.format(filename=self.filename)
+
+    def __str__(self):
+        return '{cube} in {filename}'.format(cube=self.cube.summary(True),
+                                             filename=self.filename)
+
+    def restore(self):
+        """
+        Maps the shared data back into the cube. The arrays are copy-on-write
+        so that changing them does not change the files.
+
+        :return iris.cube.Cube: The cube with realised data
+        """
+        data = np.load(self.filename + '.data.npy', mmap_mode='c')
+        if self.masked:
+            mask = np.load(self.filename + '.mask.npy', mmap_mode='c')
+            data = np.ma.MaskedArray(data, mask=mask,
+                                     fill_value=self.fill_value)
+        self.cube.data = data
+        return self.cube
+
+
+def share(item, directory, min_bytes):
+    """
+    Wraps a realised cube at least 'min_bytes' in size as a SharedCube. The
+    cubes of a tuple are wrapped in turn and other items are returned
+    unchanged.
+    """
+    import iris.cube
+    if isinstance(item, tuple):
+        return tuple(share(element, directory, min_bytes)
+                     for element in item)
+    if (isinstance(item, iris.cube.Cube) and not item.has_lazy_data() and
+            item.core_data().nbytes >= min_bytes):
+        return SharedCube(item, directory)
+    return item
+
+
+def item_nbytes(item):
+    """
+    Returns the size of the data of a cube, lazy or realised, or the total
+    size of the cubes of a tuple. Other items have no size.
+    """
+    import iris.cube
+    if isinstance(item, tuple):
+        return sum(item_nbytes(element) for element in item)
+    if isinstance(item, iris.cube.Cube):
+        return item.core_data().nbytes
+    return 0
+
+
+def unshare(item):
+    """
+    Restores the cube of a SharedCube, or the cubes of a tuple. Other items
+    are returned unchanged.
+    """
+    if isinstance(item, tuple):
+        return tuple(unshare(element) for element in item)
+    if isinstance(item, SharedCube):
+        return item.restore()
+    return item
+
+
+def _run_shared(item, func, directory, min_bytes, *args):
+    """
+    Calls a stage function in a worker, mapping a shared input cube and
+    sharing a realised result cube.
+    """
+    result = func(unshare(item), *args)
+    return share(result, directory, min_bytes)
+
+
+class WorkerPool:
+    """
+    Class defined by the maximum number of worker processes and an optional
+    memory budget. A stage function is applied to each simulation with 'map'.
+    With a single worker, or a single simulation, the stage runs in this
+    process and nothing is pickled.
+
+    Example:
+    WorkerPool(workers = 4, min_shared_bytes = 1048576, profiler = None,
+               max_memory = 8 * 1024 ** 3)
+    """
+    def __init__(self, workers=None, min_shared_bytes=2 ** 20, profiler=None,
+                 max_memory=None):
+        """
+        Initialise the class. The worker processes are started on first use.
+
+        :param int workers: Maximum number of worker processes. Defaults to
+        the number of CPUs
+        :param int min_shared_bytes: Size from which the data of realised
+        cubes is passed through memory-mapped files rather than pickled. None
+        pickles all data
+        :param Profiler profiler: Optional, profiler to record every call of a
+        stage function with
+        :param int max_memory: Optional, maximum total estimated size in bytes
+        of the items running at once. Unlimited if not given
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.min_shared_bytes = min_shared_bytes
+        self.profiler = profiler
+        self.max_memory = max_memory
+        self._executor = None
+
+    def __repr__(self):
+        return 'WorkerPool: {workers}, {max_memory}'.format(
+            workers=self.workers, max_memory=self.max_memory)
+
+    def __str__(self):
+        if self.max_memory is None:
+            return '{workers} workers'.format(workers=self.workers)
+        return '{workers} workers, {max_memory} bytes'.format(
+            workers=self.workers, max_memory=self.max_memory)
+
+    def __getstate__(self):
+        # the executor and profiler belong to the process that created them
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['profiler'] = None
+        return state
+
+    def set_workers(self, workers):
+        self.shutdown()
+        self.workers = workers
+
+    def set_min_shared_bytes(self, min_shared_bytes):
+        self.min_shared_bytes = min_shared_bytes
+
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+
+    def set_max_memory(self, max_memory):
+        self.max_memory = max_memory
+
+    def executor(self):
+        """
+        Returns the pool's executor, starting the worker processes if they
+        are not already running.
+
+        :return concurrent.futures.ProcessPoolExecutor: The executor
+        """
+        if self._executor is None:
+            logger.debug('Starting {} worker processes'.format(self.workers))
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=get_context(),
+                initializer=_init_worker,
+                initargs=(logging.getLogger().getEffectiveLevel(),))
+        return self._executor
+
+    def map(self, func, items, *args, sizes=None):
+        """
+        Applies a stage function to each item in parallel.
+
+        :param func: Module level function called as func(item, *args)
+        :param list items: Items to process, e.g. one cube per simulation
+        :param args: Further arguments passed unchanged to every call
+        :param list sizes: Optional, estimated memory in bytes needed by each
+        item, e.g. the size of the data a simulation loads. The size of the
+        cubes of each item is used if not given
+        :return list: The results in the same order as the items
+        """
+        if self.profiler is not None:
+            results = self._map(ProfiledStage(func), items, *args,
+                                sizes=sizes)
+            self.profiler.add_records(record for result, record in results)
+            return [result for result, record in results]
+        return self._map(func, items, *args, sizes=sizes)
+
+    def _map(self, func, items, *args, sizes=None):
+        items = list(items)
+        if self.workers == 1 or len(items) <= 1:
+            return [func(item, *args) for item in items]
+        if sizes is None:
+            sizes = [item_nbytes(item) for item in items]
+        if self.min_shared_bytes is None:
+            return self._schedule(func, items, sizes, args)
+        directory = shared_directory()
+        try:
+            items = [share(item, directory, self.min_shared_bytes)
+                     for item in items]
+            results = self._schedule(
+                _run_shared, items, sizes,
+                (func, directory, self.min_shared_bytes) + args)
+            return [unshare(result) for result in results]
+        finally:
+            # mapped files stay readable after they are removed
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _schedule(self, func, items, sizes, args):
+        """
+        Runs the items in the worker processes, largest first and within the
+        memory budget.
+
+        :param func: Module level function called as func(item, *args)
+        :param list items: Items to process
+        :param list sizes: Estimated memory in bytes needed by each item
+        :param tuple args: Further arguments passed to every call
+        :return list: The results in the same order as the items
+        """
+        executor = self.executor()
+        pending = sorted(range(len(items)), key=lambda index: sizes[index],
+                         reverse=True)
+        results = [None] * len(items)
+        running = dict()
+        running_size = 0
+        while pending or running:
+            while pending and len(running) < self.workers:
+                # the largest item that fits, or the largest if none are
+                # running
+                index = next(
+                    (index for index in pending if self.max_memory is None
+                     or running_size + sizes[index] <= self.max_memory),
+                    None if running else pending[0])
+                if index is None:
+                    break
+                if self.max_memory is not None and \
+                        sizes[index] > self.max_memory:
+                    logger.warning('Estimated memory of {} bytes exceeds the '
+                                   'budget of {} bytes, running it on its '
+                                   'own'.format(sizes[index],
+                                                self.max_memory))
+                pending.remove(index)
+                running[executor.submit(func, items[index], *args)] = index
+                running_size += sizes[index]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                running_size -= sizes[index]
+                results[index] = future.result()
+        return results
+
+    def shutdown(self):
+        """
+        Stops the worker processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+_default_pool = None
+
+
+def get_default_pool():
+    """
+    Returns the pool shared by stages that are not given one, creating it with
+    a worker per CPU on first use.
+
+    :return WorkerPool: The shared pool
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = WorkerPool()
+    return _default_pool
+
+
+@atexit.register
+def _shutdown_default_pool():
+    if _default_pool is not None:
+        _default_pool.shutdown()